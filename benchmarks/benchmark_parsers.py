@@ -0,0 +1,276 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Time both parsers, the stage 1 writers and an end-to-end crawl() on synthetic workbooks from synthetic_workbooks.py,
+# check that the parsers extract exactly the generated values, and compare timings with a saved baseline.
+#
+# Every case reports its best wall time out of --repeat runs, its throughput in cells and years per second, and its
+# peak Python memory measured with tracemalloc in one more run. The end-to-end case serves the synthetic ZIP files and
+# an index page from a local HTTP server and points crawl() at it.
+#
+# Usage: benchmarks/benchmark_parsers.py [--years 1991-2023] [--varieties N] [--reader pandas] [--repeat N]
+#                                        [--save-baseline FILE] [--baseline FILE] [--tolerance 0.25]
+# e.g.
+#   benchmarks/benchmark_parsers.py --save-baseline baseline.json
+#   ... change a parser ...
+#   benchmarks/benchmark_parsers.py --baseline baseline.json
+# exits with 1 when a parser extracts something else than the generated values or a case got slower than the baseline
+# by more than the tolerance.
+
+import argparse
+import contextlib
+import functools
+import http.server
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# synthetic_workbooks puts crush_data_crawler on sys.path
+import synthetic_workbooks as synthetic
+from synthetic_workbooks import crush, acreage
+from crawler_common import create_argument_parser
+from excel_reader import READER_BACKENDS, DEFAULT_READER_BACKEND
+from stage1_writer import Stage1Writer, CSV_FORMAT, PARQUET_FORMAT
+from year_result import YearResult
+
+DEFAULT_YEARS = "1991-2023"
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.25
+CRUSH_INDEX_PATH = "Reports/index.php"
+
+
+def parse_years(years):
+    begin_year, _, end_year = years.partition("-")
+    return int(begin_year), int(end_year or begin_year)
+
+
+def same_result(actual, expected):
+    """
+    :return: True if a parser result equals the generated one, NaN values being equal to each other
+    """
+    if isinstance(expected, list):
+        return len(actual) == len(expected) and all(same_result(a, e) for a, e in zip(actual, expected))
+    if isinstance(actual, YearResult):
+        actual = actual.to_grape_data()
+    if set(actual.keys()) != set(expected.keys()):
+        return False
+    for variety, expected_values in expected.items():
+        actual_values = actual[variety]
+        if len(actual_values) != len(expected_values):
+            return False
+        for (actual_district, actual_value), (expected_district, expected_value) in zip(actual_values,
+                                                                                          expected_values):
+            if actual_district != expected_district:
+                return False
+            if not (actual_value == expected_value or (math.isnan(actual_value) and math.isnan(expected_value))):
+                return False
+    return True
+
+
+def measure(function, repeat):
+    """
+    :return: (best wall time in seconds, peak traced memory in bytes, result of the last call)
+    """
+    best_seconds = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best_seconds, peak_bytes, result
+
+
+def parse_crush_years(crush_years, reader):
+    return [(year, file_postfix, crush.extract_data_from_excel(path, file_postfix, False, reader))
+            for year, path, expected_by_postfix, _ in crush_years for file_postfix in expected_by_postfix]
+
+
+def parse_acreage_years(acreage_years, reader):
+    return [(year, acreage.extract_data_from_excel(year, path, False, reader)) for year, path, _, _ in acreage_years]
+
+
+def write_outputs(parsed_crush, output_format):
+    data_root = tempfile.mkdtemp(prefix="benchmark_writer_")
+    try:
+        writer = Stage1Writer(data_root, crush.INTERESTED_GRAPE_NAMES, crush.MAX_REGION_ID,
+                              output_format=output_format)
+        for year, file_postfix, grape_data_this_year in parsed_crush:
+            writer.write("Table{}".format(file_postfix), year, grape_data_this_year)
+    finally:
+        shutil.rmtree(data_root)
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve_crush_reports(crush_years):
+    """
+    Serve crush ZIP files the way the USDA website lists them
+    :return: URL of the index page
+    """
+    server_root = tempfile.mkdtemp(prefix="benchmark_server_")
+    links = []
+    for year, path, _, _ in crush_years:
+        relative_url = "Final/{}/gc_{}_final.zip".format(year, year)
+        os.makedirs(os.path.join(server_root, "Final", str(year)))
+        shutil.copyfile(path, os.path.join(server_root, relative_url))
+        links.append('<a href="../{}">{} Final</a>'.format(relative_url, year))
+    os.makedirs(os.path.join(server_root, os.path.dirname(CRUSH_INDEX_PATH)))
+    with open(os.path.join(server_root, CRUSH_INDEX_PATH), "w") as index_file:
+        index_file.write("<html><body>{}</body></html>".format("\n".join(links)))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                             functools.partial(QuietHandler, directory=server_root))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield "http://127.0.0.1:{}/{}".format(server.server_address[1], CRUSH_INDEX_PATH)
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(server_root)
+
+
+def crawl_end_to_end(begin_year, end_year, reader):
+    data_root = tempfile.mkdtemp(prefix="benchmark_crawl_")
+    try:
+        args = create_argument_parser("benchmark").parse_args(
+            [str(begin_year), str(end_year), data_root, "False", "--reader", reader, "--log-level", "WARNING"])
+        status = crush.crawl(crush.ALL_CRUSH_TABLES, args=args)
+        if status != 0:
+            raise RuntimeError("crawl() returned {}".format(status))
+    finally:
+        shutil.rmtree(data_root)
+
+
+def run_cases(args):
+    """
+    :return: (results, mismatches), results as {case: {seconds, peak_mb, cells, years}}
+    """
+    begin_year, end_year = parse_years(args.years)
+    corpus = tempfile.mkdtemp(prefix="benchmark_corpus_")
+    results = {}
+    mismatches = []
+    try:
+        print("Generating synthetic workbooks for {} to {} in {}".format(begin_year, end_year, corpus))
+        crush_years, acreage_years = synthetic.generate_corpus(corpus, begin_year, end_year, args.varieties)
+        crush_cells = sum(cells for _, _, _, cells in crush_years)
+        acreage_cells = sum(cells for _, _, _, cells in acreage_years)
+        cases = [
+            ("crush_parse", lambda: parse_crush_years(crush_years, args.reader), crush_cells, len(crush_years)),
+            ("acreage_parse", lambda: parse_acreage_years(acreage_years, args.reader), acreage_cells,
+             len(acreage_years)),
+        ]
+        parsed = {}
+        for name, function, cells, years in cases:
+            print("Running", name)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                seconds, peak_bytes, parsed[name] = measure(function, args.repeat)
+            results[name] = {"seconds": seconds, "peak_mb": peak_bytes / 1024 / 1024, "cells": cells, "years": years}
+        expected_crush = {(year, file_postfix): expected for year, _, expected_by_postfix, _ in crush_years
+                          for file_postfix, expected in expected_by_postfix.items()}
+        for year, file_postfix, grape_data_this_year in parsed["crush_parse"]:
+            if not same_result(grape_data_this_year, expected_crush[(year, file_postfix)]):
+                mismatches.append("crush table {} of {}".format(file_postfix, year))
+        expected_acreage = {year: expected for year, _, expected, _ in acreage_years}
+        for year, grape_acreage_data_this_year in parsed["acreage_parse"]:
+            if not same_result(grape_acreage_data_this_year, expected_acreage[year]):
+                mismatches.append("acreage of {}".format(year))
+        output_formats = [CSV_FORMAT]
+        try:
+            import pyarrow
+            output_formats.append(PARQUET_FORMAT)
+        except ImportError:
+            print("pyarrow is not installed, skipping the parquet writer")
+        cases = [("{}_writer".format(output_format),
+                  functools.partial(write_outputs, parsed["crush_parse"], output_format), crush_cells,
+                  len(crush_years))
+                 for output_format in output_formats]
+        with serve_crush_reports(crush_years) as index_url:
+            crush.USDA_NASS_CA_CRUSH_REPORT_URL = index_url
+            cases.append(("crawl_end_to_end", functools.partial(crawl_end_to_end, begin_year, end_year, args.reader),
+                          crush_cells, len(crush_years)))
+            for name, function, cells, years in cases:
+                print("Running", name)
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    seconds, peak_bytes, _ = measure(function, args.repeat)
+                results[name] = {"seconds": seconds, "peak_mb": peak_bytes / 1024 / 1024, "cells": cells,
+                                 "years": years}
+    finally:
+        shutil.rmtree(corpus)
+    return results, mismatches
+
+
+def print_results(results, baseline):
+    print("{:<20} {:>10} {:>14} {:>10} {:>10} {:>12}".format("case", "seconds", "cells/s", "years/s", "peak MB",
+                                                              "vs baseline"))
+    for name, result in results.items():
+        comparison = ""
+        if baseline is not None and name in baseline["results"]:
+            comparison = "{:+.1%}".format(result["seconds"] / baseline["results"][name]["seconds"] - 1)
+        print("{:<20} {:>10.3f} {:>14,.0f} {:>10.2f} {:>10.1f} {:>12}".format(
+            name, result["seconds"], result["cells"] / result["seconds"], result["years"] / result["seconds"],
+            result["peak_mb"], comparison))
+
+
+def regressions(results, baseline, tolerance):
+    """
+    :return: names of cases slower than in baseline by more than tolerance
+    """
+    return [name for name, result in results.items()
+            if name in baseline["results"] and result["seconds"] > baseline["results"][name]["seconds"] * (1 + tolerance)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsers and writers on synthetic USDA workbooks")
+    parser.add_argument("--years", type=str, default=DEFAULT_YEARS, help="years to generate, e.g. 1991-2023")
+    parser.add_argument("--varieties", type=int, default=synthetic.DEFAULT_FILLER_VARIETIES,
+                        help="number of varieties the parsers are not interested in added to each table")
+    parser.add_argument("--reader", choices=READER_BACKENDS, default=DEFAULT_READER_BACKEND,
+                        help="backend used to read Excel files")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs of each case")
+    parser.add_argument("--save-baseline", type=str, default=None, metavar="FILE",
+                        help="save the results as a baseline")
+    parser.add_argument("--baseline", type=str, default=None, metavar="FILE", help="compare with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="fraction a case may be slower than the baseline before it is reported as a regression")
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        settings = {"years": args.years, "varieties": args.varieties, "reader": args.reader}
+        if baseline["settings"] != settings:
+            print("Baseline was measured with {}, now running with {}".format(baseline["settings"], settings))
+    results, mismatches = run_cases(args)
+    print_results(results, baseline)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump({"settings": {"years": args.years, "varieties": args.varieties, "reader": args.reader},
+                       "results": results}, baseline_file, indent=2)
+        print("Saved baseline to", args.save_baseline)
+    for mismatch in mismatches:
+        print("MISMATCH", mismatch)
+    slower = regressions(results, baseline, args.tolerance) if baseline is not None else []
+    for name in slower:
+        print("REGRESSION {} is more than {:.0%} slower than the baseline".format(name, args.tolerance))
+    return 1 if len(mismatches) > 0 or len(slower) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Generate synthetic USDA workbooks in every layout the parsers handle, together with the values the parsers are
+# expected to extract from them, so that parsers can be checked and timed without downloading anything.
+#
+# Crush reports -> one ZIP file per year holding the *02 to *06 tables, each sheet has a title row, then either
+#   * "VARIETY" header, districts 1 to 17 and a state total column (CRUSH_VARIETY_ERA)
+#   * two "Type and Variety" headers side by side, districts 1 to 9 then 10 to 17 and the state total
+#     (CRUSH_MULTI_HEADER_ERA)
+#   * one "Type and Variety" header (CRUSH_TYPE_AND_VARIETY_ERA)
+#   some value cells are "--" (zero) or blank (NaN)
+# Acreage reports -> gabtb12 or gabtb10 (1994 and from 2022) with bearing, non-bearing and total columns for each
+# district followed by a column the parser skips, then the state total, with
+#   * "VARNAME" header and d1b1998 district headers (ACREAGE_OLD_ERA)
+#   * an empty header cell and "dist 1 2005 bearing" district headers (ACREAGE_MID_ERA)
+#   * "Type and Variety" header and "District 1" district headers (ACREAGE_NEW_ERA)
+#   as a ZIP file of single sheet workbooks, or as one workbook with a sheet per table downloaded as <year>.xls(x)
+#
+# Writing xls files needs xlwt, xlsx files are written with openpyxl.
+#
+# Usage: benchmarks/synthetic_workbooks.py <data_root> <begin_year> <end_year> [--varieties N] [--seed N]
+# writes <data_root>/CrushRaw/<year>.zip and <data_root>/AcreageRaw/<year>.<zip|xls|xlsx> the same way crawlers
+# download them, e.g. to run crush_data_crawler/reader_parity.py on them
+
+import argparse
+import importlib
+import io
+import os
+import random
+import sys
+import zipfile
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "crush_data_crawler"))
+import crush_data_crawler_lib as crush
+
+acreage = importlib.import_module("12_acreage")
+
+CRUSH_VARIETY_ERA = "variety"
+CRUSH_MULTI_HEADER_ERA = "multi_header"
+CRUSH_TYPE_AND_VARIETY_ERA = "type_and_variety"
+ACREAGE_OLD_ERA = "old"
+ACREAGE_MID_ERA = "mid"
+ACREAGE_NEW_ERA = "new"
+
+ZIP_LAYOUT = "zip"
+MULTI_SHEET_LAYOUT = "multi_sheet"
+
+NUM_DISTRICTS = 17
+DEFAULT_FILLER_VARIETIES = 40
+DEFAULT_SEED = 2022
+# Varieties the parsers are not interested in, numbered once the list runs out
+FILLER_VARIETY_NAMES = [
+    "Alicante Bouschet", "Carignane", "Mourvedre", "Sangiovese", "Tempranillo", "Viognier", "Semillon",
+    "Gewurztraminer", "Thompson Seedless", "Flame Seedless", "Aleatico", "Dolcetto", "Nebbiolo", "Mission",
+    "Palomino", "Tannat", "Vermentino", "Verdelho", "Lagrein", "Touriga Nacional",
+]
+# Tables of a crush report with the range of their values
+CRUSH_TABLE_VALUE_RANGES = {
+    crush.VOLUME_TABLE.file_postfix: (0.0, 400000.0),
+    crush.DEGREE_BRIX_TABLE.file_postfix: (18.0, 27.0),
+    crush.PURCHASED_VOLUME_TABLE.file_postfix: (0.0, 300000.0),
+    crush.PURCHASED_DEGREE_BRIX_TABLE.file_postfix: (18.0, 27.0),
+    crush.PRICE_TABLE.file_postfix: (150.0, 8000.0),
+}
+
+
+def crush_era(year):
+    if year < 2000:
+        return CRUSH_VARIETY_ERA
+    if year < 2010:
+        return CRUSH_MULTI_HEADER_ERA
+    return CRUSH_TYPE_AND_VARIETY_ERA
+
+
+def acreage_era(year):
+    if year <= 2000:
+        return ACREAGE_OLD_ERA
+    if year <= 2011:
+        return ACREAGE_MID_ERA
+    return ACREAGE_NEW_ERA
+
+
+def acreage_layout(year):
+    if 2016 <= year <= 2019 or (year >= 2020 and year % 2 == 1):
+        return MULTI_SHEET_LAYOUT
+    return ZIP_LAYOUT
+
+
+def default_extension(year):
+    """
+    :return: xls for older years when xlwt is installed, xlsx otherwise
+    """
+    try:
+        import xlwt
+    except ImportError:
+        return "xlsx"
+    return "xls" if year < 2013 else "xlsx"
+
+
+def acreage_pattern(year):
+    return "gabtb10" if year == 1994 or year >= 2022 else "gabtb12"
+
+
+def variety_rows(interested_names, num_filler_varieties, rng):
+    """
+    :param interested_names: lowercase interested names of a parser
+    :return: list of (cell text, interested name or None), with section titles as (text, None) rows without values
+    """
+    rows = [("WINE GRAPES", None)]
+    fillers = [FILLER_VARIETY_NAMES[i % len(FILLER_VARIETY_NAMES)] + ("" if i < len(FILLER_VARIETY_NAMES)
+                                                                      else " {}".format(i))
+               for i in range(num_filler_varieties)]
+    names = [name for name in interested_names if not name.startswith("total")]
+    cells = [(name.title(), name) for name in names] + [(filler, None) for filler in fillers]
+    rng.shuffle(cells)
+    # footnote marks are ignored by the parsers
+    cells = [(cell + " 1/", name) if name is not None and rng.random() < 0.1 else (cell, name) for cell, name in cells]
+    rows.extend(cells)
+    rows.append(("TOTALS", None))
+    rows.extend((name.title(), name) for name in interested_names if name.startswith("total"))
+    return rows
+
+
+def crush_value_cell(value_range, rng):
+    """
+    :return: (cell, value the crush parser reads from it)
+    """
+    draw = rng.random()
+    if draw < 0.05:
+        return "--", 0.0
+    if draw < 0.1:
+        return None, float("nan")
+    value = round(rng.uniform(*value_range), 1)
+    return value, value
+
+
+def crush_table_rows(year, file_postfix, num_filler_varieties=DEFAULT_FILLER_VARIETIES, era=None, rng=None):
+    """
+    :return: (rows, expected), rows of cell values of the sheet, expected as returned by
+    crush_data_crawler_lib.extract_data_from_excel
+    """
+    era = crush_era(year) if era is None else era
+    rng = random.Random(year) if rng is None else rng
+    value_range = CRUSH_TABLE_VALUE_RANGES[file_postfix]
+    header = crush.VARIETY if era == CRUSH_VARIETY_ERA else crush.TYPE_AND_VARIETY
+    districts = list(range(1, NUM_DISTRICTS + 1))
+    blocks = [districts[:9], districts[9:]] if era == CRUSH_MULTI_HEADER_ERA else [districts]
+    varieties = variety_rows(crush.INTERESTED_GRAPE_NAMES.keys(), num_filler_varieties, rng)
+    rows = [["Table {}. Grapes crushed by type and district, {} crop".format(int(file_postfix), year)],
+            []]
+    expected = defaultdict(list)
+    for block_index, block in enumerate(blocks):
+        is_last_block = block_index == len(blocks) - 1
+        rows[1].extend([header] + block + (["State Total"] if is_last_block else []))
+        for row_index, (cell, name) in enumerate(varieties, start=2):
+            if len(rows) <= row_index:
+                rows.append([])
+            rows[row_index].append(cell)
+            if cell.isupper():
+                rows[row_index].extend([None] * (len(block) + (1 if is_last_block else 0)))
+                continue
+            regions = block + ([crush.MAX_REGION_ID] if is_last_block else [])
+            for region_id in regions:
+                value_cell, value = crush_value_cell(value_range, rng)
+                rows[row_index].append(value_cell)
+                if name is not None:
+                    expected[name].append((region_id, value))
+    rows.append([])
+    rows.append(["Source: synthetic grape crush report generated by benchmarks/synthetic_workbooks.py"])
+    for name in expected:
+        expected[name].sort(key=lambda x: x[0])
+    return rows, expected
+
+
+def acreage_district_headers(era, year, district):
+    """
+    :return: headers of the bearing, non-bearing, total and skipped columns of a district, None for the state total
+    """
+    if era == ACREAGE_OLD_ERA:
+        if district is None:
+            return ["dstb{}".format(year), "dstn{}".format(year), "dstt{}".format(year)]
+        return ["d{}b{}".format(district, year), "d{}n{}".format(district, year), "d{}t{}".format(district, year),
+                None]
+    if era == ACREAGE_MID_ERA:
+        if district is None:
+            return ["State Total Bearing", "State Total Nonbearing", "State Total Total"]
+        # the skipped column needs a header too, an empty cell left of a district header starts a new table
+        return ["Dist {} {} bearing".format(district, year), "Dist {} {} nonbearing".format(district, year),
+                "Dist {} {} total".format(district, year), "Dist {} {} change".format(district, year)]
+    if district is None:
+        return ["State Total", None, None]
+    return ["District {}".format(district), None, None, None]
+
+
+def acreage_table_rows(year, num_filler_varieties=DEFAULT_FILLER_VARIETIES, era=None, rng=None):
+    """
+    :return: (rows, expected), rows of cell values of the sheet, expected as returned by
+    12_acreage.extract_data_from_excel
+    """
+    era = acreage_era(year) if era is None else era
+    rng = random.Random(year) if rng is None else rng
+    header = {ACREAGE_OLD_ERA: acreage.OLD_HEADER, ACREAGE_MID_ERA: None, ACREAGE_NEW_ERA: acreage.NEW_HEADER}[era]
+    header_row = [header]
+    districts = list(range(1, NUM_DISTRICTS + 1)) + [None]
+    for district in districts:
+        header_row.extend(acreage_district_headers(era, year, district))
+    rows = [["Table {}. Grape acreage by type and district, {}".format(int(acreage_pattern(year)[-2:]), year)],
+            header_row]
+    expected = [defaultdict(list), defaultdict(list), defaultdict(list)]
+    for cell, name in variety_rows(acreage.INTERESTED_GRAPE_NAMES.keys(), num_filler_varieties, rng):
+        row = [cell]
+        rows.append(row)
+        if cell.isupper():
+            continue
+        for district in districts:
+            bearing = float(rng.randint(0, 20000))
+            non_bearing = float(rng.randint(0, 2000))
+            row.extend([bearing, non_bearing, bearing + non_bearing])
+            if district is not None:
+                row.append(round(rng.uniform(-10.0, 10.0), 1))
+            if name is not None:
+                district_id = acreage.TOTAL_DISTRICT_ID if district is None else district
+                for type_index, value in enumerate([bearing, non_bearing, bearing + non_bearing]):
+                    expected[type_index][name].append((district_id, value))
+    rows.append([])
+    rows.append(["Source: synthetic grape acreage report generated by benchmarks/synthetic_workbooks.py"])
+    for type_data in expected:
+        for name in type_data:
+            type_data[name].sort(key=lambda x: x[0])
+    return rows, expected
+
+
+def count_cells(rows):
+    return len(rows) * max(len(row) for row in rows)
+
+
+def write_workbook(target, extension, sheets):
+    """
+    :param target: file name or file object
+    :param sheets: list of (sheet name, rows), None cells are left empty
+    """
+    if extension == "xls":
+        import xlwt
+        workbook = xlwt.Workbook()
+        for sheet_name, rows in sheets:
+            worksheet = workbook.add_sheet(sheet_name)
+            for row_index, row in enumerate(rows):
+                for col_index, value in enumerate(row):
+                    if value is not None:
+                        worksheet.write(row_index, col_index, value)
+        workbook.save(target)
+        return
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheet_name, rows in sheets:
+        worksheet = workbook.create_sheet(sheet_name)
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(target)
+
+
+def workbook_bytes(extension, sheets):
+    output = io.BytesIO()
+    write_workbook(output, extension, sheets)
+    return output.getvalue()
+
+
+def write_crush_year(directory, year, num_filler_varieties=DEFAULT_FILLER_VARIETIES, extension=None, seed=DEFAULT_SEED,
+                     leading_blank_rows=0):
+    """
+    :param leading_blank_rows: number of blank rows above the title row of every sheet
+    :return: (path of the ZIP file, {file postfix: expected}, number of cells in the parsed sheets)
+    """
+    extension = default_extension(year) if extension is None else extension
+    rng = random.Random(seed * 10000 + year)
+    filename = os.path.join(directory, "{}.zip".format(year))
+    expected_by_postfix = {}
+    cells = 0
+    with zipfile.ZipFile(filename, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for file_postfix in CRUSH_TABLE_VALUE_RANGES:
+            rows, expected = crush_table_rows(year, file_postfix, num_filler_varieties, rng=rng)
+            rows = [[] for _ in range(leading_blank_rows)] + rows
+            zip_file.writestr("gcbtb{}.{}".format(file_postfix, extension),
+                              workbook_bytes(extension, [("Sheet1", rows)]))
+            expected_by_postfix[file_postfix] = expected
+            cells += count_cells(rows)
+        zip_file.writestr("readme.txt", "Synthetic grape crush report {}\n".format(year))
+    return filename, expected_by_postfix, cells
+
+
+def write_acreage_year(directory, year, num_filler_varieties=DEFAULT_FILLER_VARIETIES, extension=None, layout=None,
+                       seed=DEFAULT_SEED, leading_blank_rows=0):
+    """
+    :param leading_blank_rows: number of blank rows above the title row of the acreage sheet
+    :return: (path of the ZIP or Excel file, expected, number of cells in the parsed sheet)
+    """
+    extension = default_extension(year) if extension is None else extension
+    layout = acreage_layout(year) if layout is None else layout
+    rng = random.Random(seed * 10000 + year)
+    pattern = acreage_pattern(year)
+    rows, expected = acreage_table_rows(year, num_filler_varieties, rng=rng)
+    rows = [[] for _ in range(leading_blank_rows)] + rows
+    other_table = [["Table of another report, {}".format(year)], ["Not a grape acreage table"]]
+    if layout == MULTI_SHEET_LAYOUT:
+        filename = os.path.join(directory, "{}.{}".format(year, extension))
+        sheets = [(table, rows if table == pattern else other_table) for table in ["gabtb10", "gabtb11", "gabtb12"]]
+        write_workbook(filename, extension, sheets)
+    else:
+        filename = os.path.join(directory, "{}.zip".format(year))
+        with zipfile.ZipFile(filename, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr("{}{}.{}".format(year, pattern, extension), workbook_bytes(extension, [("Sheet1", rows)]))
+            zip_file.writestr("{}gabtb01.{}".format(year, extension), workbook_bytes(extension, [("Sheet1", other_table)]))
+    return filename, expected, count_cells(rows)
+
+
+def generate_corpus(data_root, begin_year, end_year, num_filler_varieties=DEFAULT_FILLER_VARIETIES,
+                    seed=DEFAULT_SEED):
+    """
+    Write crush reports of begin_year to end_year into <data_root>/CrushRaw and acreage reports from 1994 into
+    <data_root>/AcreageRaw
+    :return: (crush, acreage), lists of (year, path, expected, cells)
+    """
+    crush_dir = os.path.join(data_root, crush.ALL_CRUSH_TABLES_RAW_DATA_DIR)
+    acreage_dir = os.path.join(data_root, "AcreageRaw")
+    os.makedirs(crush_dir, exist_ok=True)
+    os.makedirs(acreage_dir, exist_ok=True)
+    crush_years = []
+    acreage_years = []
+    for year in range(begin_year, end_year + 1):
+        crush_years.append((year,) + write_crush_year(crush_dir, year, num_filler_varieties, seed=seed))
+        if year >= 1994:
+            acreage_years.append((year,) + write_acreage_year(acreage_dir, year, num_filler_varieties, seed=seed))
+    return crush_years, acreage_years
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic USDA crush and acreage reports")
+    parser.add_argument("data_root", type=str, help="CrushRaw and AcreageRaw are written under it")
+    parser.add_argument("begin_year", type=int, help="first year in YYYY")
+    parser.add_argument("end_year", type=int, help="last year in YYYY")
+    parser.add_argument("--varieties", type=int, default=DEFAULT_FILLER_VARIETIES,
+                        help="number of varieties the parsers are not interested in added to each table")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="seed of the generated values")
+    args = parser.parse_args()
+    crush_years, acreage_years = generate_corpus(args.data_root, args.begin_year, args.end_year, args.varieties,
+                                                 args.seed)
+    for year, path, _, cells in crush_years + acreage_years:
+        print("Wrote {} with {} cells".format(path, cells))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
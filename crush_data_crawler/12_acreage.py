@@ -3,21 +3,46 @@
 
 import pathlib
 import shutil
-import sys
 import requests
 from bs4 import BeautifulSoup
 import re
 from urllib.parse import urljoin
 from collections import defaultdict
 from collections import OrderedDict
+import logging
 import os
 import zipfile
-import csv
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from crawler_common import create_argument_parser, map_years_in_order, iterate_years_in_order, create_instrumentation, \
+    SKIP_DOWNLOAD_TRUE, REFRESH
+from downloader import create_session, refresh_file, run_concurrently, load_download_state, save_download_state
+from archive_reader import list_excel_files, open_excel_file
+from excel_reader import open_workbook, DEFAULT_READER_BACKEND
+from sheet_scanner import normalize_cells, column_major_locations, cells_equal_after_strip, cells_matching
+from variety_matcher import compile_variety_matcher, match_varieties, rows_with_values
+from stage1_writer import Stage1Writer
+from shards import in_shard, record_shard
+from sqlite_warehouse import SQLiteWarehouse, year_result_observations
+from year_result import YearResult
+from cell_values import coerce_cells, acreage_cell_value
+from layout_plans import LayoutPlans, sheet_fingerprint, header_row_labels, find_or_plan
+from parse_cache import ParseCache, parse_with_cache, source_sha256
+from build_manifest import BuildManifest
+from blob_store import BlobStore
+from pipeline import run_pipeline
+from instrumentation import configure_logging, measured_call, path_size
+
+logger = logging.getLogger(__name__)
 
 USDA_NASS_CA_ACREAGE_REPORT_URL = "https://www.nass.usda.gov/Statistics_by_State/California/Publications/Specialty_and_Other_Releases/Grapes/Acreage/Reports/"
 
+# Bump whenever extract_data_from_excel returns something different for the same Excel file, so that results cached
+# by parse_cache.py are parsed again
+PARSER_VERSION = 3
+# Parser name in parse cache keys and layout plan fingerprints
+PARSER_NAME = "acreage"
 MAX_DISTRICT_ID = 17
 TOTAL_DISTRICT_ID = 100
 NEW_HEADER = "Type and Variety"
@@ -29,6 +54,9 @@ MID_DISTRICT_REGEX = r"dist\s+(?P<district>\d+)\s+\d+\s+[a-z]+"
 OLD_HEADER = "VARNAME"
 OLD_DISTRICT_REGEX = r"d(?P<district>[0-9]+)(?P<type>[a-z]+)(?P<year>[0-9]+)"
 
+# District header regexes of every era, compiled once and tried in this order
+DISTRICT_REGEXES = [re.compile(NEW_DISTRICT_REGEX), re.compile(MID_DISTRICT_REGEX), re.compile(OLD_DISTRICT_REGEX)]
+
 BEARING_INDEX = 0
 NON_BEARING_INDEX = 1
 TOTAL_INDEX = 2
@@ -68,11 +96,12 @@ INTERESTED_GRAPE_NAMES = OrderedDict({
     "Total Table": "NA",
 })
 INTERESTED_GRAPE_NAMES = {k.lower(): v.lower() for k, v in INTERESTED_GRAPE_NAMES.items()}
+INTERESTED_GRAPE_NAME_MATCHER = compile_variety_matcher(INTERESTED_GRAPE_NAMES.keys())
 
 
-def get_all_zip_file_paths(url_containing_zips):
+def get_all_zip_file_paths(url_containing_zips, session=requests):
     # print(zips_page)
-    zips_source = requests.get(url_containing_zips).text
+    zips_source = session.get(url_containing_zips).text
     zip_soup = BeautifulSoup(zips_source, "html.parser")
     # in year -> (type, url) format
     zip_url_dict = defaultdict(str)
@@ -101,154 +130,221 @@ def get_all_zip_file_paths(url_containing_zips):
         year = current_year
         current_year = None
         zip_url = urljoin(url_containing_zips, zip_relative_url)
-        print('found_zip_file_path:[{}]year={},url={}'.format(zip_file_clickable_button.text, year, zip_url))
+        logger.debug("found_zip_file_path:[%s]year=%s,url=%s", zip_file_clickable_button.text, year, zip_url)
         zip_url_dict[year] = zip_url
 
     return zip_url_dict
 
 
-def download_file(target_path, year, url, extension, skip_download=False):
+def download_file(target_path, year, url, extension, skip_download=False, session=None, previous_state=None,
+                  blob_store=None):
+    """
+    :param previous_state: download state of this year's file saved by a previous run, when given the file is only
+    downloaded again if it changed on the USDA website
+    :param blob_store: BlobStore the file is kept in and linked from, None to download it into target_path
+    :return: (filename, changed, state), changed is False if the file is the same as described by previous_state
+    """
     filename = os.path.join(target_path, "{}.{}".format(year, extension))
     if skip_download:
-        return filename
-    r = requests.get(url)
-    with open(filename, 'wb') as zipFile:
-        zipFile.write(r.content)
-    return filename
+        return filename, True, previous_state
+    if session is None:
+        session = create_session()
+    if blob_store is not None:
+        changed, state = blob_store.refresh_file(session, url, filename, previous_state=previous_state)
+    else:
+        changed, state = refresh_file(session, url, filename, previous_state=previous_state)
+    logger.info("%s %s", "Downloaded..." if changed else "Unchanged...", filename)
+    return filename, changed, state
 
 
-def unzip_files(unzip_target_directory, path_to_zip_file):
+def unzip_files(unzip_target_directory, path_to_zip_file, blob_store=None):
+    if blob_store is not None:
+        return blob_store.extract_zip(path_to_zip_file, unzip_target_directory)
     with zipfile.ZipFile(path_to_zip_file, 'r') as zip_ref:
         zip_ref.extractall(unzip_target_directory)
     return unzip_target_directory
 
 
-def flatten_sheets_from_excel(source_path, destination_path):
-    all_files = [f for f in os.listdir(source_path) if os.path.isfile(os.path.join(source_path, f))]
-    all_excel_files = [f for f in all_files if (f.lower().endswith("xls") or f.lower().endswith("xlsx"))]
-    for excel_file in all_excel_files:
-        extension = pathlib.Path(excel_file).suffix.strip(". ").lower()
-        full_excel_path = os.path.join(source_path, excel_file)
-        engine = None
-        if extension == 'xlsx':
-            engine = "openpyxl"
-        elif extension == 'xls':
-            engine = "xlrd"
-        xl = pd.ExcelFile(full_excel_path, engine=engine)
+def open_sheets_from_excel(source_path, reader=DEFAULT_READER_BACKEND):
+    """
+    List sheets of every Excel file in source_path, treating each sheet of a multi-sheet file as a file of its own
+    :param source_path: this year's ZIP or Excel file, or the directory the ZIP file was extracted to
+    :param reader: Excel reader backend, one of excel_reader.READER_BACKENDS
+    :return: dict of file name -> (workbook, sheet), a single sheet file keeps its own name and its first sheet,
+    each sheet of a multi-sheet file is named <sheet>.xlsx
+    """
+    sheets = OrderedDict()
+    for excel_file in list_excel_files(source_path):
+        xl = open_workbook(open_excel_file(source_path, excel_file), excel_file, backend=reader)
         if len(xl.sheet_names) == 1 or xl.sheet_names[0].strip().lower().replace(" ", "") == "sheet1":
-            destination_file = os.path.join(destination_path, excel_file)
-            print("Copying file from {} to {}".format(full_excel_path, destination_file))
-            shutil.copyfile(full_excel_path, destination_file)
+            sheets[excel_file] = (xl, 0)
             continue
         for sheet in xl.sheet_names:
-            # Force output extension to xlsx to be compatible with latest pandas release
-            destination_file = os.path.join(destination_path, "{}.{}".format(sheet, "xlsx"))
-            # print("Extracting file from {} to {}".format(full_excel_path, destination_file))
-            df = pd.read_excel(xl, sheet_name=sheet)
-            df.to_excel(destination_file, index=False)
+            sheets["{}.{}".format(sheet, "xlsx")] = (xl, sheet)
+    return sheets
+
+
+def flatten_sheets_from_excel(source_path, destination_path, reader=DEFAULT_READER_BACKEND):
+    """
+    Dump every sheet listed by open_sheets_from_excel into destination_path as its own xlsx file, for debugging only
+    """
+    for sheet_file, (xl, sheet) in open_sheets_from_excel(source_path, reader=reader).items():
+        # Force output extension to xlsx to be compatible with latest pandas release
+        destination_file = os.path.join(destination_path, "{}.{}".format(Path(sheet_file).stem, "xlsx"))
+        logger.debug("Writing sheet %s to %s", sheet_file, destination_file)
+        pd.DataFrame(xl.read_grid(sheet)).to_excel(destination_file, index=False, header=False)
+
+
+def find_layout(grid, full_path):
+    """
+    Scan a sheet for its headers and the district and acreage type of every column right of them
+    :return: extraction plan of the sheet, see layout_plans.py
+    """
+    num_rows, num_cols = grid.shape
+    # find where are the type and variety headers
+    # lowercase string of every cell, computed once for all the scanning below
+    cells = normalize_cells(grid)
+    header_mask = cells_equal_after_strip(cells, [NEW_HEADER.lower(), OLD_HEADER.lower()])
+    mid_district_mask = cells_matching(cells, MID_DISTRICT_REGEX) & ~header_mask
+    # a district header of the mid era layout has an empty cell on its left, which is where variety names are
+    mid_district_mask[:, 0] = False
+    header_locations = []
+    for row, col in column_major_locations(header_mask | mid_district_mask):
+        if header_mask[row, col]:
+            header_locations.append((cells[row, col].strip(), row, col))
+            continue
+        previous_cell = grid[row, col-1].strip()
+        # print("matched at {},{}, previous cell {}".format(row, col, previous_cell))
+        if previous_cell == "nan" or len(previous_cell) == 0:
+            header_locations.append((MID_HEADER, row, col-1))
+    # make sure we found something
+    if len(header_locations) == 0:
+        raise RuntimeError("Did not find header location in {}".format(full_path))
+    headers = []
+    for header, row_header, col_header in header_locations:
+        headers.append({"header": header, "row": row_header, "col": col_header,
+                        "labels": header_row_labels(grid, row_header, col_header, num_cols),
+                        "columns": decode_district_columns(grid[row_header, col_header + 1:].tolist(),
+                                                           col_header + 1)})
+    return {"headers": headers}
+
+
+def decode_district_columns(header_cells, first_col):
+    """
+    Decode once for all variety rows of a header which district and acreage type each column right of it holds
+    :param header_cells: cells of the header row right of the header cell
+    :param first_col: column of header_cells[0]
+    :return: [[column, district id, type index]], district id and type index None for columns expected to be empty,
+    the total column following each total acreage column is left out
+    """
+    columns = []
+    district_id = None
+    type_index = 0
+    skip = False
+    for col_acreage, district_value in enumerate(header_cells, first_col):
+        # skip the total column
+        if skip:
+            skip = False
+            continue
+        district_value = district_value.strip().lower()
+        district_matched = None
+        for district_regex in DISTRICT_REGEXES:
+            district_matched = district_regex.match(district_value)
+            if district_matched is not None:
+                district_id = int(district_matched.group("district"))
+                break
+        if district_matched is None and ("state total" in district_value or district_value.startswith("dst")):
+            district_id = TOTAL_DISTRICT_ID
+        if district_id is None:
+            columns.append([col_acreage, None, None])
+            continue
+        columns.append([col_acreage, district_id, type_index])
+        if type_index == TOTAL_INDEX:
+            district_id = None
+            skip = True
+        type_index += 1
+        type_index %= 3
+    return columns
+
+
+def gather_header_columns(grid, header, rows_grape, matched_grape_names, grape_acreage_data, full_path):
+    """
+    Append the acreage of every variety row of a header to grape_acreage_data, reading and converting the cells of all
+    rows in all columns of the header at once
+    :param header: header of a plan from find_layout
+    :param rows_grape: rows of the varieties, matched_grape_names their names
+    """
+    district_columns = [column for column in header["columns"] if column[1] is not None]
+    empty_columns = [col_acreage for col_acreage, district_id, _ in header["columns"] if district_id is None]
+    for _, district_id, _ in district_columns:
+        if district_id != TOTAL_DISTRICT_ID and district_id > MAX_DISTRICT_ID:
+            raise RuntimeError("Matched district id {} larger than {}".format(district_id, MAX_DISTRICT_ID))
+    rows = np.array(rows_grape, dtype=int)
+    if len(empty_columns) > 0:
+        empty_cells = normalize_cells(grid[np.ix_(rows, np.array(empty_columns, dtype=int))])
+        not_empty = ~np.isin(np.char.strip(empty_cells), ["", "nan"])
+        if not_empty.any():
+            row_index, col_index = np.argwhere(not_empty)[0]
+            raise RuntimeError("No district ID when parsing ({},{}) with value {} at {}".format(
+                rows_grape[row_index], empty_columns[col_index], empty_cells[row_index, col_index].strip(), full_path))
+        logger.debug("No data found in columns %s of %s, skipping", empty_columns, full_path)
+    values, status = coerce_cells(
+        grid[np.ix_(rows, np.array([col_acreage for col_acreage, _, _ in district_columns], dtype=int))],
+        acreage_cell_value)
+    for matched_grape_name, row_values, row_status in zip(matched_grape_names, values.tolist(), status.tolist()):
+        for (_, district_id, type_index), district_acres, cell_status in zip(district_columns, row_values,
+                                                                               row_status):
+            grape_acreage_data[type_index][matched_grape_name].append((district_id, district_acres, cell_status))
 
 
-def extract_data_from_excel(year, flattened_dir_for_year):
+def extract_data_from_excel(year, excel_source_for_year, all_varieties=False, reader=DEFAULT_READER_BACKEND,
+                            layout_plans=None):
+    """
+    :param excel_source_for_year: this year's ZIP or Excel file, or the directory the ZIP file was extracted to
+    :param reader: Excel reader backend, one of excel_reader.READER_BACKENDS
+    :param layout_plans: LayoutPlans to parse sheets with a known layout without scanning them, or None
+    """
     pattern = "gabtb12"
     if year == 1994 or year >= 2022:
         pattern = "gabtb10"
-    all_files = [f for f in os.listdir(flattened_dir_for_year) if os.path.isfile(os.path.join(flattened_dir_for_year, f))]
-    print("all files", all_files)
-    all_excel_files = [f for f in all_files if (f.lower().endswith("xls") or f.lower().endswith("xlsx"))]
-    print("all_excel_files", all_excel_files)
+    sheets = open_sheets_from_excel(excel_source_for_year, reader=reader)
+    all_excel_files = list(sheets.keys())
+    logger.debug("all_excel_files %s", all_excel_files)
     # also exclude temporary files that begins with ~
     files_contains_pattern = sorted([f for f in all_excel_files if (pattern in Path(f).stem.lower()) and not Path(f).stem.startswith("~")])
-    print("files_contains_pattern", files_contains_pattern)
+    logger.debug("files_contains_pattern %s", files_contains_pattern)
     if len(files_contains_pattern) == 0:
-        raise RuntimeError("No file contains {} in {}".format(pattern, flattened_dir_for_year))
+        raise RuntimeError("No file contains {} in {}".format(pattern, excel_source_for_year))
     grape_bearing_acreage_data = defaultdict(list)
     grape_non_bearing_acreage_data = defaultdict(list)
     grape_total_acreage_data = defaultdict(list)
     grape_acreage_data = [grape_bearing_acreage_data, grape_non_bearing_acreage_data, grape_total_acreage_data]
     for excel_file in files_contains_pattern:
-        extension = pathlib.Path(excel_file).suffix.strip(". ").lower()
-        engine = None
-        if extension == 'xlsx':
-            engine = "openpyxl"
-        elif extension == 'xls':
-            engine = "xlrd"
-        full_path = os.path.join(flattened_dir_for_year, excel_file)
-        print("Parsing...", full_path)
-        data_frame = pd.read_excel(full_path, engine=engine, sheet_name=0, header=None, dtype=str)
-        num_rows, num_cols = data_frame.shape
-        print("Shape: ", data_frame.shape)
-        # find where are the type and variety headers
-        header_locations = []
-        for col in range(num_cols):
-            for row in range(num_rows):
-                value = str(data_frame.iat[row, col])
-                if (NEW_HEADER.lower() == value.lower().strip()) or (OLD_HEADER.lower() == value.lower().strip()):
-                    header_locations.append((value.lower().strip(), row, col))
-                else:
-                    district_matched = re.match(MID_DISTRICT_REGEX, value.lower())
-                    if district_matched is not None and col > 0:
-                        previous_cell = str(data_frame.iat[row, col-1]).strip()
-                        # print("matched at {},{}, previous cell {}".format(row, col, previous_cell))
-                        if previous_cell == "nan" or len(previous_cell) == 0:
-                            header_locations.append((MID_HEADER, row, col-1))
-        # make sure we found something
-        if len(header_locations) == 0:
-            raise RuntimeError("Did not find header location in {}".format(full_path))
-        # print(header_locations)
+        xl, sheet = sheets[excel_file]
+        full_path = "{}:{}".format(excel_source_for_year, excel_file)
+        logger.debug("Parsing... %s", full_path)
+        grid = xl.read_grid(sheet)
+        logger.debug("Shape: %s", grid.shape)
+        sheet_name = xl.sheet_names[sheet] if isinstance(sheet, int) else sheet
+        plan = find_or_plan(layout_plans, sheet_fingerprint([PARSER_NAME, PARSER_VERSION], sheet_name, grid), grid,
+                            lambda: find_layout(grid, full_path))
         # find grape by name
-        for header, row_header, col_header in header_locations:
-            matched_grape_name = None
-            for row_grape in range(row_header, num_rows):
-                grape_name = str(data_frame.iat[row_grape, col_header])
-                matched_grape_name_this_header = None
-                for interested_grape_name in INTERESTED_GRAPE_NAMES.keys():
-                    if interested_grape_name.lower() in grape_name.lower():
-                        matched_grape_name_this_header = interested_grape_name.lower()
-                if matched_grape_name_this_header is None:
-                    continue
-                matched_grape_name = matched_grape_name_this_header
-                district_id = None
-                type_index = 0
-                skip = False
-                for col_acreage in range(col_header + 1, num_cols):
-                    # skip the total column
-                    if skip:
-                        skip = False
-                        continue
-                    district_value = str(data_frame.iat[row_header, col_acreage]).strip().lower()
-                    # print("district_value is {} at ({}, {})".format(district_value, row_header, col_acreage))
-                    district_matched = re.match(NEW_DISTRICT_REGEX, district_value)
-                    if district_matched is None:
-                        district_matched = re.match(MID_DISTRICT_REGEX, district_value)
-                        if district_matched is None:
-                            district_matched = re.match(OLD_DISTRICT_REGEX, district_value)
-                            if district_matched is None:
-                                if "state total".lower() in district_value or district_value.startswith("dst"):
-                                    district_id = TOTAL_DISTRICT_ID
-                                # if district_matched is None:
-                                #     print("Nothing is matched for {} at ({}, {})".format(district_value, row_header, col_acreage))
-                    if district_matched is not None:
-                        district_id = int(district_matched.group("district"))
-                    value = str(data_frame.iat[row_grape, col_acreage]).strip().lower()
-                    if district_id is None:
-                        if len(value) == 0 or value == "nan":
-                            print("No data found in this cell, skipping")
-                            continue
-                        raise RuntimeError("No district ID when parsing ({},{}) with value {} at {}"
-                                           .format(row_grape, col_acreage, value, full_path))
-                    if district_id != TOTAL_DISTRICT_ID and district_id > MAX_DISTRICT_ID:
-                        raise RuntimeError("Matched district id {} larger than {}".format(district_id, MAX_DISTRICT_ID))
-                    # Get rid of non-numeric characters
-                    value = re.sub("[^\d\.]", "", value)
-                    district_acres = float(value)
-                    grape_acreage_data[type_index][matched_grape_name].append((district_id, district_acres))
-                    if type_index == TOTAL_INDEX:
-                        district_id = None
-                        skip = True
-                    type_index += 1
-                    type_index %= 3
-            if matched_grape_name is None:
+        for header in plan["headers"]:
+            row_header, col_header = header["row"], header["col"]
+            # variety name for every row from the header to the bottom, None for rows we are not interested in
+            row_has_values = rows_with_values(normalize_cells(grid[row_header:, col_header + 1:])) if all_varieties \
+                else None
+            matched_grape_names_this_header = match_varieties(normalize_cells(grid[row_header:, col_header]),
+                                                              INTERESTED_GRAPE_NAME_MATCHER,
+                                                              all_varieties=all_varieties,
+                                                              row_has_values=row_has_values)
+            rows_grape = [row_offset for row_offset, matched_grape_name in enumerate(matched_grape_names_this_header)
+                          if matched_grape_name is not None]
+            if len(rows_grape) == 0:
                 raise ValueError("Did not find any interested grape in {}".format(full_path))
+            gather_header_columns(grid, header, [row_header + row_offset for row_offset in rows_grape],
+                                  [matched_grape_names_this_header[row_offset] for row_offset in rows_grape],
+                                  grape_acreage_data, full_path)
     for type_data in grape_acreage_data:
         for key in type_data.keys():
             type_data[key].sort(key=lambda x: x[0])
@@ -258,7 +354,7 @@ def extract_data_from_excel(year, flattened_dir_for_year):
     #     for region_id, production_quantity_tons in value:
     #         print("Region: {}, Quantity: {:.1f} tons".format(region_id, production_quantity_tons))
 
-    return grape_acreage_data
+    return [YearResult.from_grape_data(type_data) for type_data in grape_acreage_data]
 
 
 def extract_needed_data(in_memory_data):
@@ -269,103 +365,203 @@ def attach_data_to_master_sheet(new_data):
     pass
 
 
-def main():
-    if len(sys.argv) < 5:
-        print(
-            "Not enough arguments, needed at least 2, with 'begin_year' in YYYY, and 'end_year' in YYYY, data_root as string, skip download as True|False")
-        return 1
-    begin_year = int(sys.argv[1])
-    end_year = int(sys.argv[2])
-    data_root = str(sys.argv[3])
-    skip_download = str(sys.argv[4]) == "True"
-    print("Step 0 Creating data root at ", data_root)
+def main(args=None):
+    """
+    :param args: parsed command line arguments, parsed from sys.argv when None
+    :return: 0 on success, non-zero on failure
+    """
+    if args is None:
+        parser = create_argument_parser("Crawl grape acreage reports")
+        parser.add_argument("--flatten", action="store_true",
+                            help="dump every sheet into <raw data directory>/<year>/flatten/ as its own xlsx file "
+                                 "for debugging")
+        args = parser.parse_args()
+    begin_year = args.begin_year
+    end_year = args.end_year
+    data_root = args.data_root
+    skip_download = args.skip_download == SKIP_DOWNLOAD_TRUE
+    refresh = args.skip_download == REFRESH
+    configure_logging(args.log_level)
+    logger.info("Step 0 Creating data root at %s", data_root)
     os.makedirs(data_root, exist_ok=True)
     crush_data_root = os.path.join(data_root, "AcreageRaw")
     os.makedirs(crush_data_root, exist_ok=True)
-    print("Step 1 Parsing website data")
-    zip_url_dict = get_all_zip_file_paths(USDA_NASS_CA_ACREAGE_REPORT_URL)
+    instrumentation = create_instrumentation("acreage", args)
+    writer = Stage1Writer(data_root, INTERESTED_GRAPE_NAMES, TOTAL_DISTRICT_ID, output_format=args.output_format,
+                          all_varieties=args.all_varieties)
+    warehouse = SQLiteWarehouse(args.sqlite) if args.sqlite else None
+    parse_cache = ParseCache(args.parse_cache, args.parse_cache_size) if args.parse_cache else None
+    layout_plans = LayoutPlans(args.layout_plans) if args.layout_plans else None
+    blob_store = BlobStore(args.blob_store) if args.blob_store else None
+    manifest = BuildManifest(data_root)
+    parse_options = {"parser": PARSER_NAME, "version": PARSER_VERSION, "varieties": list(INTERESTED_GRAPE_NAMES),
+                     "all_varieties": args.all_varieties, "reader": args.reader}
+    session = create_session(args.downloads)
+    logger.info("Step 1 Parsing website data")
+    with instrumentation.stage("index"):
+        zip_url_dict = get_all_zip_file_paths(USDA_NASS_CA_ACREAGE_REPORT_URL, session=session)
     for year, url in sorted(zip_url_dict.items()):
-        print(year, url)
-    print("Step 2 Downloading ZIP files for selected years")
-    # in (year, path, extension) format
-    downloaded_file_local_paths = []
+        logger.debug("%s %s", year, url)
+    logger.info("Step 2 Downloading ZIP files for selected years, %s at a time", args.downloads)
+    download_state = load_download_state(crush_data_root)
+    download_jobs = []
     for year in range(begin_year, end_year + 1):
+        if not in_shard(args.shard, PARSER_NAME, year):
+            continue
         if year not in zip_url_dict:
-            print("{} not in parsed zip url list".format(year))
+            logger.error("%s not in parsed zip url list", year)
             return 2
         selected_url = zip_url_dict[year]
         extension = pathlib.Path(selected_url).suffix.lower().strip(" .")
         # Rename self-extract exe files into zip files
         if extension == "exe":
             extension = "zip"
-        downloaded_file_path = download_file(crush_data_root, year, selected_url, extension, skip_download=skip_download)
-        downloaded_file_local_paths.append((year, downloaded_file_path, extension))
-        print("Downloaded...", downloaded_file_path)
-    print("Step 3 unzipping data")
-    unzipped_excel_files = []
-    for year, path_to_file, extension in downloaded_file_local_paths:
+        previous_state = download_state.get(year) if refresh else None
+        download_jobs.append((crush_data_root, year, selected_url, extension, skip_download, session, previous_state,
+                              blob_store))
+    # archive SHA-256 of every downloaded year, recorded in the manifest with its outputs
+    archive_sha256_by_year = {}
+
+    def select_year(year, path, changed, state):
+        """
+        :return: True if the year has to be parsed, False if its file and outputs did not change
+        """
+        if state is not None:
+            download_state[year] = state
+        archive_sha256_by_year[year] = state["sha256"] if state is not None else source_sha256(path)
+        # the year decides which file pattern is parsed
+        stale = any(manifest.is_stale("Acreage/{}".format(dir_name), year, archive_sha256_by_year[year],
+                                      dict(parse_options, year=year),
+                                      writer.output_filenames("Acreage/{}".format(dir_name), year))
+                    for dir_name in TYPE_INDEX_DICT.values())
+        if not changed and not stale:
+            logger.info("Skipping %s as its file and outputs did not change", year)
+            return False
+        return True
+
+    def excel_source_of(year, path_to_file, extension):
+        """
+        :return: where Excel files of the year are read from, the downloaded file unless it is extracted for debugging
+        """
+        if not args.extract:
+            return path_to_file
         unzipped_dir_for_year = os.path.join(crush_data_root, "{}".format(year))
-        if extension != "zip":
-            os.makedirs(unzipped_dir_for_year, exist_ok=True)
-            target_file = os.path.join(unzipped_dir_for_year, pathlib.Path(path_to_file).name)
-            print("Copying from {} to {}".format(path_to_file, target_file))
-            shutil.copyfile(path_to_file, target_file)
-            unzipped_excel_files.append((year, unzipped_dir_for_year, extension))
-            continue
-        print("Unzipping {} to {}".format(path_to_file, unzipped_dir_for_year))
-        unzip_files(unzipped_dir_for_year, path_to_file)
-        unzipped_excel_files.append((year, unzipped_dir_for_year, extension))
-    print("Step 3.5 Flatten Excels")
-    flatten_excel_dirs = []
-    for year, dir_path, extension in unzipped_excel_files:
-        flatten_dir_path = os.path.join(dir_path, "flatten")
-        print("flattening excel sheets from {} to {}".format(dir_path, flatten_dir_path))
+        with instrumentation.stage("unzip", year=year) as record:
+            if extension != "zip":
+                os.makedirs(unzipped_dir_for_year, exist_ok=True)
+                target_file = os.path.join(unzipped_dir_for_year, pathlib.Path(path_to_file).name)
+                logger.debug("Copying from %s to %s", path_to_file, target_file)
+                if blob_store is not None:
+                    blob_store.copy_file(path_to_file, target_file)
+                else:
+                    shutil.copyfile(path_to_file, target_file)
+            else:
+                logger.debug("Unzipping %s to %s", path_to_file, unzipped_dir_for_year)
+                unzip_files(unzipped_dir_for_year, path_to_file, blob_store=blob_store)
+            record["bytes_in"] = path_size(path_to_file)
+            record["bytes_out"] = path_size(unzipped_dir_for_year)
+        return unzipped_dir_for_year
+
+    def flatten_job_of(year, excel_source_for_year):
+        flatten_dir_path = os.path.join(crush_data_root, "{}".format(year), "flatten")
+        logger.debug("flattening excel sheets from %s to %s", excel_source_for_year, flatten_dir_path)
         os.makedirs(flatten_dir_path, exist_ok=True)
-        flatten_sheets_from_excel(dir_path, flatten_dir_path)
-        flatten_excel_dirs.append((year, flatten_dir_path))
-
-    print("Step 4 extract data from excels")
-    grape_acreage_data_by_year = []
-    for year, flattened_excel_dir_for_year in flatten_excel_dirs:
-        print("Parsing...", flattened_excel_dir_for_year)
-        grape_acreage_data_this_year = extract_data_from_excel(year, flattened_excel_dir_for_year)
+        return (year, excel_source_for_year,
+                ("flatten", year, None, args.trace_memory, None, path_size(excel_source_for_year),
+                 flatten_sheets_from_excel, (excel_source_for_year, flatten_dir_path, args.reader)))
+
+    def parse_job_of(year, excel_source_for_year):
+        return (year, excel_source_for_year,
+                ("parse", year, "Acreage", args.trace_memory,
+                 instrumentation.profile_filename("parse", year, "Acreage"), path_size(excel_source_for_year),
+                 parse_with_cache,
+                 (parse_cache, dict(parse_options, year=year), excel_source_for_year, extract_data_from_excel,
+                  (year, excel_source_for_year, args.all_varieties, args.reader, layout_plans))))
+
+    def write_year(year, measured_results):
+        """
+        :param measured_results: (result, record) of the parse job of the year, after its flatten job if any
+        """
+        for _, record in measured_results:
+            instrumentation.add(record)
+        grape_acreage_data_this_year = measured_results[-1][0]
         if grape_acreage_data_this_year is None:
             raise ValueError("grape_acreage_data_this_year is None")
-        grape_acreage_data_by_year.append((year, grape_acreage_data_this_year))
-    csv_data_root = os.path.join(data_root, "Acreage")
-    os.makedirs(csv_data_root, exist_ok=True)
-    print("Step 5 write data to Organized_Grape_Acreage_Data")
-    for year, grape_acreage_data_this_year in grape_acreage_data_by_year:
         for type_index, dir_name in TYPE_INDEX_DICT.items():
-            grape_acreage_typed_data_by_year = grape_acreage_data_this_year[type_index]
-            csv_data_root_for_type = os.path.join(csv_data_root, dir_name)
-            os.makedirs(csv_data_root_for_type, exist_ok=True)
-            csv_filename = os.path.join(csv_data_root_for_type, "{}.csv".format(year))
-            print("Writing to {}".format(csv_filename))
-            grape_acreage_this_year_list = []
-            header = [NEW_HEADER, WINE_CATEGORY]
-            for grape_name, value in grape_acreage_typed_data_by_year.items():
-                this_grape_dict = {}
-                this_grape_dict[NEW_HEADER] = grape_name
-                if grape_name not in INTERESTED_GRAPE_NAMES:
-                    raise ValueError("grape name {} not found in INTERESTED_GRAPE_NAMES, check your parser step"
-                                     .format(grape_name))
-                this_grape_dict[WINE_CATEGORY] = INTERESTED_GRAPE_NAMES[grape_name]
-                for district_id, acres in value:
-                    if str(district_id) == str(TOTAL_DISTRICT_ID):
-                        district_id = "California"
-                    if str(district_id) not in header:
-                        header.append(str(district_id))
-                    this_grape_dict[str(district_id)] = "{:.1f}".format(acres)
-                grape_acreage_this_year_list.append(this_grape_dict)
-            interested_grape_names_lower = [x.lower() for x in INTERESTED_GRAPE_NAMES.keys()]
-            grape_acreage_this_year_list = sorted(grape_acreage_this_year_list,
-                                                    key=lambda x: interested_grape_names_lower.index(x[NEW_HEADER]))
-            with open(csv_filename, 'w', newline='') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=header)
-                writer.writeheader()
-                writer.writerows(grape_acreage_this_year_list)
-    print("Done")
+            with instrumentation.stage("write", year=year, table="Acreage/{}".format(dir_name)) as record:
+                output_hashes = writer.write("Acreage/{}".format(dir_name), year,
+                                             grape_acreage_data_this_year[type_index])
+                record["bytes_out"] = sum(path_size(filename) for filename in output_hashes)
+            manifest.record("Acreage/{}".format(dir_name), year, archive_sha256_by_year[year],
+                            dict(parse_options, year=year), output_hashes)
+        if warehouse is not None:
+            with instrumentation.stage("sqlite", year=year) as record:
+                record["rows"] = warehouse.upsert_year(year, [
+                    ("Acreage/{}".format(dir_name), archive_sha256_by_year[year],
+                     year_result_observations(*writer.rows(grape_acreage_data_this_year[type_index]),
+                                              grape_acreage_data_this_year[type_index]))
+                    for type_index, dir_name in TYPE_INDEX_DICT.items()])
+
+    if args.pipeline:
+        logger.info("Steps 2 to 5 pipelined with %s download(s) and %s worker(s)", args.downloads, args.workers)
+        extension_by_year = {job[1]: job[3] for job in download_jobs}
+        with instrumentation.stage("pipeline") as pipeline_record:
+            pipeline_record["bytes_in"] = 0
+
+            def prepare_year(year, download_result):
+                path, changed, state = download_result
+                if changed and not skip_download:
+                    pipeline_record["bytes_in"] += path_size(path)
+                if not select_year(year, path, changed, state):
+                    return None
+                excel_source_for_year = excel_source_of(year, path, extension_by_year[year])
+                if args.flatten:
+                    return [flatten_job_of(year, excel_source_for_year), parse_job_of(year, excel_source_for_year)]
+                return [parse_job_of(year, excel_source_for_year)]
+
+            run_pipeline([(job[1], job) for job in download_jobs], download_file, prepare_year, measured_call,
+                         write_year, downloads=args.downloads, workers=args.workers,
+                         max_pending_years=args.pipeline_depth)
+        if not skip_download:
+            save_download_state(crush_data_root, download_state)
+    else:
+        with instrumentation.stage("download") as record:
+            download_results = run_concurrently(download_file, download_jobs, max_concurrent=args.downloads)
+            record["bytes_in"] = sum(path_size(path) for path, changed, _ in download_results
+                                     if changed and not skip_download)
+        # in (year, path, extension) format
+        downloaded_file_local_paths = [(job[1], path, job[3])
+                                       for job, (path, changed, state) in zip(download_jobs, download_results)
+                                       if select_year(job[1], path, changed, state)]
+        if not skip_download:
+            save_download_state(crush_data_root, download_state)
+        if args.extract:
+            logger.info("Step 3 unzipping data")
+        excel_sources = [(year, excel_source_of(year, path_to_file, extension))
+                         for year, path_to_file, extension in downloaded_file_local_paths]
+        if args.flatten:
+            logger.info("Step 3.5 Flatten Excels with %s worker(s)", args.workers)
+            flatten_jobs = [flatten_job_of(year, excel_source_for_year)
+                            for year, excel_source_for_year in excel_sources]
+            for _, record in map_years_in_order(measured_call, flatten_jobs, workers=args.workers):
+                instrumentation.add(record)
+
+        logger.info("Steps 4 and 5 extract data from excels with %s worker(s) and write each year to "
+                    "Organized_Grape_Acreage_Data once parsed", args.workers)
+        parse_jobs = [parse_job_of(year, excel_source_for_year) for year, excel_source_for_year in excel_sources]
+        measured_results = iterate_years_in_order(measured_call, parse_jobs, workers=args.workers)
+        for (year, _), measured_result in zip(excel_sources, measured_results):
+            write_year(year, [measured_result])
+    if parse_cache is not None:
+        logger.info("Evicted %s parse cache entries", parse_cache.evict())
+    if warehouse is not None:
+        warehouse.close()
+    manifest.save()
+    if args.shard is not None:
+        record_shard(data_root, PARSER_NAME, args,
+                     ["Acreage/{}".format(dir_name) for dir_name in TYPE_INDEX_DICT.values()], manifest)
+    instrumentation.log_summary()
+    logger.info("Done")
     return 0
 
 
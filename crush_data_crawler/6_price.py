@@ -3,9 +3,5 @@
 
 import crush_data_crawler_lib as crush
 
-crush.RAW_DATA_DIR = "PriceRaw"
-crush.OUTPUT_DIR = "Price"
-crush.FILE_POSTFIX = "06"
-
 if __name__ == "__main__":
-    crush.crawl()
+    crush.crawl([crush.PRICE_TABLE])
@@ -0,0 +1,10 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Download each year's crush report once and extract Volume, DegreeBrix, PurchasedVolume, PurchasedDegreeBrix and
+# Price tables from it in a single pass, ZIP files are kept in CrushRaw
+
+import crush_data_crawler_lib as crush
+
+if __name__ == "__main__":
+    crush.crawl(crush.ALL_CRUSH_TABLES)
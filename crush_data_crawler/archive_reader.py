@@ -0,0 +1,58 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Read Excel files of a year from wherever they are, without extracting ZIP files to disk. A source can be
+# * a ZIP file, Excel files are listed from its central directory and read into memory one at a time
+# * a directory, e.g. a ZIP file extracted by unzip_files() for debugging
+# * a single Excel file, as some acreage years are published without a ZIP file
+# In every case only top level files are considered, the same as listing an extracted directory.
+
+import io
+import os
+import zipfile
+
+EXCEL_EXTENSIONS = ("xls", "xlsx")
+
+
+def is_excel_filename(filename):
+    return filename.lower().endswith(EXCEL_EXTENSIONS)
+
+
+def list_excel_files(source):
+    """
+    :return: names of top level Excel files in source
+    """
+    if os.path.isdir(source):
+        return [f for f in os.listdir(source) if os.path.isfile(os.path.join(source, f)) and is_excel_filename(f)]
+    # check Excel files before ZIP files, xlsx files are ZIP files too
+    if is_excel_filename(source):
+        return [os.path.basename(source)]
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source, 'r') as zip_ref:
+            return [info.filename for info in zip_ref.infolist()
+                    if not info.is_dir() and "/" not in info.filename and is_excel_filename(info.filename)]
+    raise RuntimeError("{} is neither a directory, a ZIP file nor an Excel file".format(source))
+
+
+def open_excel_file(source, name):
+    """
+    :param name: one of the names returned by list_excel_files(source)
+    :return: path or in-memory file object accepted by pd.read_excel and pd.ExcelFile
+    """
+    if os.path.isdir(source):
+        return os.path.join(source, name)
+    if is_excel_filename(source):
+        return source
+    with zipfile.ZipFile(source, 'r') as zip_ref:
+        return io.BytesIO(zip_ref.read(name))
+
+
+def describe_excel_file(source, name):
+    """
+    :return: human readable location of an Excel file for messages, e.g. AcreageRaw/2005.zip:gabtb12.xls
+    """
+    if os.path.isdir(source):
+        return os.path.join(source, name)
+    if is_excel_filename(source):
+        return source
+    return "{}:{}".format(source, name)
@@ -0,0 +1,275 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Keep one copy of every raw file downloaded or extracted by the crawlers, shared by all dated output directories
+# (snapshots) instead of a full copy of 30 years of ZIP files in each of them.
+#
+# <store>/sha256/<first 2 hex digits>/<SHA-256> -> blob, a file named after the SHA-256 of its content
+# <store>/url_index.json -> url -> download state (ETag, Last-Modified, SHA-256) of the last download of url
+# <store>/tmp/ -> downloads and extracted files before they are moved into sha256/
+# <store>/store.lock -> locked exclusively by gc, shared by crawlers from adding or finding a blob until it is linked
+#
+# Raw data directories of snapshots are hard links to blobs, so a new snapshot only asks the USDA website whether each
+# file changed since any snapshot downloaded it and links the unchanged ones, and extracting a ZIP file links workbooks
+# already extracted by another snapshot. When hard links are not possible, e.g. the store is on another drive, files
+# are copied instead.
+#
+# A blob with no hard link left outside the store is not referenced by any snapshot anymore, delete those with
+#   crush_data_crawler/blob_store.py ./output/blobs gc [--dry-run]
+# Several crawls can share a store while gc runs: gc waits for crawlers between adding a blob and linking it, as the
+# blob has no hard link yet, and crawlers wait for gc. Downloads of the same url into its staging file and updates of
+# url_index.json are serialized with their own flock, an update merging into what other crawls recorded meanwhile.
+# Without fcntl, e.g. on Windows, nothing is locked and gc must not run during a crawl.
+
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import zipfile
+from downloader import download_to_file, file_sha256, DOWNLOAD_CHUNK_SIZE, PARTIAL_DOWNLOAD_SUFFIX
+from instrumentation import configure_logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = "sha256"
+TMP_DIR = "tmp"
+URL_INDEX_FILENAME = "url_index.json"
+LOCK_FILENAME = "store.lock"
+LOCK_SUFFIX = ".lock"
+GC_COMMAND = "gc"
+
+
+@contextlib.contextmanager
+def file_lock(lock_filename, exclusive=False):
+    """
+    Hold a flock on lock_filename, created if needed, shared unless exclusive, it also excludes other threads as each
+    call opens the file again
+    """
+    with open(lock_filename, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class BlobStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, BLOB_DIR), exist_ok=True)
+        os.makedirs(os.path.join(directory, TMP_DIR), exist_ok=True)
+        self.url_index_filename = os.path.join(directory, URL_INDEX_FILENAME)
+        self.lock_filename = os.path.join(directory, LOCK_FILENAME)
+        self.url_index = self.load_url_index()
+        # downloads run in threads and all update url_index
+        self.lock = threading.Lock()
+
+    def shared_lock(self):
+        """
+        :return: context manager holding the store lock shared, gc does not run while it is held
+        """
+        return file_lock(self.lock_filename)
+
+    def blob_filename(self, sha256):
+        return os.path.join(self.directory, BLOB_DIR, sha256[:2], sha256)
+
+    def has(self, sha256):
+        return os.path.exists(self.blob_filename(sha256))
+
+    def add_file(self, filename, sha256=None):
+        """
+        Move filename into the store, or delete it if the store already has the same content, call it with the shared
+        lock held until the blob is linked
+        :return: SHA-256 of its content
+        """
+        if sha256 is None:
+            sha256 = file_sha256(filename)
+        blob_filename = self.blob_filename(sha256)
+        if os.path.exists(blob_filename):
+            os.remove(filename)
+            return sha256
+        os.makedirs(os.path.dirname(blob_filename), exist_ok=True)
+        # blobs are shared by snapshots, writers always replace files instead of writing into them
+        os.chmod(filename, 0o444)
+        os.replace(filename, blob_filename)
+        return sha256
+
+    def link(self, sha256, filename):
+        """
+        Make filename a hard link to a blob, or a copy of it if hard links are not possible
+        """
+        blob_filename = self.blob_filename(sha256)
+        if os.path.exists(filename) and os.path.samefile(filename, blob_filename):
+            return
+        partial_filename = filename + PARTIAL_DOWNLOAD_SUFFIX
+        if os.path.exists(partial_filename):
+            os.remove(partial_filename)
+        try:
+            os.link(blob_filename, partial_filename)
+        except OSError:
+            shutil.copyfile(blob_filename, partial_filename)
+        os.replace(partial_filename, filename)
+
+    def copy_file(self, source, filename):
+        """
+        Copy source into filename through the store, e.g. a downloaded workbook that does not need unzipping
+        """
+        sha256 = file_sha256(source)
+        with self.shared_lock():
+            if not self.has(sha256):
+                temporary_filename = self.temporary_filename()
+                shutil.copyfile(source, temporary_filename)
+                self.add_file(temporary_filename, sha256)
+            self.link(sha256, filename)
+
+    def temporary_filename(self):
+        handle, temporary_filename = tempfile.mkstemp(dir=os.path.join(self.directory, TMP_DIR))
+        os.close(handle)
+        return temporary_filename
+
+    def indexed_state(self, url):
+        """
+        :return: download state of the last download of url, None if url was never downloaded or its blob was deleted
+        """
+        with self.lock:
+            state = self.url_index.get(url)
+        if state is None or not self.has(state["sha256"]):
+            return None
+        return state
+
+    def record_url(self, url, state):
+        with self.lock, file_lock(self.url_index_filename + LOCK_SUFFIX, exclusive=True):
+            # keep what other crawls sharing the store recorded since
+            self.url_index = self.load_url_index()
+            self.url_index[url] = state
+            self.save_url_index()
+
+    def refresh_file(self, session, url, filename, previous_state=None):
+        """
+        Same as downloader.refresh_file, but url is only downloaded when it changed since any snapshot downloaded it,
+        and filename is linked to its blob
+        :param previous_state: download state of filename saved by a previous run of this snapshot
+        :return: (changed, state), changed is False when filename has the same content as described by previous_state
+        """
+        # one staging file per url, so that an interrupted download is resumed by the next run of any snapshot
+        staging_filename = os.path.join(self.directory, TMP_DIR, hashlib.sha256(url.encode("utf-8")).hexdigest())
+        with self.shared_lock(), file_lock(staging_filename + LOCK_SUFFIX, exclusive=True):
+            indexed_state = self.indexed_state(url)
+            response_headers = download_to_file(session, url, staging_filename, previous_state=indexed_state)
+            if response_headers is None:
+                state = indexed_state
+            else:
+                state = {
+                    "url": url,
+                    "etag": response_headers.get("ETag"),
+                    "last_modified": response_headers.get("Last-Modified"),
+                    "sha256": self.add_file(staging_filename),
+                }
+                self.record_url(url, state)
+            self.link(state["sha256"], filename)
+        changed = previous_state is None or previous_state.get("sha256") != state["sha256"]
+        return changed, state
+
+    def extract_zip(self, path_to_zip_file, unzip_target_directory):
+        """
+        Same as zipfile.ZipFile.extractall, every extracted file being linked to its blob
+        :return: unzip_target_directory
+        """
+        with zipfile.ZipFile(path_to_zip_file, 'r') as zip_ref:
+            for member in zip_ref.infolist():
+                if member.is_dir():
+                    continue
+                filename = os.path.join(unzip_target_directory, *sanitized_member_path(member.filename))
+                temporary_filename = self.temporary_filename()
+                sha256 = hashlib.sha256()
+                with zip_ref.open(member) as source, open(temporary_filename, "wb") as destination:
+                    for chunk in iter(lambda: source.read(DOWNLOAD_CHUNK_SIZE), b""):
+                        sha256.update(chunk)
+                        destination.write(chunk)
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                with self.shared_lock():
+                    self.link(self.add_file(temporary_filename, sha256.hexdigest()), filename)
+        return unzip_target_directory
+
+    def load_url_index(self):
+        """
+        :return: url index saved in the store, empty if there is none yet
+        """
+        if not os.path.exists(self.url_index_filename):
+            return {}
+        with open(self.url_index_filename) as url_index_file:
+            return json.load(url_index_file)
+
+    def save_url_index(self):
+        with open(self.url_index_filename + PARTIAL_DOWNLOAD_SUFFIX, "w") as url_index_file:
+            json.dump(self.url_index, url_index_file, indent=2, sort_keys=True)
+        os.replace(self.url_index_filename + PARTIAL_DOWNLOAD_SUFFIX, self.url_index_filename)
+
+    def gc(self, dry_run=False):
+        """
+        Delete blobs no snapshot links to anymore, and forget urls whose blob was deleted, waiting for crawls holding
+        the shared lock, a blob they added has no hard link until they link it
+        :return: (number of blobs deleted, bytes freed)
+        """
+        deleted = 0
+        freed_bytes = 0
+        blob_root = os.path.join(self.directory, BLOB_DIR)
+        with file_lock(self.lock_filename, exclusive=True):
+            for directory, _, filenames in os.walk(blob_root):
+                for filename in filenames:
+                    blob_filename = os.path.join(directory, filename)
+                    stat = os.stat(blob_filename)
+                    if stat.st_nlink > 1:
+                        continue
+                    logger.debug("Deleting unreferenced blob %s", filename)
+                    deleted += 1
+                    freed_bytes += stat.st_size
+                    if not dry_run:
+                        os.chmod(blob_filename, 0o644)
+                        os.remove(blob_filename)
+            if not dry_run:
+                with self.lock, file_lock(self.url_index_filename + LOCK_SUFFIX, exclusive=True):
+                    self.url_index = self.load_url_index()
+                    for url in [url for url, state in self.url_index.items() if not self.has(state["sha256"])]:
+                        del self.url_index[url]
+                    self.save_url_index()
+        return deleted, freed_bytes
+
+
+def sanitized_member_path(member_filename):
+    """
+    :return: path components of a ZIP member name, without drive, absolute or parent directory parts
+    """
+    member_filename = member_filename.replace("\\", "/")
+    return [part for part in member_filename.split("/") if part not in ("", ".", "..") and ":" not in part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the raw data store shared by snapshots, see --blob-store")
+    parser.add_argument("store", type=str, help="directory of the store")
+    parser.add_argument("command", choices=[GC_COMMAND],
+                        help="gc deletes files no snapshot links to anymore, e.g. after deleting old snapshots")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be deleted")
+    args = parser.parse_args()
+    configure_logging("INFO")
+    deleted, freed_bytes = BlobStore(args.store).gc(dry_run=args.dry_run)
+    logger.info("%s %s unreferenced blobs, %.1f MB", "Would delete" if args.dry_run else "Deleted", deleted,
+                freed_bytes / 1024 / 1024)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
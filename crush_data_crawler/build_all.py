@@ -0,0 +1,98 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Build a whole data root in one command: crawl every crush table in one pass, crawl acreage, then reshape everything
+# into the combined Excel file and the store of crush_data_reshape/grape_data_store.py with its aggregates. Run it
+# again on the same data root with Refresh, e.g. once a year
+#   crush_data_crawler/build_all.py 1991 2024 ./output/current Refresh current.xlsx
+# and only what changed is redone: years whose archive, parser options or outputs differ from build_manifest.json are
+# parsed again, outputs are only replaced when their content changed, and the combined file and the store are only
+# written again when a stage 1 output changed. With --sqlite the combined dataset, derived rows included, is also
+# upserted into that SQLite database whenever it is written again, see sqlite_warehouse.py.
+
+import argparse
+import importlib
+import logging
+import os
+import sys
+import crush_data_crawler_lib as crush
+from crawler_common import create_argument_parser, create_instrumentation
+from build_manifest import BuildManifest
+from instrumentation import configure_logging, path_size
+from sqlite_warehouse import SQLiteWarehouse, load_data_root
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "crush_data_reshape"))
+import reshape_total
+from grape_data_store import GrapeDataStore, STORE_DIR, VALUES_FILENAME
+from grape_aggregates import write_aggregates, AGGREGATES_DIR
+
+acreage = importlib.import_module("12_acreage")
+
+logger = logging.getLogger(__name__)
+
+# USDA publishes acreage by crush district from 1994
+ACREAGE_FIRST_YEAR = 1994
+
+
+def reshape(data_root, output_filename, instrumentation, sqlite=None):
+    """
+    Write the combined dataset, the store and its aggregates under <data_root>/store, unless no stage 1 output changed
+    since they were last written
+    :param sqlite: SQLite database the combined dataset is also upserted into, or None
+    """
+    manifest = BuildManifest(data_root)
+    store_directory = os.path.join(data_root, STORE_DIR)
+    if not manifest.is_reshape_stale(os.path.join(data_root, output_filename)) and \
+            os.path.exists(os.path.join(store_directory, AGGREGATES_DIR, VALUES_FILENAME)):
+        logger.info("Skipping reshape as no stage 1 output changed since %s was written", output_filename)
+        return
+    with instrumentation.stage("reshape") as record:
+        filename = reshape_total.write_combined_dataset(data_root, output_filename)
+        record["bytes_out"] = path_size(filename)
+    with instrumentation.stage("aggregate") as record:
+        store = GrapeDataStore.from_data_root(data_root)
+        store.save(store_directory)
+        write_aggregates(store, store_directory)
+        record["bytes_out"] = path_size(store_directory)
+    if sqlite is not None:
+        with instrumentation.stage("sqlite") as record:
+            warehouse = SQLiteWarehouse(sqlite)
+            try:
+                record["rows"] = load_data_root(warehouse, data_root)
+            finally:
+                warehouse.close()
+    manifest.record_reshape(filename)
+    manifest.save()
+
+
+def main():
+    parser = create_argument_parser("Crawl every table and reshape them into one dataset, redoing only what changed "
+                                    "since the last build of data_root")
+    parser.add_argument("output_filename", type=str, help="combined Excel file written under data_root")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+    logger.info("Crush tables")
+    status = crush.crawl(crush.ALL_CRUSH_TABLES, args=args)
+    if status != 0:
+        return status
+    if args.end_year >= ACREAGE_FIRST_YEAR:
+        logger.info("Acreage")
+        acreage_args = argparse.Namespace(**vars(args))
+        acreage_args.begin_year = max(args.begin_year, ACREAGE_FIRST_YEAR)
+        acreage_args.flatten = False
+        status = acreage.main(acreage_args)
+        if status != 0:
+            return status
+    if args.shard is not None:
+        logger.info("Skipping reshape of shard %s/%s, merge every shard with merge_shards.py", *args.shard)
+        return 0
+    logger.info("Reshape")
+    instrumentation = create_instrumentation("build_all", args)
+    reshape(args.data_root, args.output_filename, instrumentation, sqlite=args.sqlite)
+    instrumentation.log_summary()
+    logger.info("Done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
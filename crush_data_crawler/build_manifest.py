@@ -0,0 +1,96 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Build manifest of a data root, BUILD_MANIFEST_FILENAME, recording how every output was built so that later runs only
+# redo the work whose inputs changed. Nodes are (table, year) pairs, e.g. ("Volume", 2020) or ("Acreage/bearing",
+# 2020), each recording
+# * archive_sha256 -> SHA-256 of the downloaded ZIP or Excel file the year was parsed from
+# * parse_options -> parser name, PARSER_VERSION and options, the same as the parse cache key
+# * outputs -> SHA-256 of every file written for the node, relative to the data root
+# A node is stale when any of them differs from what the current run would use or find on disk. The reshape step is
+# recorded separately with the digest of all stage 1 outputs it was built from.
+
+import hashlib
+import json
+import os
+from downloader import file_sha256, PARTIAL_DOWNLOAD_SUFFIX
+
+BUILD_MANIFEST_FILENAME = "build_manifest.json"
+
+
+class BuildManifest:
+    def __init__(self, data_root):
+        self.data_root = data_root
+        self.filename = os.path.join(data_root, BUILD_MANIFEST_FILENAME)
+        self.nodes = {}
+        self.reshape = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as manifest_file:
+                manifest = json.load(manifest_file)
+            self.nodes = manifest.get("nodes", {})
+            self.reshape = manifest.get("reshape", {})
+
+    @staticmethod
+    def node_key(table, year):
+        return "{}/{}".format(table, year)
+
+    def relative_path(self, filename):
+        return os.path.relpath(filename, self.data_root).replace(os.sep, "/")
+
+    def is_stale(self, table, year, archive_sha256, parse_options, output_filenames):
+        """
+        :param output_filenames: files the current run would write for this node
+        :return: True if the node has to be parsed and written again
+        """
+        node = self.nodes.get(self.node_key(table, year))
+        if node is None or node["archive_sha256"] != archive_sha256 or node["parse_options"] != parse_options:
+            return True
+        for filename in output_filenames:
+            recorded_sha256 = node["outputs"].get(self.relative_path(filename))
+            if recorded_sha256 is None or not os.path.exists(filename) or file_sha256(filename) != recorded_sha256:
+                return True
+        return False
+
+    def record(self, table, year, archive_sha256, parse_options, output_hashes):
+        """
+        :param output_hashes: {filename: SHA-256} of the files written for this node
+        """
+        self.nodes[self.node_key(table, year)] = {
+            "archive_sha256": archive_sha256,
+            "parse_options": parse_options,
+            "outputs": {self.relative_path(filename): digest for filename, digest in sorted(output_hashes.items())},
+        }
+
+    def archive_sha256(self, table, year):
+        """
+        :return: SHA-256 of the archive table and year were last parsed from, or None if the node was never recorded
+        """
+        node = self.nodes.get(self.node_key(table, year))
+        return None if node is None else node["archive_sha256"]
+
+    def outputs_digest(self):
+        """
+        :return: SHA-256 over the recorded outputs of every node, it changes whenever any stage 1 output changes
+        """
+        outputs = sorted((key, path, digest) for key, node in self.nodes.items()
+                         for path, digest in node["outputs"].items())
+        return hashlib.sha256(json.dumps(outputs).encode("utf-8")).hexdigest()
+
+    def is_reshape_stale(self, output_filename):
+        if self.reshape.get("inputs_digest") != self.outputs_digest():
+            return True
+        if self.reshape.get("output") != self.relative_path(output_filename) or not os.path.exists(output_filename):
+            return True
+        return file_sha256(output_filename) != self.reshape.get("output_sha256")
+
+    def record_reshape(self, output_filename):
+        self.reshape = {
+            "inputs_digest": self.outputs_digest(),
+            "output": self.relative_path(output_filename),
+            "output_sha256": file_sha256(output_filename),
+        }
+
+    def save(self):
+        with open(self.filename + PARTIAL_DOWNLOAD_SUFFIX, "w") as manifest_file:
+            json.dump({"nodes": dict(sorted(self.nodes.items())), "reshape": self.reshape}, manifest_file, indent=2)
+        os.replace(self.filename + PARTIAL_DOWNLOAD_SUFFIX, self.filename)
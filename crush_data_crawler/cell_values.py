@@ -0,0 +1,88 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Convert the value cells a parser gathered from a sheet into float64 in one pass over the whole block, and say what
+# every cell held, so that "0 tons" can be told from "not published" without reading the spreadsheet again.
+# Status of a cell, as int8 codes with STATUS_NAMES as their labels
+# * numeric -> a number, commas as thousands separators allowed
+# * zero -> a number equal to 0
+# * suppressed -> "--", kept as 0.0 as the parsers always read it, or a withheld marker such as "(D)", read as NaN
+# * footnoted -> a number with a footnote mark or other text around it, read by the parser's own fallback
+# * blank -> an empty cell, NaN
+# Plain numbers, blank cells and suppression markers are recognized with NumPy string operations over the whole block,
+# only the remaining cells go through the fallback one at a time.
+
+import re
+import numpy as np
+
+NUMERIC = 0
+ZERO = 1
+SUPPRESSED = 2
+FOOTNOTED = 3
+BLANK = 4
+STATUS_NAMES = ["numeric", "zero", "suppressed", "footnoted", "blank"]
+
+BLANK_CELLS = ["", "nan"]
+# Lowercase suppression markers -> value they are read as
+SUPPRESSED_CELLS = {
+    "--": 0.0,
+    "(d)": float("nan"),
+    "(na)": float("nan"),
+}
+# Footnote marks USDA appends to values, e.g. "1,234 1/" or "1,234*"
+FOOTNOTE_REGEX = re.compile(r"(\s*(\d+/|\*+))+$")
+NON_NUMERIC_REGEX = re.compile(r"[^\d\.]")
+# ASCII digits with at most one decimal point, other Unicode digits such as "²" are footnote marks float() rejects
+PLAIN_NUMBER_REGEX = re.compile(r"\d+\.?\d*|\.\d+", re.ASCII)
+
+
+def coerce_cells(cells, fallback):
+    """
+    :param cells: array of cell strings, of any shape
+    :param fallback: called as fallback(cell) for cells that are neither a plain number, blank nor suppressed, returns
+    their value or raises ValueError when the cell cannot be read
+    :return: (float64 array of values, int8 array of status codes), both shaped as cells
+    """
+    cells = np.asarray(cells, dtype=object).astype(str)
+    if cells.size == 0:
+        return np.zeros(cells.shape), np.zeros(cells.shape, dtype=np.int8)
+    stripped = np.char.lower(np.char.strip(cells))
+    without_commas = np.char.replace(stripped, ",", "")
+    # matched once for each distinct value instead of once for each cell
+    unique_values, inverse = np.unique(without_commas.ravel(), return_inverse=True)
+    unique_plain = np.array([PLAIN_NUMBER_REGEX.fullmatch(value) is not None for value in unique_values], dtype=bool)
+    plain = unique_plain[inverse.ravel()].reshape(cells.shape)
+    values = np.full(cells.shape, np.nan)
+    status = np.full(cells.shape, BLANK, dtype=np.int8)
+    values[plain] = without_commas[plain].astype(np.float64)
+    status[plain] = NUMERIC
+    for marker, value in SUPPRESSED_CELLS.items():
+        suppressed = stripped == marker
+        values[suppressed] = value
+        status[suppressed] = SUPPRESSED
+    other = ~plain & ~np.isin(stripped, BLANK_CELLS + list(SUPPRESSED_CELLS))
+    for index in zip(*np.nonzero(other)):
+        cell = cells[index]
+        try:
+            values[index] = float(cell.replace(",", ""))
+            status[index] = NUMERIC
+        except ValueError:
+            values[index] = fallback(cell)
+            status[index] = FOOTNOTED
+    status[(status == NUMERIC) & (values == 0)] = ZERO
+    return values, status
+
+
+def crush_cell_value(cell):
+    """
+    :return: value of a crush report cell that is not a plain number, "--" anywhere in it read as 0
+    """
+    return float(cell.replace(",", "").replace("--", "0.0"))
+
+
+def acreage_cell_value(cell):
+    """
+    :return: value of an acreage report cell that is not a plain number, without its footnote marks and any other
+    character than digits and decimal points
+    """
+    return float(NON_NUMERIC_REGEX.sub("", FOOTNOTE_REGEX.sub("", cell.strip().lower())))
@@ -0,0 +1,154 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Helpers shared by crush_data_crawler_lib.py and 12_acreage.py
+
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from downloader import MAX_CONCURRENT_DOWNLOADS
+from excel_reader import READER_BACKENDS, DEFAULT_READER_BACKEND
+from stage1_writer import OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT
+from parse_cache import DEFAULT_PARSE_CACHE_MAX_MB
+from instrumentation import Instrumentation, METRICS_FILENAME, PROFILE_DIR
+from shards import parse_shard
+
+# Values of the skip_download argument
+SKIP_DOWNLOAD_TRUE = "True"
+SKIP_DOWNLOAD_FALSE = "False"
+REFRESH = "Refresh"
+
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+DEFAULT_LOG_LEVEL = "INFO"
+
+
+def parse_year_list(years):
+    """
+    :param years: comma separated years, e.g. "2015,2020"
+    :return: list of years as int
+    """
+    return [int(year) for year in years.split(",") if len(year.strip()) > 0]
+
+
+def create_argument_parser(description):
+    """
+    :return: argparse.ArgumentParser with the arguments shared by all crawlers, crawlers may add their own arguments
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("begin_year", type=int, help="first year to crawl in YYYY")
+    parser.add_argument("end_year", type=int, help="last year to crawl in YYYY")
+    parser.add_argument("data_root", type=str, help="root directory of raw data and outputs")
+    parser.add_argument("skip_download", type=str, choices=[SKIP_DOWNLOAD_TRUE, SKIP_DOWNLOAD_FALSE, REFRESH],
+                        help="True to reuse raw data already downloaded, False to download everything again, "
+                             "Refresh to download and parse only the years whose file changed on the USDA website")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used to parse years in parallel, 1 parses years one at a time")
+    parser.add_argument("--downloads", type=int, default=MAX_CONCURRENT_DOWNLOADS,
+                        help="number of files downloaded at the same time")
+    parser.add_argument("--all-varieties", action="store_true",
+                        help="extract every variety row instead of only the interested grape names")
+    parser.add_argument("--extract", action="store_true",
+                        help="extract ZIP files into <raw data directory>/<year>/ for debugging, Excel files are read "
+                             "straight from ZIP files otherwise")
+    parser.add_argument("--reader", choices=READER_BACKENDS, default=DEFAULT_READER_BACKEND,
+                        help="backend used to read Excel files, see excel_reader.py")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT,
+                        help="write per-year CSV files, a Parquet dataset under <data_root>/Parquet, or both, "
+                             "see stage1_writer.py")
+    parser.add_argument("--parse-cache", type=str, default=None, metavar="DIR",
+                        help="reuse what was extracted from unchanged raw data by previous runs, cached in DIR")
+    parser.add_argument("--parse-cache-size", type=int, default=DEFAULT_PARSE_CACHE_MAX_MB, metavar="MB",
+                        help="size cap of the parse cache, least recently used entries are deleted above it")
+    parser.add_argument("--layout-plans", type=str, default=None, metavar="DIR",
+                        help="parse sheets laid out like a sheet parsed before without scanning them, by extraction "
+                             "plans recorded in DIR, see layout_plans.py")
+    parser.add_argument("--blob-store", type=str, default=None, metavar="DIR",
+                        help="keep raw data in DIR shared by all data roots, raw data directories only hold hard links "
+                             "to it, see blob_store.py")
+    parser.add_argument("--sqlite", type=str, default=None, metavar="FILE",
+                        help="also upsert every year written into the SQLite database FILE, see sqlite_warehouse.py")
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="K/N",
+                        help="only crawl the years assigned to shard K of N into data_root, merge the data roots of all "
+                             "N shards with merge_shards.py, see shards.py")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="download, parse and write years overlapped instead of one step for all years at a time, "
+                             "see pipeline.py")
+    parser.add_argument("--pipeline-depth", type=int, default=None, metavar="YEARS",
+                        help="with --pipeline, years downloaded or parsed but not written yet, bounds memory, "
+                             "defaults to twice the number of downloads or workers")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default=DEFAULT_LOG_LEVEL,
+                        help="DEBUG to also log what happens to every file, WARNING to only log problems")
+    parser.add_argument("--metrics", type=str, default=None, metavar="FILE",
+                        help="JSON lines file timings of every step and year are appended to, defaults to "
+                             "<data_root>/{}, see instrumentation.py".format(METRICS_FILENAME))
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also measure the peak memory allocated by Python in every step with tracemalloc, "
+                             "slows the run down")
+    parser.add_argument("--profile", type=parse_year_list, default=[], metavar="YEARS",
+                        help="comma separated years whose parsing runs under cProfile, e.g. 2015,2020")
+    parser.add_argument("--profile-dir", type=str, default=None, metavar="DIR",
+                        help="directory cProfile output is written to, defaults to <data_root>/{}".format(PROFILE_DIR))
+    return parser
+
+
+def parse_arguments(description):
+    return create_argument_parser(description).parse_args()
+
+
+def create_instrumentation(crawler, args):
+    """
+    :return: Instrumentation of a crawler run configured by the shared arguments, data_root must exist
+    """
+    metrics_filename = args.metrics if args.metrics is not None else os.path.join(args.data_root, METRICS_FILENAME)
+    profile_dir = args.profile_dir if args.profile_dir is not None else os.path.join(args.data_root, PROFILE_DIR)
+    return Instrumentation(crawler, metrics_filename, trace_memory=args.trace_memory, profile_years=args.profile,
+                           profile_dir=profile_dir)
+
+
+def iterate_years_in_order(function, jobs, workers=1, max_pending_jobs=None):
+    """
+    Call function for every job, in a process pool when workers > 1, and yield results in the same order as jobs as
+    soon as each of them is ready, so that a caller writing and dropping every result holds only the results of the
+    jobs in flight instead of all of them
+    :param function: module level function so that it can be sent to worker processes
+    :param jobs: list of (year, path, args) tuples, function is called as function(*args), year and path are only
+    used to report which job failed
+    :param workers: number of worker processes
+    :param max_pending_jobs: jobs submitted but not yielded yet, 2 * workers when None
+    """
+    if workers <= 1:
+        for year, path, args in jobs:
+            try:
+                result = function(*args)
+            except Exception as e:
+                raise RuntimeError("Failed processing year {} from {}".format(year, path)) from e
+            yield result
+        return
+    if max_pending_jobs is None:
+        max_pending_jobs = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        waiting_jobs = deque(jobs)
+        # (year, path, future) in jobs order
+        pending = deque()
+        try:
+            while len(waiting_jobs) > 0 or len(pending) > 0:
+                while len(waiting_jobs) > 0 and len(pending) < max_pending_jobs:
+                    year, path, args = waiting_jobs.popleft()
+                    pending.append((year, path, executor.submit(function, *args)))
+                year, path, future = pending.popleft()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    raise RuntimeError("Failed processing year {} from {}".format(year, path)) from e
+                yield result
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def map_years_in_order(function, jobs, workers=1):
+    """
+    Call function for every job, in a process pool when workers > 1, and return results in the same order as jobs
+    :return: list of function results in jobs order, see iterate_years_in_order
+    """
+    return list(iterate_years_in_order(function, jobs, workers))
@@ -1,27 +1,68 @@
 # Author: Yuhan Wang <onewang@ucdavis.edu>
 # Developed in Python 3.9
 
-import sys
 import requests
 from bs4 import BeautifulSoup
 import re
 from urllib.parse import urljoin
 from collections import defaultdict
 from collections import OrderedDict
+from collections import namedtuple
+import logging
 import os
 import zipfile
-import csv
-import pandas as pd
+import numpy as np
 from pathlib import Path
+from crawler_common import parse_arguments, iterate_years_in_order, create_instrumentation, SKIP_DOWNLOAD_TRUE, REFRESH
+from downloader import create_session, refresh_file, run_concurrently, load_download_state, save_download_state
+from archive_reader import list_excel_files, open_excel_file, describe_excel_file
+from excel_reader import open_workbook, DEFAULT_READER_BACKEND
+from sheet_scanner import normalize_cells, column_major_locations, cells_containing
+from variety_matcher import compile_variety_matcher, match_varieties, rows_with_values
+from stage1_writer import Stage1Writer
+from shards import in_shard, record_shard
+from sqlite_warehouse import SQLiteWarehouse, year_result_observations
+from year_result import YearResult
+from cell_values import coerce_cells, crush_cell_value
+from layout_plans import LayoutPlans, sheet_fingerprint, header_row_labels, find_or_plan
+from parse_cache import ParseCache, parse_with_cache, source_sha256
+from build_manifest import BuildManifest
+from blob_store import BlobStore
+from pipeline import run_pipeline
+from instrumentation import configure_logging, measured_call, path_size
+
+logger = logging.getLogger(__name__)
 
 USDA_NASS_CA_CRUSH_REPORT_URL = "https://www.nass.usda.gov/Statistics_by_State/California/Publications/Specialty_and_Other_Releases/Grapes/Crush/Reports/index.php"
 CRUSH_ZIP_RELATIVE_URL_REGEX_PATTERN = r"\.\./(?P<type>.*)/(?P<year>[0-9]{4})/.*\.zip"
 ERRATA_TYPE = "Errata"
 FINAL_TYPE = "Final"
-RAW_DATA_DIR = "VolumeRaw"
-OUTPUT_DIR = "Volume"
-FILE_POSTFIX = "02"
 
+# Every crush table is published in the same per-year ZIP, a table is identified by the postfix of its file name
+# raw_data_dir -> where ZIP files are downloaded and unzipped when crawling this table alone
+# output_dir -> where CSV files of this table are written
+# file_postfix -> the Excel file in the ZIP whose stem ends with this postfix contains this table
+CrushTable = namedtuple("CrushTable", ["raw_data_dir", "output_dir", "file_postfix"])
+VOLUME_TABLE = CrushTable("VolumeRaw", "Volume", "02")
+DEGREE_BRIX_TABLE = CrushTable("DegreeBrixRaw", "DegreeBrix", "03")
+PURCHASED_VOLUME_TABLE = CrushTable("PurchasedVolumeRaw", "PurchasedVolume", "04")
+PURCHASED_DEGREE_BRIX_TABLE = CrushTable("PurchasedDegreeBrixRaw", "PurchasedDegreeBrix", "05")
+PRICE_TABLE = CrushTable("PriceRaw", "Price", "06")
+ALL_CRUSH_TABLES = [
+    VOLUME_TABLE,
+    DEGREE_BRIX_TABLE,
+    PURCHASED_VOLUME_TABLE,
+    PURCHASED_DEGREE_BRIX_TABLE,
+    PRICE_TABLE,
+]
+# Raw data directory shared by all tables when they are crawled together in one pass
+ALL_CRUSH_TABLES_RAW_DATA_DIR = "CrushRaw"
+
+# Bump whenever extract_data_from_excel returns something different for the same Excel file, so that results cached
+# by parse_cache.py are parsed again
+PARSER_VERSION = 3
+# Parser name in parse cache keys and layout plan fingerprints
+PARSER_NAME = "crush"
 MAX_REGION_ID = 100
 VARIETY = "VARIETY"
 TYPE_AND_VARIETY = "Type and Variety"
@@ -55,12 +96,13 @@ INTERESTED_GRAPE_NAMES = OrderedDict({
     "Total All Varieties": "NA",
 })
 INTERESTED_GRAPE_NAMES = {k.lower(): v.lower() for k, v in INTERESTED_GRAPE_NAMES.items()}
+INTERESTED_GRAPE_NAME_MATCHER = compile_variety_matcher(INTERESTED_GRAPE_NAMES.keys())
 
 
 
-def get_all_zip_file_paths(url_containing_zips):
+def get_all_zip_file_paths(url_containing_zips, session=requests):
     # print(zips_page)
-    zips_source = requests.get(url_containing_zips).text
+    zips_source = session.get(url_containing_zips).text
     zip_soup = BeautifulSoup(zips_source, "html.parser")
     # in year -> (type, url) format
     # 创建一个空的字典，默认从一个东西映射到一个list，如果这个东西不存在，自动创造一个空的list还给你
@@ -73,8 +115,8 @@ def get_all_zip_file_paths(url_containing_zips):
         report_type = zip_url_matched.group('type')
         year = int(zip_url_matched.group('year'))
         zip_url = urljoin(url_containing_zips, zip_relative_url)
-        print('found_zip_file_path:[{}]year={},type={},url={}'.format(zip_file_clickable_button.text, year, report_type,
-                                                                      zip_url))
+        logger.debug("found_zip_file_path:[%s]year=%s,type=%s,url=%s", zip_file_clickable_button.text, year,
+                     report_type, zip_url)
         zip_url_dict[year].append((report_type, zip_url))
 
     # 2021 : [
@@ -91,55 +133,123 @@ def get_all_zip_file_paths(url_containing_zips):
     return zip_url_dict
 
 
-def download_zip(target_path, year, zip_url, skip_download=False):
+def download_zip(target_path, year, zip_url, skip_download=False, session=None, previous_state=None, blob_store=None):
+    """
+    :param previous_state: download state of this year's ZIP file saved by a previous run, when given the ZIP file is
+    only downloaded again if it changed on the USDA website
+    :param blob_store: BlobStore the ZIP file is kept in and linked from, None to download it into target_path
+    :return: (filename, changed, state), changed is False if the ZIP file is the same as described by previous_state
+    """
     filename = os.path.join(target_path, "{}.zip".format(year))
     if skip_download:
-        return filename
-    r = requests.get(zip_url)
-    with open(filename, 'wb') as zipFile:
-        zipFile.write(r.content)
-    return filename
+        return filename, True, previous_state
+    if session is None:
+        session = create_session()
+    if blob_store is not None:
+        changed, state = blob_store.refresh_file(session, zip_url, filename, previous_state=previous_state)
+    else:
+        changed, state = refresh_file(session, zip_url, filename, previous_state=previous_state)
+    logger.info("%s %s", "Downloaded..." if changed else "Unchanged...", filename)
+    return filename, changed, state
 
 
-def unzip_files(unzip_target_directory, path_to_zip_file):
+def unzip_files(unzip_target_directory, path_to_zip_file, blob_store=None):
+    if blob_store is not None:
+        return blob_store.extract_zip(path_to_zip_file, unzip_target_directory)
     with zipfile.ZipFile(path_to_zip_file, 'r') as zip_ref:
         zip_ref.extractall(unzip_target_directory)
     return unzip_target_directory
 
 
-def extract_data_from_excel(unzipped_dir_for_year):
-    all_files = [f for f in os.listdir(unzipped_dir_for_year) if os.path.isfile(os.path.join(unzipped_dir_for_year, f))]
-    print("all files", all_files)
-    all_excel_files = [f for f in all_files if (f.lower().endswith("xls") or f.lower().endswith("xlsx"))]
-    print("all_excel_files", all_excel_files)
-    files_ends_with_postfix = [f for f in all_excel_files if Path(f).stem.endswith(FILE_POSTFIX)]
-    print("file_ends_with_{}".format(FILE_POSTFIX), files_ends_with_postfix)
-    if len(files_ends_with_postfix) > 1:
-        print("More than one files end with {}".format(FILE_POSTFIX))
-        return None
-    if len(files_ends_with_postfix) == 0:
-        print("No file ends with {}".format(FILE_POSTFIX))
-        return None
-    # file_ends_with_postfix_path -> Volume/2002/XXXXgcbtb02.xls
-    file_ends_with_postfix_path = os.path.join(unzipped_dir_for_year, files_ends_with_postfix[0])
-    print("Parsing...", file_ends_with_postfix_path)
-    data_frame = pd.read_excel(file_ends_with_postfix_path, sheet_name=0)
-    num_rows, num_cols = data_frame.shape
-    print("Shape: ", data_frame.shape)
+def find_layout(grid, file_path):
+    """
+    Scan a sheet for its type and variety headers and the region of every column right of them
+    :param grid: cells of the sheet below its first row
+    :return: extraction plan of the sheet, see layout_plans.py
+    """
+    num_rows, num_cols = grid.shape
+    # lowercase string of every cell, computed once for all the scanning below
+    cells = normalize_cells(grid)
     # find where are the type and variety headers
     # (1, 2), (3, 5)
     type_and_variety_locations = []
-    for col in range(num_cols):
-        for row in range(num_rows):
-            value = str(data_frame.iat[row, col])
-            if (TYPE_AND_VARIETY.lower() in value.lower()) or (VARIETY.lower() in value.lower()):
-                if abs(row - num_rows) < 3:
-                    print("Discard header position less than 3 cells away from bottom edge", (row, col))
-                    continue
-                type_and_variety_locations.append((row, col))
+    header_mask = cells_containing(cells, [TYPE_AND_VARIETY.lower(), VARIETY.lower()])
+    for row, col in column_major_locations(header_mask):
+        if abs(row - num_rows) < 3:
+            logger.debug("Discard header position less than 3 cells away from bottom edge %s", (row, col))
+            continue
+        type_and_variety_locations.append((row, col))
     # make sure we found something
     if len(type_and_variety_locations) == 0:
-        print("Did not find {} location".format(TYPE_AND_VARIETY))
+        logger.warning("Did not find %s location in %s", TYPE_AND_VARIETY, file_path)
+    headers = []
+    max_col_header = max([header[1] for header in type_and_variety_locations])
+    for row_header, col_header in type_and_variety_locations:
+        columns, end_col = decode_region_columns(grid[row_header, col_header + 1:].tolist(), col_header + 1,
+                                                 max_col_header == col_header)
+        headers.append({"row": row_header, "col": col_header,
+                        "labels": header_row_labels(grid, row_header, col_header, end_col), "columns": columns})
+    return {"headers": headers}
+
+
+def decode_region_columns(header_cells, first_col, with_state_total):
+    """
+    Decode once for all variety rows of a header which region each column right of it holds
+    :param header_cells: cells of the header row right of the header cell
+    :param first_col: column of header_cells[0]
+    :param with_state_total: take the first column without a region code as the state total, only done for the
+    rightmost header of a sheet
+    :return: ([[column, region id]] of every column read for a variety, column after the last one decoded)
+    """
+    columns = []
+    parsed_total_data_for_this_year = False
+    for col_production, region_id in enumerate(header_cells, first_col):
+        discard_value = False
+        try:
+            region_id = int(region_id)
+            if region_id > MAX_REGION_ID:
+                discard_value = True
+        except ValueError:
+            # header is no longer number, so we are no longer in region codes
+            discard_value = True
+        if discard_value:
+            # Only take the state total for this year if we are at max_col_header
+            if with_state_total and not parsed_total_data_for_this_year:
+                region_id = MAX_REGION_ID
+                parsed_total_data_for_this_year = True
+            else:
+                return columns, col_production + 1
+        columns.append([col_production, region_id])
+    return columns, first_col + len(header_cells)
+
+
+def extract_data_from_excel(excel_source_for_year, file_postfix, all_varieties=False, reader=DEFAULT_READER_BACKEND,
+                            layout_plans=None):
+    """
+    :param excel_source_for_year: this year's ZIP file, or the directory it was extracted to
+    :param reader: Excel reader backend, one of excel_reader.READER_BACKENDS
+    :param layout_plans: LayoutPlans to parse sheets with a known layout without scanning them, or None
+    """
+    all_excel_files = list_excel_files(excel_source_for_year)
+    logger.debug("all_excel_files %s", all_excel_files)
+    files_ends_with_postfix = [f for f in all_excel_files if Path(f).stem.endswith(file_postfix)]
+    logger.debug("file_ends_with_%s %s", file_postfix, files_ends_with_postfix)
+    if len(files_ends_with_postfix) > 1:
+        logger.warning("More than one files end with %s in %s", file_postfix, excel_source_for_year)
+        return None
+    if len(files_ends_with_postfix) == 0:
+        logger.warning("No file ends with %s in %s", file_postfix, excel_source_for_year)
+        return None
+    # file_ends_with_postfix_path -> VolumeRaw/2002.zip:XXXXgcbtb02.xls
+    file_ends_with_postfix_path = describe_excel_file(excel_source_for_year, files_ends_with_postfix[0])
+    logger.debug("Parsing... %s", file_ends_with_postfix_path)
+    workbook = open_workbook(open_excel_file(excel_source_for_year, files_ends_with_postfix[0]),
+                             files_ends_with_postfix[0], backend=reader)
+    # skip the first row, it is the column labels when the sheet is read as a table
+    grid = workbook.read_grid(0)[1:]
+    logger.debug("Shape: %s", grid.shape)
+    plan = find_or_plan(layout_plans, sheet_fingerprint([PARSER_NAME, PARSER_VERSION], workbook.sheet_names[0], grid),
+                        grid, lambda: find_layout(grid, file_ends_with_postfix_path))
     # find grape by name
     # chardonnay : [
     #    (1, 235.35),
@@ -148,42 +258,29 @@ def extract_data_from_excel(unzipped_dir_for_year):
     #    (4, 34.5),
     #]
     grape_production_data = defaultdict(list)
-    # A in B -> A是不是在B里面
-    # for a in B -> 遍历B里面的所有值，遍历时使用的变量名为a
     # 把每个表头都看一遍
-    max_col_header = max([header[1] for header in type_and_variety_locations])
-    for row_header, col_header in type_and_variety_locations:
-        for row_grape in range(row_header, num_rows):
-            grape_name = str(data_frame.iat[row_grape, col_header])
-            matched_grape_name = None
-            for interested_grape_name in INTERESTED_GRAPE_NAMES.keys():
-                if interested_grape_name.lower() in grape_name.lower():
-                    matched_grape_name = interested_grape_name.lower()
-            if matched_grape_name is not None:
-                parsed_total_data_for_this_year = False
-                for col_production in range(col_header + 1, num_cols):
-                    region_id = data_frame.iat[row_header, col_production]
-                    discard_value = False
-                    try:
-                        region_id = int(region_id)
-                        if region_id > MAX_REGION_ID:
-                            discard_value = True
-                    except ValueError:
-                        # header is no longer number, so we are no longer in region codes
-                        discard_value = True
-                    if discard_value:
-                        # Only take the state total for this year if we are at max_col_header
-                        if max_col_header == col_header and not parsed_total_data_for_this_year:
-                            region_id = MAX_REGION_ID
-                            parsed_total_data_for_this_year = True
-                        else:
-                            break
-                    region_production_tons = float(str(data_frame.iat[row_grape, col_production]).replace(",", "")
-                                                   .replace("--", "0.0"))
-                    grape_production_data[matched_grape_name].append((region_id, region_production_tons))
+    for header in plan["headers"]:
+        row_header, col_header = header["row"], header["col"]
+        # variety name for every row from the header to the bottom, None for rows we are not interested in
+        row_has_values = rows_with_values(normalize_cells(grid[row_header:, col_header + 1:])) if all_varieties \
+            else None
+        matched_grape_names = match_varieties(normalize_cells(grid[row_header:, col_header]),
+                                              INTERESTED_GRAPE_NAME_MATCHER, all_varieties=all_varieties,
+                                              row_has_values=row_has_values)
+        rows_grape = [row_offset for row_offset, matched_grape_name in enumerate(matched_grape_names)
+                      if matched_grape_name is not None]
+        region_ids = [region_id for _, region_id in header["columns"]]
+        cols_production = [col_production for col_production, _ in header["columns"]]
+        # cells of every variety row in every column of the header, gathered and converted at once
+        values, status = coerce_cells(grid[np.ix_(np.array(rows_grape, dtype=int) + row_header,
+                                                  np.array(cols_production, dtype=int))], crush_cell_value)
+        for row_offset, row_values, row_status in zip(rows_grape, values.tolist(), status.tolist()):
+            matched_grape_name = matched_grape_names[row_offset]
+            for region_id, region_production_tons, cell_status in zip(region_ids, row_values, row_status):
+                grape_production_data[matched_grape_name].append((region_id, region_production_tons, cell_status))
     for key in grape_production_data.keys():
         grape_production_data[key].sort(key=lambda x: x[0])
-    return grape_production_data
+    return YearResult.from_grape_data(grape_production_data)
 
 
 def select_url_based_on_available_types(types_and_urls):
@@ -200,78 +297,179 @@ def select_url_based_on_available_types(types_and_urls):
     return selected_url
 
 
-def crawl():
-    if len(sys.argv) < 5:
-        print(
-            "Not enough arguments, needed at least 5, with 'begin_year' in YYYY, and 'end_year' in YYYY, data_root as string, skip download as True|False")
-        return 1
-    begin_year = int(sys.argv[1])
-    end_year = int(sys.argv[2])
-    data_root = str(sys.argv[3])
-    skip_download = str(sys.argv[4]) == "True"
-    print("Step 0 Creating data root at ", data_root)
+def crawl(tables, raw_data_dir=None, args=None):
+    """
+    Download each year's crush report once and extract every table in tables from it
+    :param tables: list of CrushTable to extract, e.g. [VOLUME_TABLE] or ALL_CRUSH_TABLES
+    :param raw_data_dir: directory name under data_root for ZIP files, defaults to the table's own raw_data_dir when
+    crawling a single table, or ALL_CRUSH_TABLES_RAW_DATA_DIR when crawling several tables together
+    :param args: parsed command line arguments, parsed from sys.argv when None
+    :return: 0 on success, non-zero on failure
+    """
+    if args is None:
+        args = parse_arguments("Crawl {} tables from USDA grape crush reports".format(
+            ", ".join(table.output_dir for table in tables)))
+    if raw_data_dir is None:
+        raw_data_dir = tables[0].raw_data_dir if len(tables) == 1 else ALL_CRUSH_TABLES_RAW_DATA_DIR
+    begin_year = args.begin_year
+    end_year = args.end_year
+    data_root = args.data_root
+    skip_download = args.skip_download == SKIP_DOWNLOAD_TRUE
+    refresh = args.skip_download == REFRESH
+    configure_logging(args.log_level)
+    logger.info("Step 0 Creating data root at %s", data_root)
     os.makedirs(data_root, exist_ok=True)
-    raw_data_root = os.path.join(data_root, RAW_DATA_DIR)
+    raw_data_root = os.path.join(data_root, raw_data_dir)
     os.makedirs(raw_data_root, exist_ok=True)
-    print("Step 1 Parsing website data")
-    zip_url_dict = get_all_zip_file_paths(USDA_NASS_CA_CRUSH_REPORT_URL)
+    instrumentation = create_instrumentation("crush", args)
+    writer = Stage1Writer(data_root, INTERESTED_GRAPE_NAMES, MAX_REGION_ID, output_format=args.output_format,
+                          all_varieties=args.all_varieties)
+    warehouse = SQLiteWarehouse(args.sqlite) if args.sqlite else None
+    parse_cache = ParseCache(args.parse_cache, args.parse_cache_size) if args.parse_cache else None
+    layout_plans = LayoutPlans(args.layout_plans) if args.layout_plans else None
+    blob_store = BlobStore(args.blob_store) if args.blob_store else None
+    manifest = BuildManifest(data_root)
+    parse_options_by_table = OrderedDict(
+        (table, {"parser": PARSER_NAME, "version": PARSER_VERSION, "postfix": table.file_postfix,
+                 "varieties": list(INTERESTED_GRAPE_NAMES), "all_varieties": args.all_varieties, "reader": args.reader})
+        for table in tables)
+    session = create_session(args.downloads)
+    logger.info("Step 1 Parsing website data")
+    with instrumentation.stage("index"):
+        zip_url_dict = get_all_zip_file_paths(USDA_NASS_CA_CRUSH_REPORT_URL, session=session)
     for year, types_and_urls in sorted(zip_url_dict.items()):
-        print(year, types_and_urls)
-    print("Step 2 Downloading ZIP files for selected years")
-    # in (year, path) format
-    # [(2020, XXX/Volume/2020.zip), (2021, XXX/Volume/2021.zip)]
-    zip_file_local_paths = []
+        logger.debug("%s %s", year, types_and_urls)
+    logger.info("Step 2 Downloading ZIP files for selected years, %s at a time", args.downloads)
+    download_state = load_download_state(raw_data_root)
+    download_jobs = []
     for year in range(begin_year, end_year + 1):
+        if not in_shard(args.shard, PARSER_NAME, year):
+            continue
         if year not in zip_url_dict:
-            print("{} not in parsed zip url list".format(year))
+            logger.error("%s not in parsed zip url list", year)
             return 2
         types_and_urls = zip_url_dict[year]
         selected_url = select_url_based_on_available_types(types_and_urls)
-        downloaded_zip_path = download_zip(raw_data_root, year, selected_url, skip_download=skip_download)
-        zip_file_local_paths.append((year, downloaded_zip_path))
-        print("Downloaded...", downloaded_zip_path)
-    print("Step 3 unzipping data")
-    unzipped_excel_files = []
-    # [(2020, "2020.zip"), (2021, "2021.zip")]
-    for year, path_to_zip_file in zip_file_local_paths:
-        print("Unzipping...", path_to_zip_file)
+        previous_state = download_state.get(year) if refresh else None
+        download_jobs.append((raw_data_root, year, selected_url, skip_download, session, previous_state, blob_store))
+    # archive SHA-256 of every downloaded year, recorded in the manifest with its outputs
+    archive_sha256_by_year = {}
+
+    def select_year(year, path, changed, state):
+        """
+        :return: True if the year has to be parsed, False if its ZIP file and outputs did not change
+        """
+        if state is not None:
+            download_state[year] = state
+        archive_sha256_by_year[year] = state["sha256"] if state is not None else source_sha256(path)
+        stale = any(manifest.is_stale(table.output_dir, year, archive_sha256_by_year[year], parse_options,
+                                      writer.output_filenames(table.output_dir, year))
+                    for table, parse_options in parse_options_by_table.items())
+        if not changed and not stale:
+            logger.info("Skipping %s as its ZIP file and outputs did not change", year)
+            return False
+        return True
+
+    def excel_source_of(year, path_to_zip_file):
+        """
+        :return: where Excel files of the year are read from, the ZIP file unless it is extracted for debugging
+        """
+        if not args.extract:
+            return path_to_zip_file
+        logger.debug("Unzipping... %s", path_to_zip_file)
         unzipped_dir_for_year = os.path.join(raw_data_root, "{}".format(year))
-        unzip_files(unzipped_dir_for_year, path_to_zip_file)
-        unzipped_excel_files.append((year, unzipped_dir_for_year))
-    print("Step 4 extract data from excels")
-    grape_data_by_year = []
-    # [(2020, "XXX/Volume/2020"), (2021, "XXXX/Volume/2021")]
-    for year, unzipped_dir_for_year in unzipped_excel_files:
-        print("Parsing...", unzipped_dir_for_year)
-        grape_data_this_year = extract_data_from_excel(unzipped_dir_for_year)
-        if grape_data_this_year is None:
-            raise ValueError("grape_data_this_year is None")
-        grape_data_by_year.append((year, grape_data_this_year))
-    csv_data_root = os.path.join(data_root, OUTPUT_DIR)
-    os.makedirs(csv_data_root, exist_ok=True)
-    print("Step 5 write data to OUTPUT_DIR")
-    for year, grape_data_this_year in grape_data_by_year:
-        csv_filename = os.path.join(csv_data_root, "{}.csv".format(year))
-        print("Writing to {}".format(csv_filename))
-        grape_data_this_year_dict = []
-        header = [TYPE_AND_VARIETY, WINE_CATEGORY]
-        for key, value in grape_data_this_year.items():
-            if key not in INTERESTED_GRAPE_NAMES:
-                raise ValueError("key {} not found in INTERESTED_GRAPE_NAMES, check your parser step".format(key))
-            this_grape_dict = {TYPE_AND_VARIETY: key, WINE_CATEGORY: INTERESTED_GRAPE_NAMES[key]}
-            for region_id, production_quantity_tons in value:
-                if str(region_id) == str(MAX_REGION_ID):
-                    region_id = "California"
-                if str(region_id) not in header:
-                    header.append(str(region_id))
-                this_grape_dict[str(region_id)] = "{:.1f}".format(production_quantity_tons)
-            grape_data_this_year_dict.append(this_grape_dict)
-        interested_grape_names_lower = [x.lower() for x in INTERESTED_GRAPE_NAMES.keys()]
-        grape_data_this_year_dict = sorted(grape_data_this_year_dict, key=lambda x: interested_grape_names_lower.index(x[TYPE_AND_VARIETY]))
-        with open(csv_filename, 'w', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=header)
-            writer.writeheader()
-            writer.writerows(grape_data_this_year_dict)
-    print("Done")
-    return 0
+        with instrumentation.stage("unzip", year=year) as record:
+            unzip_files(unzipped_dir_for_year, path_to_zip_file, blob_store=blob_store)
+            record["bytes_in"] = path_size(path_to_zip_file)
+            record["bytes_out"] = path_size(unzipped_dir_for_year)
+        return unzipped_dir_for_year
+
+    def parse_jobs_of(year, excel_source_for_year):
+        """
+        :return: one measured_call job per table, as (year, path, args) for iterate_years_in_order
+        """
+        # [(2020, "XXX/Volume/2020.zip", ("parse", 2020, "Volume", False, None, 1234, parse_with_cache,
+        #   (cache, options, "XXX/Volume/2020.zip", extract_data_from_excel,
+        #    ("XXX/Volume/2020.zip", "02", False, "pandas", plans)))), (2020, ...)]
+        return [(year, excel_source_for_year,
+                 ("parse", year, table.output_dir, args.trace_memory,
+                  instrumentation.profile_filename("parse", year, table.output_dir),
+                  path_size(excel_source_for_year), parse_with_cache,
+                  (parse_cache, parse_options, excel_source_for_year, extract_data_from_excel,
+                   (excel_source_for_year, table.file_postfix, args.all_varieties, args.reader, layout_plans))))
+                for table, parse_options in parse_options_by_table.items()]
 
+    def write_year(year, measured_results):
+        """
+        :param measured_results: (grape_data_this_year, record) of every table in tables order
+        """
+        warehouse_tables = []
+        for table, (grape_data_this_year, parse_record) in zip(tables, measured_results):
+            instrumentation.add(parse_record)
+            if grape_data_this_year is None:
+                raise ValueError("grape_data_this_year is None for {} table in {}".format(table.output_dir, year))
+            with instrumentation.stage("write", year=year, table=table.output_dir) as record:
+                output_hashes = writer.write(table.output_dir, year, grape_data_this_year)
+                record["bytes_out"] = sum(path_size(filename) for filename in output_hashes)
+            manifest.record(table.output_dir, year, archive_sha256_by_year[year], parse_options_by_table[table],
+                            output_hashes)
+            if warehouse is not None:
+                warehouse_tables.append((table.output_dir, archive_sha256_by_year[year],
+                                         year_result_observations(*writer.rows(grape_data_this_year),
+                                                                  grape_data_this_year)))
+        if warehouse is not None:
+            with instrumentation.stage("sqlite", year=year) as record:
+                record["rows"] = warehouse.upsert_year(year, warehouse_tables)
+
+    if args.pipeline:
+        logger.info("Steps 2 to 5 pipelined with %s download(s) and %s worker(s)", args.downloads, args.workers)
+        with instrumentation.stage("pipeline") as pipeline_record:
+            pipeline_record["bytes_in"] = 0
+
+            def prepare_year(year, download_result):
+                path, changed, state = download_result
+                if changed and not skip_download:
+                    pipeline_record["bytes_in"] += path_size(path)
+                if not select_year(year, path, changed, state):
+                    return None
+                return parse_jobs_of(year, excel_source_of(year, path))
+
+            run_pipeline([(job[1], job) for job in download_jobs], download_zip, prepare_year, measured_call,
+                         write_year, downloads=args.downloads, workers=args.workers,
+                         max_pending_years=args.pipeline_depth)
+        if not skip_download:
+            save_download_state(raw_data_root, download_state)
+    else:
+        with instrumentation.stage("download") as record:
+            download_results = run_concurrently(download_zip, download_jobs, max_concurrent=args.downloads)
+            record["bytes_in"] = sum(path_size(path) for path, changed, _ in download_results
+                                     if changed and not skip_download)
+        # in (year, path) format
+        # [(2020, XXX/Volume/2020.zip), (2021, XXX/Volume/2021.zip)]
+        zip_file_local_paths = [(job[1], path) for job, (path, changed, state) in zip(download_jobs, download_results)
+                                if select_year(job[1], path, changed, state)]
+        if not skip_download:
+            save_download_state(raw_data_root, download_state)
+        if args.extract:
+            logger.info("Step 3 unzipping data")
+        # [(2020, "2020.zip"), (2021, "2021.zip")]
+        excel_sources = [(year, excel_source_of(year, path_to_zip_file))
+                         for year, path_to_zip_file in zip_file_local_paths]
+        logger.info("Steps 4 and 5 extract data from excels with %s worker(s) and write each year to output "
+                    "directories once parsed", args.workers)
+        parse_jobs = [job for year, excel_source_for_year in excel_sources
+                      for job in parse_jobs_of(year, excel_source_for_year)]
+        measured_results = iterate_years_in_order(measured_call, parse_jobs, workers=args.workers)
+        for year, _ in excel_sources:
+            # the parse jobs of a year are its tables, one after the other
+            write_year(year, [next(measured_results) for _ in tables])
+    if parse_cache is not None:
+        logger.info("Evicted %s parse cache entries", parse_cache.evict())
+    if warehouse is not None:
+        warehouse.close()
+    manifest.save()
+    if args.shard is not None:
+        record_shard(data_root, PARSER_NAME, args, [table.output_dir for table in tables], manifest)
+    instrumentation.log_summary()
+    logger.info("Done")
+    return 0
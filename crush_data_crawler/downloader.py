@@ -0,0 +1,195 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Download USDA archives through one pooled requests.Session, a few at a time, streaming each response into a
+# <filename>.part file which is renamed to <filename> once complete. A .part file left by an interrupted run is
+# resumed with an HTTP Range request. The url, ETag and Last-Modified of the response a .part file was started from are
+# saved next to it in <filename>.part.json and sent back as If-Range, so the server sends the whole file again instead
+# of the rest of it when the file changed since. A .part file of another url, or without a strong ETag or
+# Last-Modified to resume it by, is deleted and downloaded again.
+#
+# Each downloaded file also gets a download state (url, ETag, Last-Modified and SHA-256 of its content) saved in
+# DOWNLOAD_STATE_FILENAME next to it, so that later runs can ask the server to send the file only if it changed.
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_DOWNLOADS = 4
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = 60
+PARTIAL_DOWNLOAD_SUFFIX = ".part"
+RESUME_STATE_SUFFIX = ".json"
+DOWNLOAD_STATE_FILENAME = "download_state.json"
+
+
+def create_session(max_concurrent_downloads=MAX_CONCURRENT_DOWNLOADS):
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=max_concurrent_downloads, pool_maxsize=max_concurrent_downloads,
+                          max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def resume_validator(resume_state, url):
+    """
+    :param resume_state: url, ETag and Last-Modified saved with a .part file, or None
+    :return: If-Range value a .part file of url can be resumed with, None if it has to be downloaded again
+    """
+    if resume_state is None or resume_state.get("url") != url:
+        return None
+    etag = resume_state.get("etag")
+    # weak ETags cannot be used with If-Range
+    if etag and not etag.startswith("W/"):
+        return etag
+    return resume_state.get("last_modified") or None
+
+
+def load_resume_state(resume_state_filename):
+    """
+    :return: resume state saved in resume_state_filename, None if there is none or it cannot be read
+    """
+    try:
+        with open(resume_state_filename) as resume_state_file:
+            return json.load(resume_state_file)
+    except (OSError, ValueError):
+        return None
+
+
+def remove_if_exists(filename):
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def download_to_file(session, url, filename, chunk_size=DOWNLOAD_CHUNK_SIZE, previous_state=None):
+    """
+    Stream url into filename, resuming from filename.part if a previous download was interrupted
+    :param session: requests.Session shared by all downloads
+    :param previous_state: download state of the copy of filename on disk, when given the server is asked to send the
+    file only if it changed since then
+    :return: response headers, or None if the server answered 304 Not Modified and filename was left untouched
+    """
+    partial_filename = filename + PARTIAL_DOWNLOAD_SUFFIX
+    resume_state_filename = partial_filename + RESUME_STATE_SUFFIX
+    resume_from = 0
+    if os.path.exists(partial_filename):
+        resume_from = os.path.getsize(partial_filename)
+    validator = resume_validator(load_resume_state(resume_state_filename), url) if resume_from > 0 else None
+    if resume_from > 0 and validator is None:
+        logger.warning("Cannot tell whether %s still holds the start of %s, downloading it again", partial_filename,
+                       url)
+        os.remove(partial_filename)
+        resume_from = 0
+    headers = {}
+    if resume_from > 0:
+        logger.info("Resuming %s from byte %s", url, resume_from)
+        headers["Range"] = "bytes={}-".format(resume_from)
+        headers["If-Range"] = validator
+    elif previous_state is not None:
+        if previous_state.get("etag"):
+            headers["If-None-Match"] = previous_state["etag"]
+        if previous_state.get("last_modified"):
+            headers["If-Modified-Since"] = previous_state["last_modified"]
+    with session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT_SECONDS) as r:
+        if r.status_code == 304:
+            return None
+        if r.status_code == 416:
+            # The partial file does not fit the file on the server anymore, start over
+            logger.warning("Server refused to resume %s, downloading it again", url)
+            os.remove(partial_filename)
+            remove_if_exists(resume_state_filename)
+            return download_to_file(session, url, filename, chunk_size=chunk_size, previous_state=previous_state)
+        r.raise_for_status()
+        mode = "wb"
+        if r.status_code == 206:
+            content_range = r.headers.get("Content-Range", "")
+            if not content_range.startswith("bytes {}-".format(resume_from)):
+                raise RuntimeError("Unexpected Content-Range {} when resuming {} from byte {}"
+                                   .format(content_range, url, resume_from))
+            mode = "ab"
+        else:
+            if resume_from > 0:
+                logger.info("%s changed since %s was started, downloading it again", url, partial_filename)
+            # saved before the first byte, so that an interrupted download is resumed from the same file only
+            with open(resume_state_filename, "w") as resume_state_file:
+                json.dump({"url": url, "etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")},
+                          resume_state_file)
+        with open(partial_filename, mode) as partial_file:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    partial_file.write(chunk)
+        response_headers = r.headers
+    os.replace(partial_filename, filename)
+    remove_if_exists(resume_state_filename)
+    return response_headers
+
+
+def file_sha256(filename):
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def refresh_file(session, url, filename, previous_state=None):
+    """
+    Download url into filename, unless previous_state shows the copy on disk is still the same as the one on the server
+    :param previous_state: download state returned by the last refresh_file call for filename, or None to always
+    download the file
+    :return: (changed, state), changed is False when filename has the same content as described by previous_state
+    """
+    if previous_state is not None and (previous_state.get("url") != url or not os.path.exists(filename)):
+        previous_state_for_request = None
+    else:
+        previous_state_for_request = previous_state
+    response_headers = download_to_file(session, url, filename, previous_state=previous_state_for_request)
+    if response_headers is None:
+        return False, previous_state
+    state = {
+        "url": url,
+        "etag": response_headers.get("ETag"),
+        "last_modified": response_headers.get("Last-Modified"),
+        "sha256": file_sha256(filename),
+    }
+    changed = previous_state is None or previous_state.get("sha256") != state["sha256"]
+    return changed, state
+
+
+def load_download_state(directory):
+    """
+    :return: dict of year -> download state saved in directory, empty if nothing was saved yet
+    """
+    state_filename = os.path.join(directory, DOWNLOAD_STATE_FILENAME)
+    if not os.path.exists(state_filename):
+        return {}
+    with open(state_filename) as state_file:
+        return {int(year): state for year, state in json.load(state_file).items()}
+
+
+def save_download_state(directory, download_state):
+    state_filename = os.path.join(directory, DOWNLOAD_STATE_FILENAME)
+    with open(state_filename + PARTIAL_DOWNLOAD_SUFFIX, "w") as state_file:
+        json.dump({str(year): state for year, state in sorted(download_state.items())}, state_file, indent=2)
+    os.replace(state_filename + PARTIAL_DOWNLOAD_SUFFIX, state_filename)
+
+
+def run_concurrently(function, jobs, max_concurrent=MAX_CONCURRENT_DOWNLOADS):
+    """
+    Call function(*args) for each args in jobs with at most max_concurrent calls in flight
+    :return: list of function results in jobs order
+    """
+    if max_concurrent <= 1:
+        return [function(*args) for args in jobs]
+    with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        futures = [executor.submit(function, *args) for args in jobs]
+        return [future.result() for future in futures]
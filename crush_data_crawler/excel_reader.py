@@ -0,0 +1,175 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Read a sheet into a raw string grid: a 2D numpy array of str with one item per cell, the same whichever backend
+# decoded the Excel file. Backends
+# * pandas -> pd.read_excel, the reader both crawlers always used
+# * streaming -> openpyxl in read_only mode for xlsx files and xlrd loading only the needed sheet for xls files
+# * calamine -> Rust based python-calamine for both xls and xlsx files, only available when it is installed
+#
+# Cells are rendered the way pd.read_excel(dtype=str) renders them: integral numbers without ".0", missing cells and
+# the strings pandas treats as missing become "", and trailing blank rows and columns are dropped.
+
+import datetime
+import io
+import math
+import pathlib
+import numpy as np
+import pandas as pd
+
+PANDAS_READER = "pandas"
+STREAMING_READER = "streaming"
+CALAMINE_READER = "calamine"
+READER_BACKENDS = [PANDAS_READER, STREAMING_READER, CALAMINE_READER]
+DEFAULT_READER_BACKEND = PANDAS_READER
+
+# Strings pd.read_excel turns into NaN by default
+PANDAS_NA_STRINGS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA",
+    "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+# Error values openpyxl returns as strings, pandas reads them as NaN
+EXCEL_ERROR_STRINGS = {"#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A", "#GETTING_DATA"}
+
+
+def format_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ""
+        if value.is_integer():
+            return str(int(value))
+        return str(value)
+    if isinstance(value, str):
+        if value in PANDAS_NA_STRINGS or value in EXCEL_ERROR_STRINGS:
+            return ""
+        return value
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    if isinstance(value, datetime.datetime):
+        return str(pd.Timestamp(value))
+    if value is pd.NaT:
+        return ""
+    return str(value)
+
+
+def to_grid(rows):
+    """
+    :param rows: iterable of rows of raw cell values, rows can have different lengths
+    :return: 2D numpy array of str without trailing blank rows and columns
+    """
+    formatted_rows = [[format_cell(value) for value in row] for row in rows]
+    num_cols = max([len(row) for row in formatted_rows], default=0)
+    grid = np.full((len(formatted_rows), num_cols), "", dtype=object)
+    for row_index, row in enumerate(formatted_rows):
+        grid[row_index, :len(row)] = row
+    not_blank = grid != ""
+    if not not_blank.any():
+        return np.zeros((0, 0), dtype=object)
+    last_row = np.flatnonzero(not_blank.any(axis=1))[-1]
+    last_col = np.flatnonzero(not_blank.any(axis=0))[-1]
+    return grid[:last_row + 1, :last_col + 1]
+
+
+class PandasWorkbook:
+    def __init__(self, excel_file, extension):
+        engine = None
+        if extension == 'xlsx':
+            engine = "openpyxl"
+        elif extension == 'xls':
+            engine = "xlrd"
+        self.xl = pd.ExcelFile(excel_file, engine=engine)
+        self.sheet_names = self.xl.sheet_names
+
+    def read_grid(self, sheet):
+        data_frame = pd.read_excel(self.xl, sheet_name=sheet, header=None, dtype=object)
+        return to_grid(data_frame.itertuples(index=False, name=None))
+
+
+class OpenpyxlWorkbook:
+    def __init__(self, excel_file):
+        import openpyxl
+        self.workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+        self.sheet_names = self.workbook.sheetnames
+
+    def read_grid(self, sheet):
+        worksheet = self.workbook.worksheets[sheet] if isinstance(sheet, int) else self.workbook[sheet]
+        return to_grid(worksheet.iter_rows(values_only=True))
+
+
+class XlrdWorkbook:
+    def __init__(self, excel_file):
+        import xlrd
+        self.xlrd = xlrd
+        if isinstance(excel_file, io.BytesIO):
+            self.book = xlrd.open_workbook(file_contents=excel_file.getvalue(), on_demand=True)
+        else:
+            self.book = xlrd.open_workbook(excel_file, on_demand=True)
+        self.sheet_names = self.book.sheet_names()
+
+    def convert_cell(self, cell):
+        if cell.ctype in (self.xlrd.XL_CELL_EMPTY, self.xlrd.XL_CELL_BLANK, self.xlrd.XL_CELL_ERROR):
+            return None
+        if cell.ctype == self.xlrd.XL_CELL_DATE:
+            return self.xlrd.xldate.xldate_as_datetime(cell.value, self.book.datemode)
+        if cell.ctype == self.xlrd.XL_CELL_BOOLEAN:
+            return bool(cell.value)
+        return cell.value
+
+    def read_grid(self, sheet):
+        worksheet = self.book.sheet_by_index(sheet) if isinstance(sheet, int) else self.book.sheet_by_name(sheet)
+        grid = to_grid([self.convert_cell(cell) for cell in worksheet.row(row)] for row in range(worksheet.nrows))
+        self.book.unload_sheet(worksheet.name)
+        return grid
+
+
+class CalamineWorkbook:
+    def __init__(self, excel_file):
+        from python_calamine import CalamineWorkbook as Calamine
+        if isinstance(excel_file, io.BytesIO):
+            self.workbook = Calamine.from_filelike(excel_file)
+        else:
+            self.workbook = Calamine.from_path(excel_file)
+        self.sheet_names = self.workbook.sheet_names
+
+    def read_grid(self, sheet):
+        if isinstance(sheet, int):
+            worksheet = self.workbook.get_sheet_by_index(sheet)
+        else:
+            worksheet = self.workbook.get_sheet_by_name(sheet)
+        return to_grid(worksheet.to_python(skip_empty_area=False))
+
+
+def open_workbook(excel_file, name, backend=DEFAULT_READER_BACKEND):
+    """
+    :param excel_file: path or in-memory file object, as returned by archive_reader.open_excel_file
+    :param name: file name, its extension tells xls files from xlsx files
+    :param backend: one of READER_BACKENDS
+    :return: workbook with a sheet_names list and a read_grid(sheet) method, sheet being a name or an index
+    """
+    extension = pathlib.Path(name).suffix.strip(". ").lower()
+    if backend == PANDAS_READER:
+        return PandasWorkbook(excel_file, extension)
+    if backend == STREAMING_READER:
+        if extension == 'xls':
+            return XlrdWorkbook(excel_file)
+        return OpenpyxlWorkbook(excel_file)
+    if backend == CALAMINE_READER:
+        return CalamineWorkbook(excel_file)
+    raise ValueError("Unknown Excel reader backend {}, expected one of {}".format(backend, READER_BACKENDS))
+
+
+def available_reader_backends():
+    """
+    :return: backends in READER_BACKENDS whose optional dependencies are installed
+    """
+    backends = [PANDAS_READER, STREAMING_READER]
+    try:
+        import python_calamine
+        backends.append(CALAMINE_READER)
+    except ImportError:
+        pass
+    return backends
@@ -0,0 +1,227 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Measure every step of a crawler, and every year inside the steps that work year by year, so that a slow run shows
+# whether downloading, unzipping, flattening, parsing or writing is responsible. Each record holds
+# * stage, year and table when they apply
+# * wall_seconds and cpu_seconds, cpu_seconds only counts the process the stage ran in
+# * bytes_in and bytes_out when the stage knows them, e.g. downloaded or written bytes
+# * peak_rss_mb, the peak resident memory of the process so far, and peak_traced_mb, the peak memory allocated by
+#   Python during the stage on top of what was allocated when it started, only measured with --trace-memory as
+#   tracemalloc slows everything down. tracemalloc has one peak for the whole process, so peak_traced_mb is left out
+#   of a stage that ran while another thread measured a stage, e.g. parsing and writing with --pipeline and one worker
+# Records are appended as JSON lines to the metrics file and summed up per stage in a table at the end of the run.
+#
+# Years given to --profile are parsed under cProfile, each one dumped into <profile dir>/parse_<table>_<year>.prof, to
+# be read with python -m pstats or snakeviz.
+
+import contextlib
+import cProfile
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILENAME = "metrics.jsonl"
+PROFILE_DIR = "profile"
+LOG_FORMAT = "%(asctime)s %(message)s"
+
+
+def configure_logging(log_level):
+    """
+    :param log_level: name of a logging level, e.g. INFO, or DEBUG to also see what happens to every file
+    """
+    logging.basicConfig(level=getattr(logging, log_level.upper()), format=LOG_FORMAT, force=True)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return peak_rss / 1024 / 1024 if sys.platform == "darwin" else peak_rss / 1024
+
+
+def path_size(path):
+    """
+    :return: size in bytes of a file, or of every file under a directory
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(directory, filename))
+               for directory, _, filenames in os.walk(path) for filename in filenames)
+
+
+class StageMeasurement:
+    """
+    Measure one stage, nested stages are folded into the tracemalloc peak of the stages they run in
+    """
+    # thread id -> stack of the measurements open in that thread, guarded by lock
+    open_measurements = {}
+    lock = threading.Lock()
+
+    def __init__(self, stage, year=None, table=None):
+        self.record = {"stage": stage}
+        if year is not None:
+            self.record["year"] = year
+        if table is not None:
+            self.record["table"] = table
+        self.traced_peak = 0
+        # True once a stage of another thread was measured at the same time, the traced peak is then meaningless
+        self.overlapped = False
+
+    @staticmethod
+    def fold_traced_peak():
+        """
+        Fold the tracemalloc peak into every open measurement before resetting it, lock has to be held
+        """
+        if not tracemalloc.is_tracing():
+            return
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        for measurements in StageMeasurement.open_measurements.values():
+            for measurement in measurements:
+                measurement.traced_peak = max(measurement.traced_peak, traced_peak)
+        tracemalloc.reset_peak()
+
+    def start(self):
+        thread_id = threading.get_ident()
+        with StageMeasurement.lock:
+            StageMeasurement.fold_traced_peak()
+            others = [measurement for other_thread_id, measurements in StageMeasurement.open_measurements.items()
+                      if other_thread_id != thread_id for measurement in measurements]
+            if len(others) > 0:
+                for measurement in others + StageMeasurement.open_measurements.get(thread_id, []) + [self]:
+                    measurement.overlapped = True
+            StageMeasurement.open_measurements.setdefault(thread_id, []).append(self)
+        self.traced_start = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def stop(self):
+        self.record["wall_seconds"] = time.perf_counter() - self.wall_start
+        self.record["cpu_seconds"] = time.process_time() - self.cpu_start
+        thread_id = threading.get_ident()
+        with StageMeasurement.lock:
+            StageMeasurement.fold_traced_peak()
+            measurements = StageMeasurement.open_measurements[thread_id]
+            measurements.remove(self)
+            if len(measurements) == 0:
+                del StageMeasurement.open_measurements[thread_id]
+        if tracemalloc.is_tracing() and not self.overlapped:
+            self.record["peak_traced_mb"] = max(self.traced_peak - self.traced_start, 0) / 1024 / 1024
+        self.record["peak_rss_mb"] = peak_rss_mb()
+        return self.record
+
+
+class Instrumentation:
+    def __init__(self, crawler, metrics_filename=None, trace_memory=False, profile_years=None, profile_dir=None):
+        """
+        :param crawler: name of the crawler written in every record
+        :param metrics_filename: JSON lines file records are appended to, None to only log the summary
+        :param profile_years: years whose parse stage runs under cProfile
+        """
+        self.crawler = crawler
+        self.run = datetime.datetime.now().isoformat(timespec="seconds")
+        self.metrics_filename = metrics_filename
+        self.trace_memory = trace_memory
+        self.profile_years = set(profile_years or [])
+        self.profile_dir = profile_dir
+        self.records = []
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, stage, year=None, table=None):
+        """
+        Measure the code inside the with block
+        :return: the record, bytes_in and bytes_out can be added to it inside the with block
+        """
+        measurement = StageMeasurement(stage, year=year, table=table)
+        measurement.start()
+        try:
+            yield measurement.record
+        finally:
+            self.add(measurement.stop())
+
+    def add(self, record):
+        """
+        Keep a record, e.g. one measured by measured_call in a worker process
+        """
+        record = dict(record, crawler=self.crawler, run=self.run)
+        self.records.append(record)
+        if self.metrics_filename is not None:
+            with open(self.metrics_filename, "a") as metrics_file:
+                metrics_file.write(json.dumps(record) + "\n")
+
+    def profile_filename(self, stage, year, table=None):
+        """
+        :return: where cProfile output of a stage of a year is dumped, None if the year is not profiled
+        """
+        if year not in self.profile_years:
+            return None
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = "_".join(str(part) for part in [stage, table, year] if part is not None)
+        return os.path.join(self.profile_dir, "{}.prof".format(name.replace("/", "_")))
+
+    def summary(self):
+        """
+        :return: lines of a table summing up records by stage, in the order stages first ran
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record["stage"], {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                        "bytes_in": 0, "bytes_out": 0, "peak_mb": 0.0})
+            total["count"] += 1
+            total["wall_seconds"] += record["wall_seconds"]
+            total["cpu_seconds"] += record["cpu_seconds"]
+            total["bytes_in"] += record.get("bytes_in", 0)
+            total["bytes_out"] += record.get("bytes_out", 0)
+            total["peak_mb"] = max(total["peak_mb"], record.get("peak_traced_mb", record.get("peak_rss_mb")) or 0)
+        lines = ["{:<12} {:>6} {:>10} {:>10} {:>10} {:>10} {:>9}".format("stage", "count", "wall s", "cpu s", "MB in",
+                                                                         "MB out", "peak MB")]
+        for stage, total in totals.items():
+            lines.append("{:<12} {:>6} {:>10.2f} {:>10.2f} {:>10.1f} {:>10.1f} {:>9.1f}".format(
+                stage, total["count"], total["wall_seconds"], total["cpu_seconds"], total["bytes_in"] / 1024 / 1024,
+                total["bytes_out"] / 1024 / 1024, total["peak_mb"]))
+        return lines
+
+    def log_summary(self):
+        for line in self.summary():
+            logger.info(line)
+        if self.metrics_filename is not None:
+            logger.info("Metrics appended to %s", self.metrics_filename)
+
+
+def measured_call(stage, year, table, trace_memory, profile_filename, bytes_in, function, args):
+    """
+    Call function(*args) and measure it, module level so that map_years_in_order can run it in worker processes
+    :param profile_filename: file cProfile output is dumped into, None to not profile
+    :param bytes_in: input size written in the record
+    :return: (function result, record)
+    """
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    measurement = StageMeasurement(stage, year=year, table=table)
+    measurement.start()
+    if profile_filename is None:
+        result = function(*args)
+    else:
+        profile = cProfile.Profile()
+        result = profile.runcall(function, *args)
+        profile.dump_stats(profile_filename)
+        logger.info("Profile of %s %s written to %s", stage, year, profile_filename)
+    record = measurement.stop()
+    record["bytes_in"] = bytes_in
+    return result, record
@@ -0,0 +1,134 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Remember how the parsers laid out a sheet, so that a sheet with the same layout is read without searching it again.
+# USDA reports keep the same layout for many years, yet both parsers find their header cells by scanning the whole
+# sheet and decode the district of every column below each header for every sheet.
+#
+# A sheet is fingerprinted by the parser name and PARSER_VERSION, the sheet name, its shape, the text of its first row
+# and which cells of its first column are blank, not their text, as variety names change from year to year. The
+# fingerprint maps to an extraction plan the parser found with a full scan, a JSON object listing every header cell,
+# the text of its row, which district each column right of it holds, and every cell of the sheet holding the exact text
+# of one of its header cells. A sheet whose fingerprint has a plan is parsed by that plan when the text of every header
+# cell and header row in the plan is still the same and cells with the text of a header cell are found exactly where
+# the plan has them, and by a full scan recording a new plan otherwise. A plan therefore returns what a scan would,
+# unless the sheet has another header the scan recognizes written differently from every header cell of the plan,
+# e.g. a second block headed "Variety" next to one headed "Type and Variety", which the fingerprint of the sheet does
+# not tell apart. Variety rows are still matched in every sheet, only in the columns of the plan's headers.
+#
+# Sheets are still decoded whole: every reader backend decodes a sheet before returning any cell and the fingerprint
+# needs the first column, so a plan saves scanning the sheet, not reading it.
+#
+# Plans are small JSON files named <fingerprint>.json in a directory shared by every run and worker process, written
+# once and never changed, and every process keeps the plans it used in memory.
+
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+from downloader import PARTIAL_DOWNLOAD_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_PLAN_SUFFIX = ".json"
+
+
+def sheet_fingerprint(parser, sheet_name, grid):
+    """
+    :param parser: parser name and version, e.g. ["crush", 2]
+    :param grid: 2D array of str as returned by excel_reader read_grid
+    :return: SHA-256 hex digest of what the layout of the sheet is recognized by
+    """
+    num_rows, num_cols = grid.shape
+    sha256 = hashlib.sha256(json.dumps([parser, str(sheet_name), num_rows, num_cols]).encode("utf-8"))
+    if grid.size > 0:
+        sha256.update("\0".join(grid[0].tolist()).encode("utf-8"))
+        sha256.update(np.packbits(np.char.str_len(np.char.strip(grid[:, 0].astype(str))) > 0).tobytes())
+    return sha256.hexdigest()
+
+
+def header_row_labels(grid, row, col, end_col):
+    """
+    :return: text of the cells of a header row from the header cell at (row, col) to end_col excluded
+    """
+    return grid[row, col:end_col].tolist()
+
+
+def header_text_cells(grid, plan):
+    """
+    :return: [[row, col]] of every cell of grid holding the exact text of a header cell of plan, blank ones aside
+    """
+    texts = sorted({header["labels"][0] for header in plan["headers"]
+                    if len(header["labels"]) > 0 and len(header["labels"][0].strip()) > 0})
+    if len(texts) == 0 or grid.size == 0:
+        return []
+    return np.argwhere(np.isin(grid, texts)).tolist()
+
+
+def plan_matches(grid, plan):
+    """
+    :return: True if every header cell and header row of plan has the same text in grid, and cells with the text of
+    a header cell are where plan has them
+    """
+    for header in plan["headers"]:
+        labels = header["labels"]
+        if header_row_labels(grid, header["row"], header["col"], header["col"] + len(labels)) != labels:
+            return False
+    # plans recorded without header cells never match, and are replaced by a scan
+    return plan.get("header_text_cells") == header_text_cells(grid, plan)
+
+
+class LayoutPlans:
+    def __init__(self, directory):
+        self.directory = directory
+        # fingerprint -> plan, plans used by this process
+        self.plans = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def plan_filename(self, fingerprint):
+        return os.path.join(self.directory, fingerprint + LAYOUT_PLAN_SUFFIX)
+
+    def get(self, fingerprint):
+        """
+        :return: plan recorded for fingerprint, or None
+        """
+        plan = self.plans.get(fingerprint)
+        if plan is not None:
+            return plan
+        try:
+            with open(self.plan_filename(fingerprint)) as plan_file:
+                plan = json.load(plan_file)
+        except (OSError, ValueError):
+            return None
+        self.plans[fingerprint] = plan
+        return plan
+
+    def put(self, fingerprint, plan):
+        self.plans[fingerprint] = plan
+        filename = self.plan_filename(fingerprint)
+        # the process id keeps concurrent writes of the same plan by several workers apart
+        partial_filename = "{}.{}{}".format(filename, os.getpid(), PARTIAL_DOWNLOAD_SUFFIX)
+        with open(partial_filename, "w") as plan_file:
+            json.dump(plan, plan_file, separators=(",", ":"))
+        os.replace(partial_filename, filename)
+
+
+def find_or_plan(layout_plans, fingerprint, grid, find_layout):
+    """
+    :param layout_plans: LayoutPlans, or None to always scan the sheet
+    :param find_layout: called without arguments to scan the sheet, returns its plan
+    :return: plan of the sheet, the recorded one when it still matches grid
+    """
+    if layout_plans is None:
+        return find_layout()
+    plan = layout_plans.get(fingerprint)
+    if plan is not None:
+        if plan_matches(grid, plan):
+            logger.debug("Layout plan hit... %s", fingerprint)
+            return plan
+        logger.debug("Layout plan %s does not match the sheet, scanning it", fingerprint)
+    plan = find_layout()
+    plan["header_text_cells"] = header_text_cells(grid, plan)
+    layout_plans.put(fingerprint, plan)
+    return plan
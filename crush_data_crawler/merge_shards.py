@@ -0,0 +1,154 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Merge the data roots of every shard of a rebuild crawled with --shard K/N, see shards.py, into one data root with the
+# usual Volume/, Price/, ..., Acreage/<type>/ trees and Parquet dataset, then reshape it as build_all.py does.
+#
+# Usage: crush_data_crawler/merge_shards.py <data_root> <shard_root> [<shard_root> ...] [--output-filename FILE]
+#                                           [--sqlite FILE]
+# e.g.
+#   crush_data_crawler/merge_shards.py ./output/current ./output/shards/1 ./output/shards/2 ./output/shards/3 \
+#       --output-filename current.xlsx
+#
+# Nothing is written unless the shards fit together: for every data type, all N shards have to be there exactly once,
+# crawled with the same year range, output format and tables, each of them has to have finished every year assigned to
+# it, and every output has to be the one its build manifest recorded. Outputs are copied shard by shard in shard
+# order, replacing a file of data_root only when its content differs, and their build manifest nodes are recorded in
+# data_root, so the merged data root looks as if one crawl had written it, except for raw data that stays in the
+# shards. The result does not depend on the order shard roots are given in.
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+from build_manifest import BuildManifest
+from downloader import file_sha256
+from instrumentation import Instrumentation, configure_logging, METRICS_FILENAME
+from shards import ShardManifest, SHARD_MANIFEST_FILENAME, in_shard
+from stage1_writer import partial_filename_of, replace_if_changed
+from build_all import reshape
+
+logger = logging.getLogger(__name__)
+
+# Settings every shard of a data type has to share
+SHARED_SETTINGS = ["shards", "begin_year", "end_year", "output_format"]
+
+
+def check_shards(shard_roots):
+    """
+    :return: {data type: [(shard root, shard description, BuildManifest of the shard root)] in shard order}
+    :raise ValueError: when the shards overlap, one of them is missing or did not finish, or their outputs changed
+    """
+    shards_by_data_type = {}
+    for shard_root in shard_roots:
+        shard_manifest = ShardManifest(shard_root)
+        if len(shard_manifest.data_types) == 0:
+            raise ValueError("{} has no {}, it is not a shard or its crawl did not finish".format(
+                shard_root, SHARD_MANIFEST_FILENAME))
+        manifest = BuildManifest(shard_root)
+        for data_type, description in shard_manifest.data_types.items():
+            shards_by_data_type.setdefault(data_type, []).append((shard_root, description, manifest))
+    for data_type, shards in shards_by_data_type.items():
+        shards.sort(key=lambda shard: shard[1]["shard"])
+        first_root, first, _ = shards[0]
+        for shard_root, description, _ in shards:
+            for setting in SHARED_SETTINGS + ["tables"]:
+                expected, actual = first[setting], description[setting]
+                if setting == "tables":
+                    expected, actual = sorted(expected), sorted(actual)
+                if actual != expected:
+                    raise ValueError("{} shards {} and {} were crawled with different {}, {} and {}".format(
+                        data_type, first_root, shard_root, setting, expected, actual))
+        found = [description["shard"] for _, description, _ in shards]
+        for previous, current in zip(shards, shards[1:]):
+            if previous[1]["shard"] == current[1]["shard"]:
+                raise ValueError("{} shard {}/{} overlaps in {} and {}".format(
+                    data_type, current[1]["shard"], first["shards"], previous[0], current[0]))
+        missing = sorted(set(range(1, first["shards"] + 1)) - set(found))
+        if len(missing) > 0:
+            raise ValueError("{} shards {} of {} are missing".format(data_type, missing, first["shards"]))
+        for shard_root, description, manifest in shards:
+            shard = (description["shard"], description["shards"])
+            assigned = [year for year in range(description["begin_year"], description["end_year"] + 1)
+                        if in_shard(shard, data_type, year)]
+            if description["years"] != assigned:
+                raise ValueError("{} shard {} was assigned years {} instead of {}".format(
+                    data_type, shard_root, description["years"], assigned))
+            for table, completed in description["tables"].items():
+                unfinished = sorted(set(assigned) - set(completed))
+                if len(unfinished) > 0:
+                    raise ValueError("{} of {} in shard {} did not finish".format(unfinished, table, shard_root))
+                for year in assigned:
+                    check_outputs(shard_root, manifest, table, year)
+    return shards_by_data_type
+
+
+def check_outputs(shard_root, manifest, table, year):
+    """
+    :raise ValueError: when an output of the node (table, year) is missing or differs from the recorded one
+    """
+    node = manifest.nodes.get(manifest.node_key(table, year))
+    if node is None:
+        raise ValueError("{} of {} in shard {} is not in its build manifest".format(year, table, shard_root))
+    for relative_path, recorded_sha256 in node["outputs"].items():
+        filename = os.path.join(shard_root, relative_path)
+        if not os.path.exists(filename) or file_sha256(filename) != recorded_sha256:
+            raise ValueError("{} is missing or was modified after its shard was crawled".format(filename))
+
+
+def merge_shards(data_root, shard_roots):
+    """
+    Copy every stage 1 output of the shards into data_root and record them in its build manifest
+    :return: number of outputs copied, those data_root already had are not counted
+    """
+    shards_by_data_type = check_shards(shard_roots)
+    os.makedirs(data_root, exist_ok=True)
+    merged_manifest = BuildManifest(data_root)
+    copied = 0
+    for data_type, shards in sorted(shards_by_data_type.items()):
+        for shard_root, description, manifest in shards:
+            logger.info("Merging %s shard %s/%s from %s", data_type, description["shard"], description["shards"],
+                        shard_root)
+            for table in sorted(description["tables"]):
+                for year in description["years"]:
+                    node = manifest.nodes[manifest.node_key(table, year)]
+                    output_hashes = {}
+                    for relative_path in sorted(node["outputs"]):
+                        filename = os.path.join(data_root, relative_path)
+                        os.makedirs(os.path.dirname(filename), exist_ok=True)
+                        existed = os.path.exists(filename) and file_sha256(filename) == node["outputs"][relative_path]
+                        shutil.copyfile(os.path.join(shard_root, relative_path), partial_filename_of(filename))
+                        output_hashes[filename] = replace_if_changed(partial_filename_of(filename), filename)
+                        copied += 0 if existed else 1
+                    merged_manifest.record(table, year, node["archive_sha256"], node["parse_options"], output_hashes)
+    merged_manifest.save()
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the data roots of every shard of a rebuild, see shards.py")
+    parser.add_argument("data_root", type=str, help="data root the shards are merged into")
+    parser.add_argument("shard_roots", type=str, nargs="+", help="data roots of the shards")
+    parser.add_argument("--output-filename", type=str, default=None, metavar="FILE",
+                        help="also reshape data_root into this combined Excel file, the store and its aggregates, as "
+                             "build_all.py does")
+    parser.add_argument("--sqlite", type=str, default=None, metavar="FILE",
+                        help="with --output-filename, also upsert the combined dataset into this SQLite database")
+    args = parser.parse_args()
+    configure_logging("INFO")
+    try:
+        copied = merge_shards(args.data_root, args.shard_roots)
+    except ValueError as error:
+        logger.error("Refusing to merge: %s", error)
+        return 1
+    logger.info("Merged %s shard data roots into %s, %s outputs copied", len(args.shard_roots), args.data_root, copied)
+    if args.output_filename is not None:
+        instrumentation = Instrumentation("merge", os.path.join(args.data_root, METRICS_FILENAME))
+        reshape(args.data_root, args.output_filename, instrumentation, sqlite=args.sqlite)
+        instrumentation.log_summary()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Cache what extract_data_from_excel returns for a year on disk, so that re-running a crawler over raw data that did
+# not change (e.g. skip_download=True while working on the writers or stage 2) does not parse any Excel file again.
+#
+# An entry is keyed on the SHA-256 of the year's source (ZIP file, Excel file or extracted directory) and on the
+# parser options: parser name and PARSER_VERSION, table postfix or year, interested variety names, --all-varieties and
+# the reader backend. Changing any of them misses the cache, so entries never need to be invalidated by hand, bump
+# PARSER_VERSION of a crawler whenever its extract_data_from_excel returns something different.
+#
+# Entries are gzip compressed JSON files named <key>.json.gz, a hit touches its file, and once the cache is larger than
+# its size cap the least recently used entries are deleted.
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+from downloader import file_sha256, PARTIAL_DOWNLOAD_SUFFIX
+from year_result import YearResult
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARSE_CACHE_MAX_MB = 512
+PARSE_CACHE_ENTRY_SUFFIX = ".json.gz"
+
+# source path -> (size, mtime, SHA-256), so that a ZIP file shared by several tables is hashed once per process
+source_hashes = {}
+
+
+def source_sha256(source):
+    """
+    :param source: ZIP file, Excel file, or directory of Excel files
+    :return: SHA-256 of the source content, for a directory the hash of its top level file names and hashes
+    """
+    if os.path.isdir(source):
+        sha256 = hashlib.sha256()
+        for filename in sorted(os.listdir(source)):
+            path = os.path.join(source, filename)
+            if os.path.isfile(path):
+                sha256.update("{}\0{}\0".format(filename, source_sha256(path)).encode("utf-8"))
+        return sha256.hexdigest()
+    stat = os.stat(source)
+    cached = source_hashes.get(source)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+    digest = file_sha256(source)
+    source_hashes[source] = (stat.st_size, stat.st_mtime_ns, digest)
+    return digest
+
+
+def encode_result(result):
+    """
+    :param result: YearResult or a list of them
+    :return: JSON serializable copy of result
+    """
+    if isinstance(result, YearResult):
+        return result.encode()
+    return [encode_result(item) for item in result]
+
+
+def decode_result(encoded):
+    """
+    :return: result as it was given to encode_result
+    """
+    if isinstance(encoded, dict):
+        return YearResult.decode(encoded)
+    return [decode_result(item) for item in encoded]
+
+
+class ParseCache:
+    def __init__(self, directory, max_mb=DEFAULT_PARSE_CACHE_MAX_MB):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source, options):
+        """
+        :param options: JSON serializable parser options, e.g. {"parser": "crush", "version": 1, "postfix": "02"}
+        """
+        key_parts = json.dumps([source_sha256(source), options], sort_keys=True)
+        return hashlib.sha256(key_parts.encode("utf-8")).hexdigest()
+
+    def entry_filename(self, key):
+        return os.path.join(self.directory, key + PARSE_CACHE_ENTRY_SUFFIX)
+
+    def get(self, key):
+        """
+        :return: cached result, or None on a miss
+        """
+        filename = self.entry_filename(key)
+        try:
+            with gzip.open(filename, "rt", encoding="utf-8") as entry:
+                result = decode_result(json.load(entry))
+        except (OSError, EOFError, ValueError):
+            return None
+        os.utime(filename)
+        return result
+
+    def put(self, key, result):
+        filename = self.entry_filename(key)
+        # the process id keeps concurrent writes of the same entry by several workers apart
+        partial_filename = "{}.{}{}".format(filename, os.getpid(), PARTIAL_DOWNLOAD_SUFFIX)
+        with gzip.open(partial_filename, "wt", encoding="utf-8") as entry:
+            json.dump(encode_result(result), entry, separators=(",", ":"))
+        os.replace(partial_filename, filename)
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits in its size cap
+        :return: number of deleted entries
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(PARSE_CACHE_ENTRY_SUFFIX):
+                stat = os.stat(os.path.join(self.directory, filename))
+                entries.append((stat.st_mtime, stat.st_size, filename))
+        total_bytes = sum(size for _, size, _ in entries)
+        deleted = 0
+        for _, size, filename in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, filename))
+            total_bytes -= size
+            deleted += 1
+        return deleted
+
+
+def parse_with_cache(cache, options, source, function, args):
+    """
+    Return function(*args) from cache when possible, module level so that map_years_in_order can run it in workers
+    :param cache: ParseCache, or None to always call function
+    :param options: parser options identifying what function extracts from source, see ParseCache.key
+    :param source: this year's ZIP file, Excel file or extracted directory parsed by function
+    """
+    if cache is None:
+        return function(*args)
+    key = cache.key(source, options)
+    result = cache.get(key)
+    if result is not None:
+        logger.debug("Parse cache hit... %s", source)
+        return result
+    result = function(*args)
+    if result is not None:
+        cache.put(key, result)
+    return result
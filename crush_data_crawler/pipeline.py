@@ -0,0 +1,88 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Run the download, prepare, parse and write steps of a crawler year by year and overlapped, instead of each step for
+# every year before the next step starts. Selected with --pipeline.
+# * downloads run in threads, --downloads at a time
+# * a downloaded year is prepared (skipped when unchanged, unzipped) in the calling thread as soon as its download
+#   finished, and its parse jobs are sent to --workers worker processes, or one thread with a single worker
+# * a year is written in the calling thread as soon as all its parse jobs finished, then its parsed data is dropped
+# At most max_pending_years years are between the start of their download and the end of their write. Downloads wait
+# for parsing and writing to catch up instead of piling up years in memory, so memory depends on max_pending_years
+# rather than on the number of years crawled, and a run takes about as long as its slowest step.
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from downloader import MAX_CONCURRENT_DOWNLOADS
+
+DOWNLOAD_STEP = "downloading"
+PARSE_STEP = "processing"
+
+
+def default_max_pending_years(downloads, workers):
+    """
+    :return: enough years in flight to keep every download and every worker busy
+    """
+    return 2 * max(downloads, workers, 1)
+
+
+def run_pipeline(download_jobs, download, prepare, function, write, downloads=MAX_CONCURRENT_DOWNLOADS, workers=1,
+                 max_pending_years=None):
+    """
+    :param download_jobs: list of (year, args), download(*args) is called in a thread for each of them
+    :param prepare: called as prepare(year, download result) once a year is downloaded, returns the parse jobs of
+    this year as a list of (year, path, args) like map_years_in_order, or None to skip the year
+    :param function: module level function called as function(*args) for every parse job, in worker processes when
+    workers > 1
+    :param write: called as write(year, list of function results in parse jobs order) once a year is parsed
+    :param max_pending_years: years downloaded or parsed but not written yet, default_max_pending_years when None
+    """
+    if max_pending_years is None:
+        max_pending_years = default_max_pending_years(downloads, workers)
+    waiting_downloads = deque(download_jobs)
+    pending_years = 0
+    # future -> (step, year, path, index of the parse job in its year)
+    futures = {}
+    # year -> [parse results, number of parse jobs not finished yet]
+    parsing = {}
+    download_executor = ThreadPoolExecutor(max_workers=max(downloads, 1))
+    if workers > 1:
+        parse_executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        parse_executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        while len(waiting_downloads) > 0 or len(futures) > 0:
+            while len(waiting_downloads) > 0 and pending_years < max_pending_years:
+                year, args = waiting_downloads.popleft()
+                futures[download_executor.submit(download, *args)] = (DOWNLOAD_STEP, year, None, None)
+                pending_years += 1
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                step, year, path, index = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    raise RuntimeError("Failed {} year {}{}".format(
+                        step, year, "" if path is None else " from {}".format(path))) from e
+                if step == DOWNLOAD_STEP:
+                    parse_jobs = prepare(year, result)
+                    if parse_jobs is None:
+                        pending_years -= 1
+                        continue
+                    if len(parse_jobs) == 0:
+                        write(year, [])
+                        pending_years -= 1
+                        continue
+                    parsing[year] = [[None] * len(parse_jobs), len(parse_jobs)]
+                    for job_index, (_, job_path, job_args) in enumerate(parse_jobs):
+                        futures[parse_executor.submit(function, *job_args)] = (PARSE_STEP, year, job_path, job_index)
+                    continue
+                parsing[year][0][index] = result
+                parsing[year][1] -= 1
+                if parsing[year][1] == 0:
+                    results, _ = parsing.pop(year)
+                    write(year, results)
+                    pending_years -= 1
+    finally:
+        download_executor.shutdown(wait=True, cancel_futures=True)
+        parse_executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,88 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Check that every available Excel reader backend returns the same raw string grid for every sheet of every year
+# already downloaded under a data root, e.g. after crawling with
+#   crush_data_crawler/all_crush_tables.py 1991 2023 ./output/YYYYMMDD False
+#   crush_data_crawler/12_acreage.py 1994 2023 ./output/YYYYMMDD False
+# run
+#   crush_data_crawler/reader_parity.py ./output/YYYYMMDD
+
+import os
+import re
+import sys
+import numpy as np
+from archive_reader import list_excel_files, open_excel_file, describe_excel_file
+from excel_reader import open_workbook, available_reader_backends, PANDAS_READER
+
+DOWNLOADED_FILE_REGEX = r"^[0-9]{4}\.(zip|xls|xlsx)$"
+
+
+def find_downloaded_files(data_root):
+    """
+    :return: sorted list of downloaded files of every year in every *Raw directory under data_root
+    """
+    downloaded_files = []
+    for raw_dir in sorted(os.listdir(data_root)):
+        raw_dir_path = os.path.join(data_root, raw_dir)
+        if not raw_dir.endswith("Raw") or not os.path.isdir(raw_dir_path):
+            continue
+        for filename in sorted(os.listdir(raw_dir_path)):
+            if re.match(DOWNLOADED_FILE_REGEX, filename.lower()):
+                downloaded_files.append(os.path.join(raw_dir_path, filename))
+    return downloaded_files
+
+
+def first_difference(expected_grid, actual_grid):
+    if expected_grid.shape != actual_grid.shape:
+        return "shape {} != {}".format(expected_grid.shape, actual_grid.shape)
+    rows, cols = np.nonzero(expected_grid != actual_grid)
+    if len(rows) == 0:
+        return None
+    row, col = rows[0], cols[0]
+    return "{} cells differ, first at ({}, {}): {!r} != {!r}".format(len(rows), row, col, expected_grid[row, col],
+                                                                      actual_grid[row, col])
+
+
+def compare_backends(source, excel_file, backends):
+    """
+    :return: list of mismatch descriptions between PANDAS_READER and every other backend for one Excel file
+    """
+    mismatches = []
+    location = describe_excel_file(source, excel_file)
+    expected = open_workbook(open_excel_file(source, excel_file), excel_file, backend=PANDAS_READER)
+    for backend in backends:
+        if backend == PANDAS_READER:
+            continue
+        actual = open_workbook(open_excel_file(source, excel_file), excel_file, backend=backend)
+        if list(expected.sheet_names) != list(actual.sheet_names):
+            mismatches.append("{} {}: sheet names {} != {}".format(location, backend, expected.sheet_names,
+                                                                  actual.sheet_names))
+            continue
+        for sheet in expected.sheet_names:
+            difference = first_difference(expected.read_grid(sheet), actual.read_grid(sheet))
+            if difference is not None:
+                mismatches.append("{} [{}] {}: {}".format(location, sheet, backend, difference))
+    return mismatches
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Not enough arguments, needed data_root as string")
+        return 1
+    data_root = sys.argv[1]
+    backends = available_reader_backends()
+    print("Comparing backends", backends)
+    mismatches = []
+    for source in find_downloaded_files(data_root):
+        for excel_file in list_excel_files(source):
+            print("Comparing...", describe_excel_file(source, excel_file))
+            mismatches.extend(compare_backends(source, excel_file, backends))
+    for mismatch in mismatches:
+        print("MISMATCH", mismatch)
+    print("{} mismatch(es)".format(len(mismatches)))
+    return 1 if len(mismatches) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Split a rebuild of the whole history across several machines or containers sharing a filesystem. A crawler given
+# --shard K/N only downloads, parses and writes the years assigned to shard K of N, into its own data root, e.g.
+#   crush_data_crawler/build_all.py 1991 2024 ./output/shards/1 False current.xlsx --shard 1/3
+#   crush_data_crawler/build_all.py 1991 2024 ./output/shards/2 False current.xlsx --shard 2/3
+#   crush_data_crawler/build_all.py 1991 2024 ./output/shards/3 False current.xlsx --shard 3/3
+# and merge_shards.py combines the shard data roots into one.
+#
+# Work units are (data type, year) pairs, the data type being the parser name, "crush" or "acreage", as every crush
+# table of a year is read from the same archive. A unit belongs to shard crc32("<data type>/<year>") % N + 1, so
+# every machine assigns the same units to the same shard without talking to the others, and years of both data types
+# are spread over all shards.
+#
+# Once a crawler finished its shard, it records in SHARD_MANIFEST_FILENAME of the shard data root, per data type
+# * shard, shards -> K and N
+# * begin_year, end_year -> year range every shard of the rebuild was given
+# * output_format -> output format of its stage 1 outputs
+# * years -> years assigned to the shard
+# * tables -> for every table written, years whose outputs are recorded in build_manifest.json
+# so that a merge can tell which shards it has and whether each of them finished.
+
+import argparse
+import json
+import os
+import zlib
+from downloader import PARTIAL_DOWNLOAD_SUFFIX
+
+SHARD_MANIFEST_FILENAME = "shard_manifest.json"
+
+
+def parse_shard(shard):
+    """
+    :param shard: K/N with 1 <= K <= N, e.g. "2/4"
+    :return: (K, N) as int
+    """
+    index, _, count = shard.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected K/N, e.g. 2/4, got {}".format(shard))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("expected 1 <= K <= N, got {}".format(shard))
+    return index, count
+
+
+def shard_of(data_type, year, shards):
+    """
+    :return: shard from 1 to shards the work unit (data_type, year) belongs to
+    """
+    return zlib.crc32("{}/{}".format(data_type, year).encode("utf-8")) % shards + 1
+
+
+def in_shard(shard, data_type, year):
+    """
+    :param shard: (K, N) as returned by parse_shard, or None when not sharding
+    :return: True if the work unit (data_type, year) is crawled by shard
+    """
+    return shard is None or shard_of(data_type, year, shard[1]) == shard[0]
+
+
+class ShardManifest:
+    def __init__(self, data_root):
+        self.data_root = data_root
+        self.filename = os.path.join(data_root, SHARD_MANIFEST_FILENAME)
+        # data type -> description of the shard, see the top of this file
+        self.data_types = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as manifest_file:
+                self.data_types = json.load(manifest_file)
+
+    def record(self, data_type, shard, begin_year, end_year, output_format, years, completed_by_table):
+        """
+        Record a finished crawl of a shard, tables written before by a crawl of the same shard with other tables are
+        kept
+        :param years: years assigned to the shard
+        :param completed_by_table: {table: years whose outputs are recorded in the build manifest}
+        """
+        description = {"shard": shard[0], "shards": shard[1], "begin_year": begin_year, "end_year": end_year,
+                       "output_format": output_format, "years": sorted(years)}
+        tables = {}
+        previous = self.data_types.get(data_type)
+        if previous is not None and all(previous[key] == value for key, value in description.items()):
+            tables.update(previous["tables"])
+        tables.update({table: sorted(completed) for table, completed in completed_by_table.items()})
+        description["tables"] = dict(sorted(tables.items()))
+        self.data_types[data_type] = description
+
+    def save(self):
+        with open(self.filename + PARTIAL_DOWNLOAD_SUFFIX, "w") as manifest_file:
+            json.dump(dict(sorted(self.data_types.items())), manifest_file, indent=2)
+        os.replace(self.filename + PARTIAL_DOWNLOAD_SUFFIX, self.filename)
+
+
+def record_shard(data_root, data_type, args, tables, manifest):
+    """
+    Record in the shard manifest of data_root which years of tables the finished crawl of args.shard wrote
+    :param tables: stage 1 tables the crawler writes, e.g. ["Volume", "Price"]
+    :param manifest: BuildManifest of data_root
+    """
+    years = [year for year in range(args.begin_year, args.end_year + 1) if in_shard(args.shard, data_type, year)]
+    completed_by_table = {table: [year for year in years if manifest.node_key(table, year) in manifest.nodes]
+                          for table in tables}
+    shard_manifest = ShardManifest(data_root)
+    shard_manifest.record(data_type, args.shard, args.begin_year, args.end_year, args.output_format, years,
+                          completed_by_table)
+    shard_manifest.save()
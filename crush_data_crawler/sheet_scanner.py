@@ -0,0 +1,65 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Locate header cells and grape rows in a sheet with NumPy string operations instead of walking every cell.
+# A sheet is normalized once by normalize_cells(), all other functions take that normalized array.
+
+import re
+import numpy as np
+
+
+def normalize_cells(values):
+    """
+    Convert a 2D array of cell values into lowercase strings. Grids of excel_reader read_grid already hold the same
+    string for a cell whatever the backend, "" for missing cells, NA strings and Excel errors, so scanning them finds
+    the same cells with every backend
+    :param values: 2D array like, e.g. a grid returned by excel_reader read_grid
+    :return: 2D numpy array of str
+    """
+    cells = np.asarray(values, dtype=object)
+    if cells.size == 0:
+        return np.zeros(cells.shape, dtype=str)
+    return np.char.lower(cells.astype(str))
+
+
+def column_major_locations(mask):
+    """
+    :return: list of (row, col) where mask is True, ordered column by column and top to bottom inside a column
+    """
+    cols, rows = np.nonzero(mask.T)
+    return list(zip(rows.tolist(), cols.tolist()))
+
+
+def cells_containing(cells, substrings):
+    """
+    :return: bool mask of cells containing any of substrings
+    """
+    mask = np.zeros(cells.shape, dtype=bool)
+    for substring in substrings:
+        mask |= np.char.find(cells, substring) >= 0
+    return mask
+
+
+def cells_equal_after_strip(cells, values):
+    """
+    :return: bool mask of cells equal to any of values once leading and trailing spaces are removed
+    """
+    stripped = np.char.strip(cells)
+    mask = np.zeros(cells.shape, dtype=bool)
+    for value in values:
+        mask |= stripped == value
+    return mask
+
+
+def cells_matching(cells, regex):
+    """
+    re.match regex against every cell, running the regex once for each distinct value instead of once for each cell
+    :return: bool mask of cells matching regex
+    """
+    if cells.size == 0:
+        return np.zeros(cells.shape, dtype=bool)
+    compiled_regex = re.compile(regex)
+    unique_values, inverse = np.unique(cells.ravel(), return_inverse=True)
+    unique_matched = np.array([compiled_regex.match(value) is not None for value in unique_values], dtype=bool)
+    return unique_matched[inverse.ravel()].reshape(cells.shape)
+
@@ -0,0 +1,247 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Keep every observation of every table in one local SQLite database, so that it can be queried with SQL instead of
+# filtering the combined Excel file by hand or reading CSV trees. Schema
+# * variables(variable_id, name, unit), districts(district_id, name), varieties(variety_id, name, category) and
+#   statuses(status_id, name), names as in the combined dataset, e.g. "crushed volume" and "4:Napa"
+# * observations(variable_id, variety_id, district_id, year, value, status, source_sha256), value NULL when USDA
+#   published nothing, status a cell_values.py status code, NULL when unknown, and source_sha256 the SHA-256 of the
+#   archive the year was parsed from, NULL when unknown
+# * observation_values, a view of observations with names instead of ids
+# The primary key of observations, (variable, variety, district, year), is its clustered index, and a second index on
+# (variable, year) also holds district, variety and value, so that point and range queries of a variable are answered
+# from an index alone.
+#
+# Crawlers given --sqlite PATH upsert every year they parse in one transaction: rows are inserted or updated in place,
+# and rows of the same table and year the new parse does not have, e.g. left by an older parser version, by the final
+# report an errata replaced or by --all-varieties, are deleted, so every table and year holds exactly its last parse.
+# Derived rows such as "total all varieties" acreage are only added by the stage 2 load below, which build_all runs
+# whenever it reshapes a data root with --sqlite, a year a crawler writes again is without them until then. It loads
+# every cell of the stage 1 outputs, those without a value too, so it keeps the rows of the crawlers, and keeps their
+# status and source when it does not know them.
+#
+# Usage: crush_data_crawler/sqlite_warehouse.py <data_root> <database>
+# loads every stage 1 table of a data root the way the combined dataset reads them, e.g. for a data root built before
+# --sqlite was used. Needs SQLite 3.24 or later for upserts, as bundled with Python 3.9.
+
+import logging
+import math
+import os
+import sqlite3
+import sys
+from build_manifest import BuildManifest
+from cell_values import STATUS_NAMES
+from instrumentation import configure_logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "crush_data_reshape"))
+from reshape_total import read_parquet_dataset, read_stage1_variable, STAGE1_VARIABLES, DISTRICT_COLUMNS, \
+    DISTRICT_NAMES, STATUS_COLUMNS, VARIETY, CATEGORY, YEAR
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS variables (
+    variable_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    unit TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS districts (
+    district_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS varieties (
+    variety_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    category TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS statuses (
+    status_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS observations (
+    variable_id INTEGER NOT NULL REFERENCES variables,
+    variety_id INTEGER NOT NULL REFERENCES varieties,
+    district_id INTEGER NOT NULL REFERENCES districts,
+    year INTEGER NOT NULL,
+    value REAL,
+    status INTEGER REFERENCES statuses,
+    source_sha256 TEXT,
+    PRIMARY KEY (variable_id, variety_id, district_id, year)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS observations_by_variable_year
+    ON observations (variable_id, year, district_id, variety_id, value);
+CREATE VIEW IF NOT EXISTS observation_values AS
+    SELECT variables.name AS variable, observations.year, districts.name AS district, varieties.name AS variety,
+           varieties.category, observations.value, variables.unit, statuses.name AS status, observations.source_sha256
+    FROM observations
+    JOIN variables USING (variable_id)
+    JOIN districts USING (district_id)
+    JOIN varieties USING (variety_id)
+    LEFT JOIN statuses ON statuses.status_id = observations.status;
+"""
+UPSERT_OBSERVATION = """
+INSERT INTO observations (variable_id, variety_id, district_id, year, value, status, source_sha256)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (variable_id, variety_id, district_id, year) DO UPDATE SET
+    value = excluded.value,
+    status = COALESCE(excluded.status, observations.status),
+    source_sha256 = COALESCE(excluded.source_sha256, observations.source_sha256)
+"""
+INSERT_VARIABLE = "INSERT INTO variables (name, unit) VALUES (?, ?) " \
+                  "ON CONFLICT (name) DO UPDATE SET unit = excluded.unit"
+INSERT_STATUS = "INSERT INTO statuses (status_id, name) VALUES (?, ?) " \
+                "ON CONFLICT (status_id) DO UPDATE SET name = excluded.name"
+INSERT_VARIETY = "INSERT INTO varieties (name, category) VALUES (?, ?) ON CONFLICT (name) DO NOTHING"
+# (variety, district) pairs of the batch being upserted, rows of the same table and year outside it are deleted
+CREATE_BATCH = """
+CREATE TEMP TABLE IF NOT EXISTS batch (
+    variety_id INTEGER NOT NULL,
+    district_id INTEGER NOT NULL,
+    PRIMARY KEY (variety_id, district_id)
+) WITHOUT ROWID
+"""
+DELETE_OUTSIDE_BATCH = """
+DELETE FROM observations
+WHERE variable_id = ? AND year = ? AND NOT EXISTS (
+    SELECT 1 FROM batch
+    WHERE batch.variety_id = observations.variety_id AND batch.district_id = observations.district_id
+)
+"""
+# Stage 1 district column -> district name in the combined dataset
+DISTRICT_NAME_BY_COLUMN = dict(zip(DISTRICT_COLUMNS, DISTRICT_NAMES))
+# status name as in the combined dataset -> status code
+STATUS_CODE_BY_NAME = {name: code for code, name in enumerate(STATUS_NAMES)}
+
+
+class SQLiteWarehouse:
+    def __init__(self, filename):
+        self.filename = filename
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(filename)
+        # readers are not blocked while a crawler writes
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+        self.connection.execute(CREATE_BATCH)
+        with self.connection:
+            self.connection.executemany(INSERT_VARIABLE, [(variable, unit) for _, unit, variable in STAGE1_VARIABLES])
+            self.connection.executemany("INSERT INTO districts (name) VALUES (?) ON CONFLICT (name) DO NOTHING",
+                                        [(name,) for name in DISTRICT_NAMES])
+            self.connection.executemany(INSERT_STATUS, list(enumerate(STATUS_NAMES)))
+        variable_ids = dict(self.connection.execute("SELECT name, variable_id FROM variables"))
+        # stage 1 table, e.g. Volume or Acreage/bearing -> variable id
+        self.variable_ids = {stage1_dir: variable_ids[variable] for stage1_dir, _, variable in STAGE1_VARIABLES}
+        self.district_ids = dict(self.connection.execute("SELECT name, district_id FROM districts"))
+        self.variety_ids = dict(self.connection.execute("SELECT name, variety_id FROM varieties"))
+        # varieties added by the transaction in progress, dropped from variety_ids if it rolls back
+        self.uncommitted_varieties = []
+
+    def variety_id(self, variety, category):
+        """
+        :return: id of variety, added with category when it is new, a variety keeps the category it was added with
+        """
+        variety_id = self.variety_ids.get(variety)
+        if variety_id is None:
+            self.connection.execute(INSERT_VARIETY, (variety, category))
+            variety_id = self.connection.execute("SELECT variety_id FROM varieties WHERE name = ?",
+                                                 (variety,)).fetchone()[0]
+            self.variety_ids[variety] = variety_id
+            self.uncommitted_varieties.append(variety)
+        return variety_id
+
+    def upsert_year(self, year, tables):
+        """
+        Upsert every table of a year in one transaction, rows of the same table and year that are not in its
+        observations are deleted
+        :param tables: list of (stage 1 table, source SHA-256 or None if unknown, observations) with observations as a
+        list of (variety, category, district name, value, status code or None), every cell of the table and year
+        :return: number of rows upserted
+        """
+        upserted = 0
+        try:
+            with self.connection:
+                for table, source_sha256, observations in tables:
+                    variable_id = self.variable_ids[table]
+                    rows = [(variable_id, self.variety_id(variety, category), self.district_ids[district], year,
+                             None if math.isnan(value) else value, status, source_sha256)
+                            for variety, category, district, value, status in observations]
+                    self.connection.executemany(UPSERT_OBSERVATION, rows)
+                    self.connection.execute("DELETE FROM batch")
+                    self.connection.executemany("INSERT OR IGNORE INTO batch (variety_id, district_id) VALUES (?, ?)",
+                                                [(row[1], row[2]) for row in rows])
+                    self.connection.execute(DELETE_OUTSIDE_BATCH, (variable_id, year))
+                    upserted += len(observations)
+        except BaseException:
+            # the varieties were rolled back with the rest of the transaction
+            for variety in self.uncommitted_varieties:
+                del self.variety_ids[variety]
+            raise
+        finally:
+            self.uncommitted_varieties = []
+        return upserted
+
+    def close(self):
+        self.connection.close()
+
+
+def year_result_observations(districts, rows, year_result):
+    """
+    :param districts: district columns and rows as returned by Stage1Writer.rows
+    :return: observations of every present cell of year_result for SQLiteWarehouse.upsert_year
+    """
+    district_names = [DISTRICT_NAME_BY_COLUMN[district] for district in districts]
+    observations = []
+    for variety, category, row in rows:
+        for column in year_result.present[row].nonzero()[0].tolist():
+            observations.append((variety, category, district_names[column], float(year_result.values[row, column]),
+                                 int(year_result.status[row, column])))
+    return observations
+
+
+def load_data_root(warehouse, data_root):
+    """
+    Upsert every cell of every stage 1 table of data_root as read for the combined dataset, derived rows included, one
+    transaction per table and year, rows keep their status when the data root does not record it and their source
+    when the build manifest does not know it
+    :return: number of rows upserted
+    """
+    manifest = BuildManifest(data_root)
+    parquet_dataset = read_parquet_dataset(data_root)
+    upserted = 0
+    for stage1_dir, _, _ in STAGE1_VARIABLES:
+        wide = read_stage1_variable(data_root, stage1_dir, parquet_dataset)
+        if wide is None:
+            continue
+        for year, wide_this_year in wide.groupby(YEAR, sort=True):
+            year = int(year)
+            statuses = wide_this_year[STATUS_COLUMNS].to_numpy(dtype=object)
+            observations = [(variety, category, district, value, STATUS_CODE_BY_NAME.get(status))
+                            for variety, category, values, row_statuses in zip(
+                                wide_this_year[VARIETY], wide_this_year[CATEGORY],
+                                wide_this_year[DISTRICT_NAMES].to_numpy(dtype=float), statuses)
+                            for district, value, status in zip(DISTRICT_NAMES, values.tolist(), row_statuses)]
+            source_sha256 = manifest.archive_sha256(stage1_dir, year)
+            upserted += warehouse.upsert_year(year, [(stage1_dir, source_sha256, observations)])
+    return upserted
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Not enough arguments, needed data_root as string and database as string")
+        return 1
+    configure_logging("INFO")
+    data_root = str(sys.argv[1])
+    warehouse = SQLiteWarehouse(str(sys.argv[2]))
+    try:
+        logger.info("Upserted %s rows from %s into %s", load_data_root(warehouse, data_root), data_root,
+                    warehouse.filename)
+    finally:
+        warehouse.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Write what the parsers extracted from one year of one stage 1 table, e.g. Volume or Acreage/bearing, in
+# * csv -> <data_root>/<table>/<year>.csv with one row per variety and one column per district, values as "{:.1f}",
+#   and <data_root>/<table>/<year>.status.csv of the same shape telling what the cell of every value held, one of
+#   cell_values.STATUS_NAMES, e.g. "suppressed" for a "--" written as 0.0, empty where the value is empty
+# * parquet -> one partition of a single Parquet dataset <data_root>/Parquet/table=<table>/year=<year>/ with one row
+#   per variety and district, float values, and variety, category and district dictionary encoded. Districts always
+#   use the same dictionary DISTRICTS, so every partition has the same schema and the full history of every table is
+#   loaded with one read, e.g. pd.read_parquet("<data_root>/Parquet"). A status column tells what the cell of every
+#   value held, one of cell_values.STATUS_NAMES, e.g. "suppressed" for a "--" read as 0
+# pyarrow is only needed for parquet
+#
+# Files are first written next to their destination and only replace it when their content changed, so unchanged
+# outputs keep their modification time.
+
+import csv
+import logging
+import os
+import numpy as np
+from variety_matcher import variety_sort_key, UNKNOWN_WINE_CATEGORY
+from cell_values import STATUS_NAMES
+from downloader import file_sha256, PARTIAL_DOWNLOAD_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+CSV_FORMAT = "csv"
+PARQUET_FORMAT = "parquet"
+BOTH_FORMATS = "both"
+OUTPUT_FORMATS = [CSV_FORMAT, PARQUET_FORMAT, BOTH_FORMATS]
+DEFAULT_OUTPUT_FORMAT = CSV_FORMAT
+
+VARIETY_HEADER = "Type and Variety"
+WINE_CATEGORY_HEADER = "Wine Category"
+STATE_DISTRICT = "California"
+# District column names, "1" to "17" for crush districts then the state total
+DISTRICTS = [str(district_id) for district_id in range(1, 18)] + [STATE_DISTRICT]
+
+STATUS_CSV_SUFFIX = ".status.csv"
+PARQUET_DIR = "Parquet"
+PARQUET_FILENAME = "part-0.parquet"
+# Columns of Parquet files, table and year are partition keys stored in directory names
+VARIETY_COLUMN = "variety"
+CATEGORY_COLUMN = "category"
+DISTRICT_COLUMN = "district"
+VALUE_COLUMN = "value"
+STATUS_COLUMN = "status"
+TABLE_PARTITION = "table"
+YEAR_PARTITION = "year"
+
+
+def partition_value(table):
+    """
+    :return: table as a single directory name, e.g. Acreage/bearing -> Acreage_bearing
+    """
+    return table.replace("/", "_")
+
+
+def grape_data_to_rows(year_result, interested_grape_names, total_district_id, all_varieties=False):
+    """
+    :param year_result: YearResult returned by the parsers
+    :param interested_grape_names: OrderedDict of variety -> wine category
+    :param total_district_id: district id the parser uses for the state total
+    :return: (districts, rows), district names of year_result columns, and rows as a list of (variety, wine category,
+    row of year_result) sorted with interested names first
+    """
+    for variety in year_result.varieties:
+        if variety not in interested_grape_names and not all_varieties:
+            raise ValueError("variety {} not found in INTERESTED_GRAPE_NAMES, check your parser step".format(variety))
+    districts = [STATE_DISTRICT if str(district_id) == str(total_district_id) else str(district_id)
+                 for district_id in year_result.districts]
+    rows = [(variety, interested_grape_names.get(variety, UNKNOWN_WINE_CATEGORY), row)
+            for row, variety in enumerate(year_result.varieties)]
+    sort_key = variety_sort_key(interested_grape_names.keys())
+    return districts, sorted(rows, key=lambda row: sort_key(row[0]))
+
+
+def write_csv(csv_filename, districts, rows, year_result):
+    with open(csv_filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow([VARIETY_HEADER, WINE_CATEGORY_HEADER] + districts)
+        for variety, category, row in rows:
+            writer.writerow([variety, category] + ["{:.1f}".format(value) if present else ""
+                                                   for value, present in zip(year_result.values[row].tolist(),
+                                                                             year_result.present[row].tolist())])
+
+
+def write_status_csv(status_csv_filename, districts, rows, year_result):
+    with open(status_csv_filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow([VARIETY_HEADER, WINE_CATEGORY_HEADER] + districts)
+        for variety, category, row in rows:
+            writer.writerow([variety, category] + [STATUS_NAMES[status] if present else ""
+                                                   for status, present in zip(year_result.status[row].tolist(),
+                                                                              year_result.present[row].tolist())])
+
+
+def write_parquet(parquet_filename, districts, rows, year_result):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    district_index = {district: index for index, district in enumerate(DISTRICTS)}
+    for district in districts:
+        if district not in district_index:
+            raise ValueError("district {} is not one of {}".format(district, DISTRICTS))
+    # one Parquet row per present cell, variety by variety in rows order and districts in ascending id order
+    columns = np.argsort(year_result.districts, kind="stable")
+    row_order = np.array([row for _, _, row in rows], dtype=int)
+    row_positions, column_positions = np.nonzero(year_result.present[row_order][:, columns])
+    source_rows = row_order[row_positions]
+    source_columns = columns[column_positions]
+    varieties = np.array([variety for variety, _, _ in rows], dtype=object)
+    categories = np.array([category for _, category, _ in rows], dtype=object)
+    district_indices = np.array([district_index[district] for district in districts], dtype=np.int8)
+    table = pa.table({
+        VARIETY_COLUMN: pa.array(varieties[row_positions], type=pa.string()).dictionary_encode(),
+        CATEGORY_COLUMN: pa.array(categories[row_positions], type=pa.string()).dictionary_encode(),
+        DISTRICT_COLUMN: pa.DictionaryArray.from_arrays(pa.array(district_indices[source_columns], type=pa.int8()),
+                                                        pa.array(DISTRICTS, type=pa.string())),
+        VALUE_COLUMN: pa.array(year_result.values[source_rows, source_columns], type=pa.float64()),
+        STATUS_COLUMN: pa.DictionaryArray.from_arrays(pa.array(year_result.status[source_rows, source_columns],
+                                                               type=pa.int8()),
+                                                      pa.array(STATUS_NAMES, type=pa.string())),
+    })
+    pq.write_table(table, parquet_filename)
+
+
+def partial_filename_of(filename):
+    """
+    :return: where filename is written before replace_if_changed, the leading _ hides it from Parquet dataset readers
+    """
+    return os.path.join(os.path.dirname(filename), "_{}{}".format(os.path.basename(filename), PARTIAL_DOWNLOAD_SUFFIX))
+
+
+def replace_if_changed(partial_filename, filename):
+    """
+    Move partial_filename to filename, unless filename already has the same content
+    :return: SHA-256 of filename
+    """
+    digest = file_sha256(partial_filename)
+    if os.path.exists(filename) and file_sha256(filename) == digest:
+        logger.debug("Unchanged... %s", filename)
+        os.remove(partial_filename)
+        return digest
+    logger.debug("Writing to %s", filename)
+    os.replace(partial_filename, filename)
+    return digest
+
+
+class Stage1Writer:
+    """
+    Write every year of every table of one crawler in the chosen output format
+    """
+
+    def __init__(self, data_root, interested_grape_names, total_district_id, output_format=DEFAULT_OUTPUT_FORMAT,
+                 all_varieties=False):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("Unknown output format {}, expected one of {}".format(output_format, OUTPUT_FORMATS))
+        self.data_root = data_root
+        self.interested_grape_names = interested_grape_names
+        self.total_district_id = total_district_id
+        self.csv_enabled = output_format in (CSV_FORMAT, BOTH_FORMATS)
+        self.parquet_enabled = output_format in (PARQUET_FORMAT, BOTH_FORMATS)
+        self.all_varieties = all_varieties
+        if self.parquet_enabled:
+            # fail before downloading and parsing anything rather than when writing
+            import pyarrow.parquet
+
+    def csv_filename(self, table, year):
+        return os.path.join(self.data_root, table, "{}.csv".format(year))
+
+    def status_csv_filename(self, table, year):
+        return os.path.join(self.data_root, table, "{}{}".format(year, STATUS_CSV_SUFFIX))
+
+    def parquet_filename(self, table, year):
+        return os.path.join(self.data_root, PARQUET_DIR, "{}={}".format(TABLE_PARTITION, partition_value(table)),
+                            "{}={}".format(YEAR_PARTITION, year), PARQUET_FILENAME)
+
+    def output_filenames(self, table, year):
+        """
+        :return: files written for one year of table in the chosen output format
+        """
+        filenames = []
+        if self.csv_enabled:
+            filenames.append(self.csv_filename(table, year))
+            filenames.append(self.status_csv_filename(table, year))
+        if self.parquet_enabled:
+            filenames.append(self.parquet_filename(table, year))
+        return filenames
+
+    def rows(self, year_result):
+        """
+        :return: (districts, rows) of year_result as written, see grape_data_to_rows
+        """
+        return grape_data_to_rows(year_result, self.interested_grape_names, self.total_district_id,
+                                  all_varieties=self.all_varieties)
+
+    def write(self, table, year, year_result):
+        """
+        :param year_result: YearResult of table and year returned by a parser
+        :return: {filename: SHA-256} of every file of table and year in the chosen output format
+        """
+        districts, rows = self.rows(year_result)
+        output_hashes = {}
+        if self.csv_enabled:
+            csv_filename = self.csv_filename(table, year)
+            os.makedirs(os.path.dirname(csv_filename), exist_ok=True)
+            write_csv(partial_filename_of(csv_filename), districts, rows, year_result)
+            output_hashes[csv_filename] = replace_if_changed(partial_filename_of(csv_filename), csv_filename)
+            status_csv_filename = self.status_csv_filename(table, year)
+            write_status_csv(partial_filename_of(status_csv_filename), districts, rows, year_result)
+            output_hashes[status_csv_filename] = replace_if_changed(partial_filename_of(status_csv_filename),
+                                                                    status_csv_filename)
+        if self.parquet_enabled:
+            parquet_filename = self.parquet_filename(table, year)
+            os.makedirs(os.path.dirname(parquet_filename), exist_ok=True)
+            write_parquet(partial_filename_of(parquet_filename), districts, rows, year_result)
+            output_hashes[parquet_filename] = replace_if_changed(partial_filename_of(parquet_filename),
+                                                                 parquet_filename)
+        return output_hashes
@@ -0,0 +1,102 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Match grape variety names in the variety column of USDA sheets, shared by crush_data_crawler_lib.py and
+# 12_acreage.py. All interested names are compiled into a single regex once, and the longest name contained in a cell
+# wins, so "Cabernet Sauvignon" is never taken for a shorter name it contains.
+#
+# In "all varieties" mode every row that has a name and some values is a variety row. Rows whose name is an
+# interested name (ignoring footnote marks) keep the interested name, other rows are named by their normalized text.
+
+import re
+import numpy as np
+
+# Wine category written for varieties that are not in the interested names
+UNKNOWN_WINE_CATEGORY = "na"
+# Footnote marks USDA appends to variety names, e.g. "Zinfandel 1/" or "Symphony*"
+FOOTNOTE_REGEX = re.compile(r"(\s*(\d+/|\*+))+$")
+LETTER_REGEX = re.compile(r"[a-z]")
+BLANK_CELLS = ["", "nan"]
+
+
+def compile_variety_matcher(interested_names):
+    """
+    :param interested_names: lowercase variety names
+    :return: compiled regex finding, at every position of a cell, the longest interested name starting there
+    """
+    alternatives = sorted(interested_names, key=len, reverse=True)
+    return re.compile("(?=({}))".format("|".join(re.escape(name) for name in alternatives)))
+
+
+def longest_match(matcher, cell):
+    """
+    :return: longest interested name contained in cell, the leftmost one if several are as long, or None
+    """
+    longest = None
+    for matched in matcher.finditer(cell):
+        name = matched.group(1)
+        if longest is None or len(name) > len(longest):
+            longest = name
+    return longest
+
+
+def normalize_variety_name(cell):
+    name = re.sub(r"\s+", " ", cell).strip()
+    name = FOOTNOTE_REGEX.sub("", name)
+    return name.strip(" .:")
+
+
+def find_variety(cell, matcher, all_varieties=False):
+    """
+    :param cell: normalized cell from the variety column
+    :return: variety name of this cell, or None if it is not a row of an interested variety (or of any variety in
+    all_varieties mode)
+    """
+    interested_name = longest_match(matcher, cell)
+    if not all_varieties:
+        return interested_name
+    name = normalize_variety_name(cell)
+    if name in BLANK_CELLS or LETTER_REGEX.search(name) is None:
+        return None
+    if interested_name is not None and LETTER_REGEX.search(name.replace(interested_name, "", 1)) is None:
+        return interested_name
+    return name
+
+
+def match_varieties(column_cells, matcher, all_varieties=False, row_has_values=None):
+    """
+    Find the variety of every row below a header, each distinct cell is matched once
+    :param column_cells: 1D array of normalized cells of the variety column, starting from the header row
+    :param row_has_values: 1D bool array, whether each row has any value right of the variety column, only used in
+    all_varieties mode to skip section titles and notes
+    :return: list of variety name or None for each cell
+    """
+    if len(column_cells) == 0:
+        return []
+    unique_cells, inverse = np.unique(column_cells, return_inverse=True)
+    unique_varieties = [find_variety(cell, matcher, all_varieties=all_varieties) for cell in unique_cells.tolist()]
+    varieties = [unique_varieties[index] for index in inverse.ravel().tolist()]
+    if all_varieties:
+        # the header row itself is never a variety row
+        varieties[0] = None
+        if row_has_values is not None:
+            varieties = [variety if has_values else None for variety, has_values in zip(varieties, row_has_values)]
+    return varieties
+
+
+def rows_with_values(cells):
+    """
+    :param cells: 2D array of normalized cells right of the variety column
+    :return: 1D bool array, whether each row has any non blank cell
+    """
+    if cells.shape[1] == 0:
+        return np.zeros(cells.shape[0], dtype=bool)
+    return ~np.isin(np.char.strip(cells), BLANK_CELLS).all(axis=1)
+
+
+def variety_sort_key(interested_names):
+    """
+    :return: sort key putting interested names first in their own order, then other varieties alphabetically
+    """
+    order = {name: index for index, name in enumerate(interested_names)}
+    return lambda name: (order.get(name, len(order)), name)
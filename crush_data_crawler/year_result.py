@@ -0,0 +1,91 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# What the parsers extract from one table of one year, kept as two arrays instead of a dict of lists of tuples
+# * values -> float64 array of varieties x districts, NaN where the cell was empty
+# * present -> bool array of the same shape, False where the table has no such district for the variety
+# * status -> int8 array of the same shape, what the cell held as a cell_values.py status code, BLANK where not present
+# varieties keep the order the parser found them in, and districts the order they first appear in, as the CSV columns.
+# A year of all varieties of a table is a few kilobytes that pickle in one piece between processes, and is dropped as
+# soon as it is written.
+
+from collections import defaultdict
+import numpy as np
+from cell_values import NUMERIC, ZERO, BLANK
+
+
+class YearResult:
+    def __init__(self, varieties, districts, values, present, status=None):
+        """
+        :param varieties: variety names, one per row
+        :param districts: district ids, one per column
+        :param status: status codes, None to derive them from values
+        """
+        self.varieties = list(varieties)
+        self.districts = list(districts)
+        self.values = values
+        self.present = present
+        if status is None:
+            status = np.where(values == 0, ZERO, NUMERIC).astype(np.int8)
+            status[np.isnan(values) | ~present] = BLANK
+        self.status = status
+
+    @classmethod
+    def from_grape_data(cls, grape_data):
+        """
+        :param grape_data: {variety: [(district id, value, status)]} as collected by the parsers, the last value of a
+        district wins when a variety has it twice, status can be left out to derive it from the value
+        """
+        districts = []
+        district_columns = {}
+        for entries in grape_data.values():
+            for entry in entries:
+                if entry[0] not in district_columns:
+                    district_columns[entry[0]] = len(districts)
+                    districts.append(entry[0])
+        values = np.full((len(grape_data), len(districts)), np.nan)
+        present = np.zeros((len(grape_data), len(districts)), dtype=bool)
+        status = np.full((len(grape_data), len(districts)), BLANK, dtype=np.int8)
+        derive_status = False
+        for row, entries in enumerate(grape_data.values()):
+            for entry in entries:
+                column = district_columns[entry[0]]
+                values[row, column] = entry[1]
+                present[row, column] = True
+                if len(entry) > 2:
+                    status[row, column] = entry[2]
+                else:
+                    derive_status = True
+        return cls(grape_data.keys(), districts, values, present, None if derive_status else status)
+
+    def __len__(self):
+        return len(self.varieties)
+
+    def pairs(self, row):
+        """
+        :return: [(district id, value)] of a row in ascending district order, as the parsers sort them
+        """
+        columns = sorted(np.flatnonzero(self.present[row]), key=lambda column: self.districts[column])
+        return [(self.districts[column], float(self.values[row, column])) for column in columns]
+
+    def to_grape_data(self):
+        """
+        :return: {variety: [(district id, value)]}
+        """
+        return defaultdict(list, {variety: self.pairs(row) for row, variety in enumerate(self.varieties)})
+
+    def encode(self):
+        """
+        :return: JSON serializable copy, absent values as None
+        """
+        return {"varieties": self.varieties, "districts": self.districts,
+                "values": np.where(self.present, self.values, None).tolist(), "status": self.status.tolist()}
+
+    @classmethod
+    def decode(cls, encoded):
+        values = np.array(encoded["values"], dtype=float).reshape(len(encoded["varieties"]),
+                                                                  len(encoded["districts"]))
+        present = np.array([[value is not None for value in row] for row in encoded["values"]],
+                           dtype=bool).reshape(values.shape)
+        status = np.array(encoded["status"], dtype=np.int8).reshape(values.shape)
+        return cls(encoded["varieties"], encoded["districts"], values, present, status)
@@ -0,0 +1,163 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Compute once per build the numbers charts derive from the combined dataset, for every year, district and variety at
+# once, so that they are looked up instead of recomputed with pandas for every request. The result is a
+# GrapeDataStore whose variables are metrics:
+# * every stage 1 variable, with one "<category> subtotal" variety per wine category added, e.g. "red subtotal", the
+#   sum of the varieties of that category for volumes and acreage, and their average weighted by tons for price and
+#   degree brix (tonnage-weighted price)
+# * crush value, price times crushed volume in $, summed into category subtotals
+# * "<variable> share of state", the district value divided by the California value, for volumes, acreage and crush
+#   value
+# * "<variable> year over year change", (value - value of the previous year) / value of the previous year, NaN when the
+#   previous year is missing
+# Varieties in category "na", such as USDA's own "total red", are not summed into any subtotal.
+#
+# Usage: crush_data_reshape/grape_aggregates.py <store_directory>
+# reads the cube written by grape_data_store.py and writes the aggregates into <store_directory>/aggregates
+
+import os
+import sys
+import numpy as np
+from grape_data_store import GrapeDataStore
+from reshape_total import DISTRICT_NAMES
+
+AGGREGATES_DIR = "aggregates"
+SUBTOTAL_SUFFIX = " subtotal"
+# Varieties of this category are totals published by USDA, or varieties without a known category
+NO_CATEGORY = "na"
+
+PRICE = "price"
+CRUSHED_VOLUME = "crushed volume"
+CRUSH_VALUE = "crush value"
+CRUSH_VALUE_UNIT = "$"
+# Variables summed over varieties and districts
+ADDITIVE_VARIABLES = ["crushed volume", "purchased volume", "bearing acreage", "non-bearing acreage", "total acreage",
+                      CRUSH_VALUE]
+# Averages -> variable of the tons they are averaged over
+WEIGHTED_VARIABLES = {
+    PRICE: "purchased volume",
+    "average brix purchased": "purchased volume",
+    "average brix crushed": "crushed volume",
+}
+SHARE_SUFFIX = " share of state"
+SHARE_UNIT = "fraction of California"
+CHANGE_SUFFIX = " year over year change"
+CHANGE_UNIT = "fraction of previous year"
+STATE_DISTRICT = DISTRICT_NAMES[-1]
+
+
+def category_membership(categories):
+    """
+    :return: (wine categories with a subtotal, boolean array varieties x categories)
+    """
+    subtotal_categories = sorted({category for category in categories if category != NO_CATEGORY})
+    membership = np.array([[category == subtotal_category for subtotal_category in subtotal_categories]
+                           for category in categories], dtype=bool).reshape(len(categories), len(subtotal_categories))
+    return subtotal_categories, membership
+
+
+def subtotal(values, membership):
+    """
+    :param values: array of (..., varieties)
+    :return: sum over the varieties of each category, (..., categories), NaN when no variety has a value
+    """
+    present = ~np.isnan(values)
+    totals = np.where(present, values, 0.0) @ membership
+    counts = present.astype(float) @ membership
+    totals[counts == 0] = np.nan
+    return totals
+
+
+def weighted_subtotal(values, weights, membership):
+    """
+    :return: average of values over the varieties of each category weighted by weights, NaN without any weight
+    """
+    present = ~np.isnan(values) & ~np.isnan(weights)
+    weighted_sums = np.where(present, values * weights, 0.0) @ membership
+    weight_sums = np.where(present, weights, 0.0) @ membership
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(weight_sums > 0, weighted_sums / weight_sums, np.nan)
+
+
+def year_over_year_change(values, years):
+    """
+    :param values: array of (years, ...)
+    :return: change from the previous year, NaN for the first year and after a missing year
+    """
+    change = np.full(values.shape, np.nan)
+    consecutive = np.flatnonzero(np.diff(years) == 1) + 1
+    previous = values[consecutive - 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change[consecutive] = np.where(previous != 0, (values[consecutive] - previous) / previous, np.nan)
+    return change
+
+
+def build_aggregates(store):
+    """
+    :param store: GrapeDataStore of the stage 1 tables
+    :return: GrapeDataStore of every metric, see the top of this file
+    """
+    variables = list(store.labels["variable"])
+    units = list(store.units)
+    values = np.asarray(store.values, dtype=float)
+    if PRICE in variables and CRUSHED_VOLUME in variables:
+        crush_value = values[variables.index(PRICE)] * values[variables.index(CRUSHED_VOLUME)]
+        values = np.concatenate([values, crush_value[np.newaxis]])
+        variables.append(CRUSH_VALUE)
+        units.append(CRUSH_VALUE_UNIT)
+    subtotal_categories, membership = category_membership(store.categories)
+    subtotals = np.full(values.shape[:3] + (len(subtotal_categories),), np.nan)
+    for variable_code, variable in enumerate(variables):
+        if variable in ADDITIVE_VARIABLES:
+            subtotals[variable_code] = subtotal(values[variable_code], membership)
+        elif variable in WEIGHTED_VARIABLES and WEIGHTED_VARIABLES[variable] in variables:
+            subtotals[variable_code] = weighted_subtotal(values[variable_code],
+                                                         values[variables.index(WEIGHTED_VARIABLES[variable])],
+                                                         membership)
+    metrics = [np.concatenate([values, subtotals], axis=3)]
+    metric_names = list(variables)
+    metric_units = list(units)
+    state_code = store.code("district", STATE_DISTRICT)
+    for variable_code, variable in enumerate(variables):
+        if variable not in ADDITIVE_VARIABLES:
+            continue
+        with np.errstate(divide="ignore", invalid="ignore"):
+            share = metrics[0][variable_code] / metrics[0][variable_code][:, state_code:state_code + 1, :]
+        metrics.append(share[np.newaxis])
+        metric_names.append(variable + SHARE_SUFFIX)
+        metric_units.append(SHARE_UNIT)
+    years = np.array(store.labels["year"])
+    for variable_code, variable in enumerate(variables):
+        metrics.append(year_over_year_change(metrics[0][variable_code], years)[np.newaxis])
+        metric_names.append(variable + CHANGE_SUFFIX)
+        metric_units.append(CHANGE_UNIT)
+    return GrapeDataStore(np.concatenate(metrics), metric_names, metric_units, store.labels["year"],
+                          store.labels["variety"] + [category + SUBTOTAL_SUFFIX for category in subtotal_categories],
+                          store.categories + subtotal_categories)
+
+
+def write_aggregates(store, store_directory):
+    """
+    :return: directory the aggregates were saved into
+    """
+    directory = os.path.join(store_directory, AGGREGATES_DIR)
+    aggregates = build_aggregates(store)
+    print("Writing {} metrics to {}".format(len(aggregates.labels["variable"]), directory))
+    aggregates.save(directory)
+    return directory
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Not enough arguments, needed store directory as string")
+        return 1
+    store_directory = str(sys.argv[1])
+    write_aggregates(GrapeDataStore.load(store_directory, mmap=False), store_directory)
+    print("Done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
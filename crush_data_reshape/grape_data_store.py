@@ -0,0 +1,217 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Answer lookups such as "Napa Cabernet Sauvignon price from 1995 to 2023" from a dense NumPy cube instead of filtering
+# the long combined dataset row by row. GrapeDataStore holds every stage 1 table read the same way reshape_total.py
+# reads them, "total all varieties" acreage included, as
+#   values[variable, year, district, variety] -> float64, NaN where USDA published nothing
+# with variables in STAGE1_VARIABLES order, years sorted, districts in DISTRICT_NAMES order and varieties in order of
+# first appearance. Every dimension has its labels and a label -> integer code dict, and select() returns views of
+# values, so slicing costs the same whatever the size of the dataset. A second cube of the same shape
+#   status[variable, year, district, variety] -> int8 code of the status of the value in statuses, -1 when unknown
+# tells what USDA published in the cell of every value, e.g. "zero" for 0 tons or "suppressed" for "--" read as 0, see
+# reshape_total.py, and select_status() slices it the same way.
+#
+# save() writes the cubes as values.npy and status.npy plus dimensions.json, and load() memory-maps them read only by
+# default, so any number of processes, e.g. the workers of the visualization backend, share one copy through the page
+# cache.
+#
+# Usage: crush_data_reshape/grape_data_store.py <data_root> <store_directory>
+# e.g. crush_data_reshape/grape_data_store.py ./output/YYYYMMDD ./output/YYYYMMDD/store
+
+import bisect
+import json
+import os
+import sys
+import numpy as np
+from reshape_total import read_parquet_dataset, read_stage1_variable, STAGE1_VARIABLES, DISTRICT_NAMES, VARIETY, \
+    CATEGORY, YEAR, VARIABLE, DISTRICT, STATUS_COLUMNS
+
+# Directory under a data root build_all.py saves the store into
+STORE_DIR = "store"
+VALUES_FILENAME = "values.npy"
+STATUS_FILENAME = "status.npy"
+UNKNOWN_STATUS = -1
+DIMENSIONS_FILENAME = "dimensions.json"
+PARTIAL_SUFFIX = ".part"
+# Dimensions of values, in axis order
+DIMENSIONS = [VARIABLE, YEAR, DISTRICT, VARIETY]
+
+
+class GrapeDataStore:
+    def __init__(self, values, variables, units, years, varieties, categories, status=None, statuses=None):
+        """
+        :param values: float array shaped (variables, years, districts, varieties)
+        :param units: unit of every variable
+        :param categories: wine category of every variety
+        :param status: int8 array shaped as values of codes in statuses, UNKNOWN_STATUS when unknown, or None
+        :param statuses: status names
+        """
+        self.values = values
+        self.status = status
+        self.statuses = list(statuses or [])
+        self.labels = {VARIABLE: list(variables), YEAR: list(years), DISTRICT: list(DISTRICT_NAMES),
+                       VARIETY: list(varieties)}
+        self.codes = {dimension: {label: code for code, label in enumerate(labels)}
+                      for dimension, labels in self.labels.items()}
+        self.units = list(units)
+        self.categories = list(categories)
+        if values.shape != tuple(len(self.labels[dimension]) for dimension in DIMENSIONS):
+            raise ValueError("Shape {} does not match dimensions {}".format(
+                values.shape, [len(self.labels[dimension]) for dimension in DIMENSIONS]))
+        if status is not None and status.shape != values.shape:
+            raise ValueError("Status shape {} does not match values shape {}".format(status.shape, values.shape))
+
+    @classmethod
+    def from_data_root(cls, data_root):
+        """
+        Read every stage 1 table under data_root, from its Parquet dataset when there is one
+        """
+        parquet_dataset = read_parquet_dataset(data_root)
+        wide_by_variable = []
+        for stage1_dir, unit, variable in STAGE1_VARIABLES:
+            wide = read_stage1_variable(data_root, stage1_dir, parquet_dataset)
+            if wide is None:
+                print("No data found for {}, skipping".format(stage1_dir))
+                continue
+            wide_by_variable.append((variable, unit, wide))
+        if len(wide_by_variable) == 0:
+            raise RuntimeError("No stage 1 data found in {}".format(data_root))
+        years = sorted({int(year) for _, _, wide in wide_by_variable for year in wide[YEAR].unique()})
+        # variety -> category of its first appearance
+        category_by_variety = {}
+        for _, _, wide in wide_by_variable:
+            for variety, category in zip(wide[VARIETY], wide[CATEGORY]):
+                category_by_variety.setdefault(variety, category)
+        varieties = list(category_by_variety)
+        year_codes = {year: code for code, year in enumerate(years)}
+        variety_codes = {variety: code for code, variety in enumerate(varieties)}
+        statuses = sorted({status for _, _, wide in wide_by_variable
+                           for status in np.unique(wide[STATUS_COLUMNS].dropna(how="all").stack().astype(str))})
+        status_codes = {status: code for code, status in enumerate(statuses)}
+        values = np.full((len(wide_by_variable), len(years), len(DISTRICT_NAMES), len(varieties)), np.nan)
+        status = np.full(values.shape, UNKNOWN_STATUS, dtype=np.int8)
+        for variable_code, (_, _, wide) in enumerate(wide_by_variable):
+            rows_year = wide[YEAR].astype(int).map(year_codes).to_numpy()
+            rows_variety = wide[VARIETY].map(variety_codes).to_numpy()
+            # advanced indexes around a slice, each row of the table fills the districts of one (year, variety)
+            values[variable_code, rows_year, :, rows_variety] = wide[DISTRICT_NAMES].to_numpy(dtype=float)
+            status_of_rows = wide[STATUS_COLUMNS].apply(lambda column: column.map(status_codes))
+            status[variable_code, rows_year, :, rows_variety] = \
+                status_of_rows.fillna(UNKNOWN_STATUS).to_numpy(dtype=np.int8)
+        return cls(values, [variable for variable, _, _ in wide_by_variable],
+                   [unit for _, unit, _ in wide_by_variable], years, varieties,
+                   [category_by_variety[variety] for variety in varieties], status=status, statuses=statuses)
+
+    def code(self, dimension, label):
+        """
+        :return: integer code of label along dimension, raises KeyError for an unknown label
+        """
+        return self.codes[dimension][label]
+
+    def year_range(self, first_year=None, last_year=None):
+        """
+        :return: slice of the year axis from first_year to last_year included, missing bounds are open
+        """
+        years = self.labels[YEAR]
+        begin = 0 if first_year is None else bisect.bisect_left(years, first_year)
+        end = len(years) if last_year is None else bisect.bisect_right(years, last_year)
+        return slice(begin, end)
+
+    def select(self, variable=None, years=None, district=None, variety=None):
+        """
+        Values for labels of each dimension, e.g. select("price", (1995, 2023), "4:Napa", "cabernet sauvignon")
+        :param years: a year, a (first year, last year) range, or None for all years
+        :param variable: label of a variable, or None for all of them, same for district and variety
+        :return: view of values, the dimensions given as a single label are dropped
+        """
+        return self.values[self.index(variable, years, district, variety)]
+
+    def select_status(self, variable=None, years=None, district=None, variety=None):
+        """
+        Status codes for labels of each dimension, as select() slices values, names are in statuses
+        :return: view of status, None if the store has no status
+        """
+        if self.status is None:
+            return None
+        return self.status[self.index(variable, years, district, variety)]
+
+    def index(self, variable=None, years=None, district=None, variety=None):
+        """
+        :return: index of the cubes for labels of each dimension, see select()
+        """
+        if years is None:
+            year_index = slice(None)
+        elif isinstance(years, tuple):
+            year_index = self.year_range(*years)
+        else:
+            year_index = self.code(YEAR, years)
+        return (
+            slice(None) if variable is None else self.code(VARIABLE, variable),
+            year_index,
+            slice(None) if district is None else self.code(DISTRICT, district),
+            slice(None) if variety is None else self.code(VARIETY, variety),
+        )
+
+    def years_of(self, years=None):
+        """
+        :return: year labels along the year axis of select(years=years)
+        """
+        if years is None:
+            return list(self.labels[YEAR])
+        if isinstance(years, tuple):
+            return self.labels[YEAR][self.year_range(*years)]
+        return [years]
+
+    def save(self, directory):
+        """
+        Write values.npy, status.npy when there is a status and dimensions.json into directory, each replacing the
+        previous one once complete
+        """
+        os.makedirs(directory, exist_ok=True)
+        for filename, cube in [(VALUES_FILENAME, self.values), (STATUS_FILENAME, self.status)]:
+            filename = os.path.join(directory, filename)
+            if cube is None:
+                if os.path.exists(filename):
+                    os.remove(filename)
+                continue
+            with open(filename + PARTIAL_SUFFIX, "wb") as cube_file:
+                np.save(cube_file, np.ascontiguousarray(cube))
+            os.replace(filename + PARTIAL_SUFFIX, filename)
+        dimensions_filename = os.path.join(directory, DIMENSIONS_FILENAME)
+        with open(dimensions_filename + PARTIAL_SUFFIX, "w") as dimensions_file:
+            json.dump({"labels": self.labels, "units": self.units, "categories": self.categories,
+                       "statuses": self.statuses}, dimensions_file, indent=2)
+        os.replace(dimensions_filename + PARTIAL_SUFFIX, dimensions_filename)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        :param mmap: memory-map values and status read only, False to read them into memory
+        """
+        with open(os.path.join(directory, DIMENSIONS_FILENAME)) as dimensions_file:
+            dimensions = json.load(dimensions_file)
+        values = np.load(os.path.join(directory, VALUES_FILENAME), mmap_mode="r" if mmap else None)
+        status = None
+        if os.path.exists(os.path.join(directory, STATUS_FILENAME)):
+            status = np.load(os.path.join(directory, STATUS_FILENAME), mmap_mode="r" if mmap else None)
+        labels = dimensions["labels"]
+        return cls(values, labels[VARIABLE], dimensions["units"], labels[YEAR], labels[VARIETY],
+                   dimensions["categories"], status=status, statuses=dimensions.get("statuses"))
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Not enough arguments, needed data_root as string and store directory as string")
+        return 1
+    data_root = str(sys.argv[1])
+    directory = str(sys.argv[2])
+    store = GrapeDataStore.from_data_root(data_root)
+    print("Writing {} cube to {}".format(" x ".join(str(size) for size in store.values.shape), directory))
+    store.save(directory)
+    print("Done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Stage 2 in Python, replaces reshape_total.R
+# Read every stage 1 CSV file under a data root, add "total all varieties" to acreage data, and flatten everything into
+# one long table with variety, category, district, value, unit, year, variable and status columns, written as an Excel
+# file. Years are discovered from the CSV files on disk. When stage 1 also wrote a Parquet dataset under
+# <data_root>/Parquet, every table found in it is loaded from that single dataset instead of its CSV files, which needs
+# pyarrow. The status of a value tells what USDA published in its cell, e.g. "zero" for 0 tons and "suppressed" for
+# "--", see crush_data_crawler/cell_values.py, read from the status column of the Parquet dataset or the
+# <year>.status.csv file next to each CSV file. It is empty for derived rows and stage 1 outputs written without it.
+#
+# Usage: crush_data_reshape/reshape_total.py <data_root> <output_filename>
+# e.g. crush_data_reshape/reshape_total.py ./output/YYYYMMDD YYYYMMDD.xlsx writes ./output/YYYYMMDD/YYYYMMDD.xlsx
+
+import os
+import re
+import sys
+import pandas as pd
+
+# Mapping district indices to display names of California wine crush districts
+DISTRICT_NAMES = [
+    "1:Mendocino",
+    "2:Lake",
+    "3:Sonoma/Marin",  # "3:Sonoma",
+    "4:Napa",
+    "5:Solano",
+    "6:Bay Area",
+    "7:Monterey/S. Ben",  # "7:Monterey",
+    "8:S. Barbara/SLO/Ven",  # "8:Santa Barbara",
+    "9:North",
+    "10:Sierra Foothills",  # "10:Sierra",
+    "11:Sacramento/S. Jqn",  # "11:Sacramento",
+    "12:Merced/Stan./S. Jqn",  # "12:Stanislaus",
+    "13:Fresno+",  # "13:Fresno",
+    "14:Kern+",  # "14:Kern",
+    "15:Los Angeles/S. Ber",  # "15:Los Angeles",
+    "16:South",
+    "17:Yolo",
+    "California",
+]
+# Column names of districts in stage 1 CSV files, in DISTRICT_NAMES order
+DISTRICT_COLUMNS = [str(district_id) for district_id in range(1, len(DISTRICT_NAMES))] + ["California"]
+# Columns of stage 1 frames holding the status of the value of every district, in DISTRICT_NAMES order
+STATUS_COLUMNS = ["{} status".format(district) for district in DISTRICT_NAMES]
+
+# (stage 1 directory, unit, variable) in the order they appear in the combined dataset
+STAGE1_VARIABLES = [
+    ("Price", "$/ton", "price"),
+    ("Volume", "tons", "crushed volume"),
+    ("PurchasedVolume", "tons", "purchased volume"),
+    ("PurchasedDegreeBrix", "degree brix", "average brix purchased"),
+    ("DegreeBrix", "degree brix", "average brix crushed"),
+    ("Acreage/bearing", "acres", "bearing acreage"),
+    ("Acreage/non_bearing", "acres", "non-bearing acreage"),
+    ("Acreage/total", "acres", "total acreage"),
+]
+ACREAGE_DIR = "Acreage"
+TOTAL_ALL_VARIETIES = "total all varieties"
+# Rows summed into TOTAL_ALL_VARIETIES, total raisin is only published in some years
+ACREAGE_TOTAL_ROWS = ["total raisin", "total wine", "total table"]
+
+VARIETY = "variety"
+CATEGORY = "category"
+DISTRICT = "district"
+VALUE = "value"
+UNIT = "unit"
+YEAR = "year"
+VARIABLE = "variable"
+STATUS = "status"
+COMBINED_COLUMNS = [VARIETY, CATEGORY, DISTRICT, VALUE, UNIT, YEAR, VARIABLE, STATUS]
+
+STAGE1_CSV_REGEX = r"^(?P<year>[0-9]{4})\.csv$"
+STATUS_CSV_SUFFIX = ".status.csv"
+# Stage 1 Parquet dataset, see crush_data_crawler/stage1_writer.py
+PARQUET_DIR = "Parquet"
+TABLE_PARTITION = "table"
+
+
+def discover_years(directory):
+    """
+    :return: sorted years of YYYY.csv files in directory, empty if directory does not exist
+    """
+    if not os.path.isdir(directory):
+        return []
+    years = []
+    for filename in os.listdir(directory):
+        matched = re.match(STAGE1_CSV_REGEX, filename)
+        if matched is not None:
+            years.append(int(matched.group("year")))
+    return sorted(years)
+
+
+def read_stage1_csv(csv_filename):
+    """
+    :return: DataFrame with variety, category, one column per DISTRICT_NAMES and one per STATUS_COLUMNS, districts
+    missing from the file are NaN, statuses are NaN without its <year>.status.csv file
+    """
+    stage1 = pd.read_csv(csv_filename, dtype={0: str, 1: str})
+    stage1 = stage1.rename(columns={stage1.columns[0]: VARIETY, stage1.columns[1]: CATEGORY})
+    stage1 = stage1.rename(columns=dict(zip(DISTRICT_COLUMNS, DISTRICT_NAMES)))
+    stage1 = stage1.reindex(columns=[VARIETY, CATEGORY] + DISTRICT_NAMES)
+    status_csv_filename = csv_filename[:-len(".csv")] + STATUS_CSV_SUFFIX
+    if not os.path.exists(status_csv_filename):
+        return stage1.reindex(columns=[VARIETY, CATEGORY] + DISTRICT_NAMES + STATUS_COLUMNS)
+    status = pd.read_csv(status_csv_filename, dtype=str, keep_default_na=False)
+    if status.iloc[:, 0].tolist() != stage1[VARIETY].tolist():
+        raise ValueError("{} does not have the varieties of {}".format(status_csv_filename, csv_filename))
+    status = status.rename(columns=dict(zip(DISTRICT_COLUMNS, STATUS_COLUMNS)))
+    status = status.reindex(columns=STATUS_COLUMNS).replace("", float("nan"))
+    return pd.concat([stage1, status], axis=1)
+
+
+def add_total_variety_to_acreage_data(acreage):
+    """
+    :param acreage: DataFrame returned by read_stage1_csv for one year of acreage data
+    :return: acreage with a TOTAL_ALL_VARIETIES row appended, the sum of ACREAGE_TOTAL_ROWS available this year,
+    without status
+    """
+    by_variety = acreage.set_index(VARIETY)
+    total_rows = [row for row in ACREAGE_TOTAL_ROWS if row in by_variety.index]
+    if "total wine" not in total_rows or "total table" not in total_rows:
+        raise ValueError("Acreage data needs total wine and total table rows to add {}".format(TOTAL_ALL_VARIETIES))
+    totals = by_variety.loc[total_rows, DISTRICT_NAMES].sum(skipna=False)
+    total_row = pd.DataFrame([[TOTAL_ALL_VARIETIES, "na"] + totals.tolist()], columns=[VARIETY, CATEGORY] + DISTRICT_NAMES)
+    return pd.concat([acreage, total_row], ignore_index=True)
+
+
+def read_parquet_dataset(data_root):
+    """
+    :return: long DataFrame of the whole stage 1 Parquet dataset with variety, category, district, value, status,
+    table and year columns, None if there is no dataset, status is NaN in partitions written without it
+    """
+    directory = os.path.join(data_root, PARQUET_DIR)
+    if not os.path.isdir(directory):
+        return None
+    dataset = pd.read_parquet(directory, engine="pyarrow")
+    for column in [VARIETY, CATEGORY, DISTRICT, TABLE_PARTITION]:
+        dataset[column] = dataset[column].astype(str)
+    if STATUS not in dataset.columns:
+        dataset[STATUS] = float("nan")
+    dataset[STATUS] = dataset[STATUS].astype(object).where(dataset[STATUS].notna(), float("nan"))
+    dataset[YEAR] = dataset[YEAR].astype(str).astype(int)
+    print("Read {} rows from {}".format(len(dataset), directory))
+    # files are read in path order, rows keep their order inside a file
+    return dataset.sort_values([TABLE_PARTITION, YEAR], kind="stable")
+
+
+def parquet_to_stage1_frames(long):
+    """
+    :param long: rows of one table returned by read_parquet_dataset
+    :return: list of (year, DataFrame shaped as read_stage1_csv returns it) in year order
+    """
+    frames = []
+    for year, long_this_year in long.groupby(YEAR, sort=True):
+        varieties = long_this_year[[VARIETY, CATEGORY]].drop_duplicates()
+        wide = long_this_year.pivot(index=[VARIETY, CATEGORY], columns=DISTRICT, values=VALUE).reset_index()
+        wide = wide.rename(columns=dict(zip(DISTRICT_COLUMNS, DISTRICT_NAMES)))
+        status = long_this_year.pivot(index=[VARIETY, CATEGORY], columns=DISTRICT, values=STATUS).reset_index()
+        status = status.rename(columns=dict(zip(DISTRICT_COLUMNS, STATUS_COLUMNS)))
+        wide = varieties.merge(wide, on=[VARIETY, CATEGORY], how="left")
+        wide = wide.merge(status.reindex(columns=[VARIETY, CATEGORY] + STATUS_COLUMNS), on=[VARIETY, CATEGORY],
+                          how="left")
+        frames.append((year, wide.reindex(columns=[VARIETY, CATEGORY] + DISTRICT_NAMES + STATUS_COLUMNS)))
+    return frames
+
+
+def read_stage1_variable(data_root, stage1_dir, parquet_dataset=None):
+    """
+    :param parquet_dataset: returned by read_parquet_dataset, stage1_dir is read from it when it has this table
+    :return: DataFrame of every year of one stage 1 directory with a year column, None if there is no data
+    """
+    table = stage1_dir.replace("/", "_")
+    if parquet_dataset is not None and (parquet_dataset[TABLE_PARTITION] == table).any():
+        source = "{} table {}".format(PARQUET_DIR, table)
+        stage1_by_year = parquet_to_stage1_frames(parquet_dataset[parquet_dataset[TABLE_PARTITION] == table])
+    else:
+        directory = os.path.join(data_root, stage1_dir)
+        source = directory
+        stage1_by_year = [(year, read_stage1_csv(os.path.join(directory, "{}.csv".format(year))))
+                          for year in discover_years(directory)]
+    if len(stage1_by_year) == 0:
+        return None
+    frames = []
+    for year, stage1 in stage1_by_year:
+        if stage1_dir.startswith(ACREAGE_DIR):
+            stage1 = add_total_variety_to_acreage_data(stage1)
+        stage1[YEAR] = "{}".format(year)
+        frames.append(stage1)
+    print("Read {} from {} to {} from {}".format(stage1_dir, stage1_by_year[0][0], stage1_by_year[-1][0], source))
+    return pd.concat(frames, ignore_index=True)
+
+
+def build_combined_dataset(data_root):
+    """
+    :return: long DataFrame with COMBINED_COLUMNS, ordered by variable, year, district and then variety as in stage 1
+    """
+    parquet_dataset = read_parquet_dataset(data_root)
+    frames = []
+    for variable_index, (stage1_dir, unit, variable) in enumerate(STAGE1_VARIABLES):
+        wide = read_stage1_variable(data_root, stage1_dir, parquet_dataset)
+        if wide is None:
+            print("No data found for {}, skipping".format(stage1_dir))
+            continue
+        wide[UNIT] = unit
+        wide[VARIABLE] = variable
+        wide["variable_order"] = variable_index
+        frames.append(wide)
+    if len(frames) == 0:
+        raise RuntimeError("No stage 1 data found in {}".format(data_root))
+    wide = pd.concat(frames, ignore_index=True)
+    wide["row_order"] = range(len(wide))
+    combined = wide.melt(id_vars=[VARIETY, CATEGORY, UNIT, YEAR, VARIABLE, "variable_order", "row_order"],
+                         value_vars=DISTRICT_NAMES, var_name=DISTRICT, value_name=VALUE)
+    # melted in the same order as the values, district by district
+    combined[STATUS] = wide.melt(id_vars=[VARIETY], value_vars=STATUS_COLUMNS, value_name=STATUS)[STATUS].to_numpy()
+    combined["district_order"] = combined[DISTRICT].map({name: index for index, name in enumerate(DISTRICT_NAMES)})
+    combined = combined.sort_values(["variable_order", YEAR, "district_order", "row_order"], kind="stable")
+    return combined[COMBINED_COLUMNS].reset_index(drop=True)
+
+
+def write_combined_dataset(data_root, output_filename):
+    """
+    :return: path of the Excel file written under data_root
+    """
+    combined = build_combined_dataset(data_root)
+    filename = os.path.join(data_root, output_filename)
+    print("Writing {} rows to {}".format(len(combined), filename))
+    combined.to_excel(filename, index=False)
+    return filename
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Not enough arguments, needed data_root as string and output filename as string")
+        return 1
+    data_root = str(sys.argv[1])
+    output_filename = str(sys.argv[2])
+    write_combined_dataset(data_root, output_filename)
+    print("Done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
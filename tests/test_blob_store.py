@@ -0,0 +1,78 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Check that gc of a blob store shared by several crawls only deletes blobs no snapshot links to, waiting for a crawl
+# between adding a blob and linking it, and that crawls sharing a store keep each other's url index entries.
+#
+# Usage: python3 -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "crush_data_crawler"))
+from blob_store import BlobStore, fcntl
+
+
+class BlobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store_directory = os.path.join(self.directory, "blobs")
+        self.snapshot_directory = os.path.join(self.directory, "snapshot")
+        os.makedirs(self.snapshot_directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write_temporary_file(self, store, content):
+        temporary_filename = store.temporary_filename()
+        with open(temporary_filename, "wb") as temporary_file:
+            temporary_file.write(content)
+        return temporary_filename
+
+    def test_gc_deletes_unreferenced_blobs_only(self):
+        store = BlobStore(self.store_directory)
+        with store.shared_lock():
+            kept = store.add_file(self.write_temporary_file(store, b"linked"))
+            store.link(kept, os.path.join(self.snapshot_directory, "2020.zip"))
+            deleted = store.add_file(self.write_temporary_file(store, b"unreferenced"))
+        store.record_url("https://example.com/2020.zip", {"sha256": kept})
+        store.record_url("https://example.com/2019.zip", {"sha256": deleted})
+        self.assertEqual((1, len(b"unreferenced")), store.gc())
+        self.assertTrue(store.has(kept))
+        self.assertFalse(store.has(deleted))
+        self.assertEqual(["https://example.com/2020.zip"], list(BlobStore(self.store_directory).url_index))
+
+    @unittest.skipIf(fcntl is None, "the store is not locked without fcntl")
+    def test_gc_waits_for_blobs_being_linked(self):
+        store = BlobStore(self.store_directory)
+        results = []
+        with store.shared_lock():
+            sha256 = store.add_file(self.write_temporary_file(store, b"being linked"))
+            gc = threading.Thread(target=lambda: results.append(BlobStore(self.store_directory).gc()))
+            gc.start()
+            gc.join(0.5)
+            # the blob has no hard link yet, gc has to wait until it is linked
+            self.assertTrue(gc.is_alive())
+            store.link(sha256, os.path.join(self.snapshot_directory, "2020.zip"))
+        gc.join()
+        self.assertEqual([(0, 0)], results)
+        self.assertTrue(store.has(sha256))
+
+    def test_crawls_keep_each_other_url_index_entries(self):
+        first = BlobStore(self.store_directory)
+        second = BlobStore(self.store_directory)
+        with first.shared_lock():
+            sha256 = first.add_file(self.write_temporary_file(first, b"archive"))
+            first.link(sha256, os.path.join(self.snapshot_directory, "2020.zip"))
+        first.record_url("https://example.com/2020.zip", {"sha256": sha256})
+        second.record_url("https://example.com/2020-errata.zip", {"sha256": sha256})
+        self.assertEqual(["https://example.com/2020-errata.zip", "https://example.com/2020.zip"],
+                         sorted(BlobStore(self.store_directory).url_index))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Check how download_to_file resumes and refreshes files against a local http.server that answers Range, If-Range,
+# If-None-Match and If-Modified-Since requests the way USDA servers do
+# * an interrupted transfer is resumed with Range and If-Range, and the 206 answer appended after its Content-Range
+#   was checked
+# * a 200 answer to a resume request, as sent when the file changed since the .part file was started, replaces it
+# * a 304 answer to a conditional GET leaves the file on disk untouched
+# * a 416 answer, when the .part file is longer than the file on the server, starts over, still conditional
+#
+# Usage: python3 -m unittest discover tests
+
+import functools
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "crush_data_crawler"))
+from downloader import create_session, download_to_file, load_resume_state, PARTIAL_DOWNLOAD_SUFFIX, \
+    RESUME_STATE_SUFFIX
+
+FILE_PATH = "/2020.zip"
+LAST_MODIFIED = "Wed, 01 Jan 2020 00:00:00 GMT"
+
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    def __init__(self, *args, server_state=None, **kwargs):
+        self.server_state = server_state
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        state = self.server_state
+        state["requests"].append(dict(self.headers))
+        body, etag = state["body"], state["etag"]
+        if self.path != FILE_PATH:
+            self.send_error(404)
+            return
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        status, start = 200, 0
+        range_header = self.headers.get("Range")
+        if range_header is not None and self.headers.get("If-Range") in (None, etag, LAST_MODIFIED):
+            start = int(range_header[len("bytes="):].rstrip("-"))
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{}".format(len(body)))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        content_range = state.pop("content_range", None) or "bytes {}-{}/{}".format(start, len(body) - 1, len(body))
+        part = body[start:]
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.send_header("Content-Length", str(len(part)))
+        if status == 206:
+            self.send_header("Content-Range", content_range)
+        self.end_headers()
+        # the connection is closed after interrupt_after bytes, as if the transfer was cut
+        interrupt_after = state.pop("interrupt_after", None)
+        self.wfile.write(part if interrupt_after is None else part[:interrupt_after])
+        self.wfile.flush()
+
+
+class DownloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "2020.zip")
+        self.partial_filename = self.filename + PARTIAL_DOWNLOAD_SUFFIX
+        self.resume_state_filename = self.partial_filename + RESUME_STATE_SUFFIX
+        self.state = {"body": bytes(range(256)) * 40, "etag": '"v1"', "requests": []}
+        handler = functools.partial(RangeRequestHandler, server_state=self.state)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}{}".format(self.server.server_address[1], FILE_PATH)
+        self.session = create_session()
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def read(self, filename):
+        with open(filename, "rb") as file:
+            return file.read()
+
+    def interrupt_download(self, after):
+        """
+        :return: size of the .part file left by a transfer cut after `after` bytes
+        """
+        self.state["interrupt_after"] = after
+        with self.assertRaises(requests.RequestException):
+            download_to_file(self.session, self.url, self.filename, chunk_size=256)
+        self.assertFalse(os.path.exists(self.filename))
+        return os.path.getsize(self.partial_filename)
+
+    def test_resumes_interrupted_download(self):
+        resume_from = self.interrupt_download(4096)
+        self.assertGreater(resume_from, 0)
+        self.assertEqual({"url": self.url, "etag": '"v1"', "last_modified": LAST_MODIFIED},
+                         load_resume_state(self.resume_state_filename))
+        headers = download_to_file(self.session, self.url, self.filename, chunk_size=256)
+        self.assertEqual("bytes={}-".format(resume_from), self.state["requests"][-1]["Range"])
+        self.assertEqual('"v1"', self.state["requests"][-1]["If-Range"])
+        self.assertEqual("bytes {}-{}/{}".format(resume_from, len(self.state["body"]) - 1, len(self.state["body"])),
+                         headers["Content-Range"])
+        self.assertEqual(self.state["body"], self.read(self.filename))
+        self.assertFalse(os.path.exists(self.partial_filename))
+        self.assertFalse(os.path.exists(self.resume_state_filename))
+
+    def test_refuses_unexpected_content_range(self):
+        self.interrupt_download(4096)
+        self.state["content_range"] = "bytes 0-{}/{}".format(len(self.state["body"]) - 1, len(self.state["body"]))
+        with self.assertRaises(RuntimeError):
+            download_to_file(self.session, self.url, self.filename, chunk_size=256)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_downloads_again_when_resume_is_answered_with_200(self):
+        self.interrupt_download(4096)
+        # the file changed on the server, If-Range does not match anymore
+        self.state["body"], self.state["etag"] = b"changed" * 1000, '"v2"'
+        download_to_file(self.session, self.url, self.filename, chunk_size=256)
+        self.assertIn("Range", self.state["requests"][-1])
+        self.assertEqual(b"changed" * 1000, self.read(self.filename))
+        self.assertFalse(os.path.exists(self.resume_state_filename))
+
+    def test_leaves_file_untouched_when_not_modified(self):
+        headers = download_to_file(self.session, self.url, self.filename)
+        previous_state = {"url": self.url, "etag": headers["ETag"], "last_modified": headers["Last-Modified"]}
+        with open(self.filename, "wb") as file:
+            file.write(b"copy on disk")
+        self.assertIsNone(download_to_file(self.session, self.url, self.filename, previous_state=previous_state))
+        self.assertEqual('"v1"', self.state["requests"][-1]["If-None-Match"])
+        self.assertEqual(LAST_MODIFIED, self.state["requests"][-1]["If-Modified-Since"])
+        self.assertEqual(b"copy on disk", self.read(self.filename))
+
+    def test_starts_over_after_416(self):
+        self.interrupt_download(4096)
+        # the file shrank on the server, keeping its ETag, the .part file is now past its end
+        self.state["body"] = self.state["body"][:1000]
+        download_to_file(self.session, self.url, self.filename, chunk_size=256)
+        self.assertNotIn("Range", self.state["requests"][-1])
+        self.assertEqual(self.state["body"], self.read(self.filename))
+        self.assertFalse(os.path.exists(self.partial_filename))
+
+    def test_starts_over_after_416_with_previous_state(self):
+        with open(self.filename, "wb") as file:
+            file.write(b"copy on disk")
+        with open(self.partial_filename, "wb") as partial_file:
+            partial_file.write(self.state["body"] + b"past the end")
+        with open(self.resume_state_filename, "w") as resume_state_file:
+            json.dump({"url": self.url, "etag": '"v1"'}, resume_state_file)
+        previous_state = {"url": self.url, "etag": '"v1"', "last_modified": LAST_MODIFIED}
+        self.assertIsNone(download_to_file(self.session, self.url, self.filename, previous_state=previous_state))
+        # the retry is still conditional, the copy on disk is the file on the server
+        self.assertEqual('"v1"', self.state["requests"][-1]["If-None-Match"])
+        self.assertEqual(b"copy on disk", self.read(self.filename))
+        self.assertFalse(os.path.exists(self.partial_filename))
+        self.assertFalse(os.path.exists(self.resume_state_filename))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+# Author: Yuhan Wang <onewang@ucdavis.edu>
+# Developed in Python 3.9
+
+# Check that every installed Excel reader backend reads the synthetic workbooks of benchmarks/synthetic_workbooks.py
+# into the same grids, and that both parsers extract the same values from them whichever backend they use, for every
+# layout of both reports, as xls and xlsx files, and with a blank row above the title row. The crush parser drops the
+# first row of the grid where it used to read it as column labels with pd.read_excel(header=0), and discards headers
+# less than 3 rows away from the bottom of the grid, so a backend keeping or dropping one blank row more than another
+# would shift what it parses.
+#
+# Usage: python3 -m unittest discover tests
+
+import importlib
+import math
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+# synthetic_workbooks puts crush_data_crawler on sys.path
+import synthetic_workbooks as synthetic
+from synthetic_workbooks import crush, acreage
+from archive_reader import list_excel_files, open_excel_file
+from excel_reader import open_workbook, available_reader_backends, PANDAS_READER
+from reader_parity import compare_backends
+
+# (year, extension), one year for each era and layout of the synthetic reports
+CRUSH_YEARS = [(1995, "xls"), (2005, "xls"), (2015, "xlsx"), (2015, "xls")]
+ACREAGE_YEARS = [(1994, "xls"), (2000, "xlsx"), (2005, "xls"), (2017, "xlsx"), (2017, "xls"), (2022, "xlsx")]
+NUM_FILLER_VARIETIES = 10
+
+
+def can_write(extension):
+    try:
+        importlib.import_module("xlwt" if extension == "xls" else "openpyxl")
+    except ImportError:
+        return False
+    return True
+
+
+def to_grape_data(year_result):
+    """
+    :return: {variety: [(district id, value, status)]} of a parser result, NaN values as None so that they compare equal
+    """
+    grape_data = {}
+    for row, variety in enumerate(year_result.varieties):
+        columns = sorted(np.flatnonzero(year_result.present[row]), key=lambda column: year_result.districts[column])
+        grape_data[variety] = [(year_result.districts[column], None if math.isnan(year_result.values[row, column])
+                                else float(year_result.values[row, column]), int(year_result.status[row, column]))
+                               for column in columns]
+    return grape_data
+
+
+def same_values(actual, expected):
+    """
+    :param expected: {variety: [(district id, value)]} as generated by synthetic_workbooks
+    """
+    return {variety: [(district, value) for district, value, _ in entries] for variety, entries in actual.items()} == \
+        {variety: [(district, None if math.isnan(value) else value) for district, value in entries]
+         for variety, entries in expected.items()}
+
+
+class ReaderParityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.backends = available_reader_backends()
+        cls.crush_years = []
+        cls.acreage_years = []
+        for leading_blank_rows in [0, 1]:
+            for year, extension in CRUSH_YEARS:
+                if not can_write(extension):
+                    continue
+                directory = os.path.join(cls.directory, "crush_{}_{}_{}".format(year, extension, leading_blank_rows))
+                os.makedirs(directory)
+                path, expected_by_postfix, _ = synthetic.write_crush_year(
+                    directory, year, NUM_FILLER_VARIETIES, extension=extension, leading_blank_rows=leading_blank_rows)
+                cls.crush_years.append((year, extension, leading_blank_rows, path, expected_by_postfix))
+            for year, extension in ACREAGE_YEARS:
+                if not can_write(extension):
+                    continue
+                directory = os.path.join(cls.directory, "acreage_{}_{}_{}".format(year, extension, leading_blank_rows))
+                os.makedirs(directory)
+                path, expected, _ = synthetic.write_acreage_year(
+                    directory, year, NUM_FILLER_VARIETIES, extension=extension, leading_blank_rows=leading_blank_rows)
+                cls.acreage_years.append((year, extension, leading_blank_rows, path, expected))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def test_backends_read_the_same_grids(self):
+        tables = [(path, leading_blank_rows, "gcbtb") for _, _, leading_blank_rows, path, _ in self.crush_years] + \
+            [(path, leading_blank_rows, synthetic.acreage_pattern(year))
+             for year, _, leading_blank_rows, path, _ in self.acreage_years]
+        for path, leading_blank_rows, pattern in tables:
+            for excel_file in list_excel_files(path):
+                with self.subTest(path=path, excel_file=excel_file):
+                    self.assertEqual([], compare_backends(path, excel_file, self.backends))
+                    workbook = open_workbook(open_excel_file(path, excel_file), excel_file, backend=PANDAS_READER)
+                    for sheet in workbook.sheet_names:
+                        if pattern not in excel_file and pattern not in sheet:
+                            continue
+                        grid = workbook.read_grid(sheet)
+                        # the blank rows are kept, the title row is where the parsers expect it
+                        self.assertTrue((grid[:leading_blank_rows] == "").all())
+                        self.assertTrue(grid[leading_blank_rows, 0].startswith("Table "))
+
+    def test_crush_parser_extracts_the_same_values(self):
+        for year, extension, leading_blank_rows, path, expected_by_postfix in self.crush_years:
+            for file_postfix, expected in expected_by_postfix.items():
+                with self.subTest(year=year, extension=extension, leading_blank_rows=leading_blank_rows,
+                                  file_postfix=file_postfix):
+                    results = {backend: to_grape_data(crush.extract_data_from_excel(path, file_postfix,
+                                                                                    reader=backend))
+                               for backend in self.backends}
+                    self.assertTrue(same_values(results[PANDAS_READER], expected))
+                    for backend, result in results.items():
+                        self.assertEqual(results[PANDAS_READER], result, backend)
+
+    def test_acreage_parser_extracts_the_same_values(self):
+        for year, extension, leading_blank_rows, path, expected in self.acreage_years:
+            with self.subTest(year=year, extension=extension, leading_blank_rows=leading_blank_rows):
+                results = {backend: [to_grape_data(type_result) for type_result in
+                                     acreage.extract_data_from_excel(year, path, reader=backend)]
+                           for backend in self.backends}
+                for type_result, type_expected in zip(results[PANDAS_READER], expected):
+                    self.assertTrue(same_values(type_result, type_expected))
+                for backend, result in results.items():
+                    self.assertEqual(results[PANDAS_READER], result, backend)
+
+
+if __name__ == "__main__":
+    unittest.main()